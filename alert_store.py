@@ -0,0 +1,224 @@
+# alert_store.py
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class AlertStore():
+    """
+    Bounded in-memory ring of recent alerts backed by append-only day logs on disk.
+
+    Every alert gets a monotonically increasing seq (the cursor for since= /
+    before= paging) and a received_at epoch; alerts are kept in seq order, which
+    is also received_at order, so the ring is indexed by seq in O(1) and by time
+    with a bisect. A per-patient list of seqs is trimmed from the front as the
+    ring evicts, so inserts are amortized O(1) and memory stays bounded by
+    capacity however long the process runs. Each alert is also appended as one
+    JSON line to <root>/<yyyy-mm-dd>.ndjson; the newest capacity alerts are
+    reloaded from there on restart.
+    """
+
+    def __init__(self, root, capacity=10000, fsync=False):
+        self.root = root
+        self.capacity = capacity
+        self.fsync = fsync
+        self._ring = [None] * capacity
+        self._times = [0.0] * capacity
+        self._start = 0       # ring position of the oldest alert
+        self._count = 0
+        self._next_seq = 1
+        self._by_patient = {}  # patient_id -> [seqs] (from offset _heads[patient_id])
+        self._heads = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_day = None
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    # -------------------------------
+    # Ring
+    # -------------------------------
+    @property
+    def oldest_seq(self):
+        return self._next_seq - self._count
+
+    def _at(self, i):
+        """i-th oldest alert in memory"""
+        return self._ring[(self._start + i) % self.capacity]
+
+    def _time_at(self, i):
+        return self._times[(self._start + i) % self.capacity]
+
+    def _insert(self, alert):
+        if self._count == self.capacity:
+            evicted = self._ring[self._start]
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+            self._evict_from_patient(str(evicted['patient_id']))
+        pos = (self._start + self._count) % self.capacity
+        self._ring[pos] = alert
+        self._times[pos] = alert['received_at']
+        self._count += 1
+        self._next_seq = alert['seq'] + 1
+        self._by_patient.setdefault(str(alert['patient_id']), []).append(alert['seq'])
+        self._heads.setdefault(str(alert['patient_id']), 0)
+
+    def _evict_from_patient(self, patient_id):
+        seqs = self._by_patient[patient_id]
+        head = self._heads[patient_id] + 1
+        if head == len(seqs):
+            del self._by_patient[patient_id], self._heads[patient_id]
+            return
+        if head > 64 and head * 2 > len(seqs):
+            del seqs[:head]
+            head = 0
+        self._heads[patient_id] = head
+
+    # -------------------------------
+    # Writes
+    # -------------------------------
+    def add(self, data, patient_id=None):
+        """Store an alert dict; returns the stored copy with seq / received_at / patient_id set"""
+        with self._lock:
+            received_at = time.time()
+            if self._count:
+                received_at = max(received_at, self._time_at(self._count - 1))  # keep time order if the clock steps back
+            alert = dict(data, seq=self._next_seq, received_at=received_at,
+                         patient_id=str(patient_id or data.get('patient_id') or '00001'))
+            self._append_log(alert)
+            self._insert(alert)
+            return alert
+
+    def replicate(self, alert):
+        """
+        Mirror an alert another worker stored (and logged). Seqs must stay
+        contiguous in the ring, so after a gap (missed messages) the ring is
+        reloaded from the shared day logs instead.
+        """
+        with self._lock:
+            if alert['seq'] < self._next_seq:
+                return
+            if alert['seq'] == self._next_seq:
+                self._insert(alert)
+                return
+            self._ring = [None] * self.capacity
+            self._times = [0.0] * self.capacity
+            self._start = self._count = 0
+            self._by_patient, self._heads = {}, {}
+            self._load()
+
+    def _append_log(self, alert):
+        day = datetime.fromtimestamp(alert['received_at']).strftime('%Y-%m-%d')
+        if day != self._file_day:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(os.path.join(self.root, f'{day}.ndjson'), 'a', encoding='utf-8')
+            self._file_day = day
+        self._file.write(json.dumps(alert, default=str) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _load(self):
+        """Reload the newest capacity alerts from the day logs (torn or malformed lines are skipped)"""
+        lines = []
+        for filename in sorted(os.listdir(self.root), reverse=True):
+            if not filename.endswith('.ndjson'):
+                continue
+            with open(os.path.join(self.root, filename), encoding='utf-8') as f:
+                lines = f.readlines() + lines
+            if len(lines) >= self.capacity:
+                break
+        alerts = []
+        for line in lines:
+            try:
+                alert = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(alert, dict) and isinstance(alert.get('seq'), int):
+                alerts.append(alert)
+        alerts.sort(key=lambda alert: alert['seq'])
+        for alert in alerts[-self.capacity:]:
+            self._insert(alert)
+        if alerts:
+            print(f"🚨 Loaded {min(len(alerts), self.capacity)} alerts from {self.root}")
+
+    # -------------------------------
+    # Queries
+    # -------------------------------
+    def _time_bound(self, t, lo):
+        """First in-memory index at or after lo whose received_at >= t"""
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time_at(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, patient_id=None, since=None, before=None, start=None, end=None, limit=50):
+        """
+        Alerts matching the filters (start / end are epoch seconds, inclusive).
+        With since=<seq> the oldest alerts after the cursor come first (poll for
+        new alerts); otherwise the newest first, optionally before=<seq> (pages
+        back through history). Returns (alerts, next_cursor), where next_cursor
+        is the seq to pass as since / before for the next page, None when done.
+        """
+        with self._lock:
+            oldest = self.oldest_seq
+            # Candidate in-memory index range [lo, hi) from the seq cursors and time bounds
+            lo = 0 if since is None else max(0, since + 1 - oldest)
+            hi = self._count if before is None else max(0, min(self._count, before - oldest))
+            if start is not None:
+                lo = self._time_bound(start, lo)
+            if end is not None:
+                hi = min(hi, self._time_bound(end + 1e-6, lo))
+            if lo >= hi:
+                return [], since
+
+            ascending = since is not None
+            if patient_id is None:
+                indices = range(lo, hi) if ascending else range(hi - 1, lo - 1, -1)
+                alerts = [self._at(i) for i in indices[:limit + 1]]
+            else:
+                seqs = self._by_patient.get(str(patient_id), [])
+                head = self._heads.get(str(patient_id), 0)
+                first = bisect.bisect_left(seqs, lo + oldest, head)
+                last = bisect.bisect_left(seqs, hi + oldest, first)
+                page = seqs[first:min(last, first + limit + 1)] if ascending \
+                    else seqs[max(first, last - limit - 1):last][::-1]
+                alerts = [self._at(seq - oldest) for seq in page]
+
+        more = len(alerts) > limit
+        alerts = alerts[:limit]
+        if ascending:
+            # A poller always keeps the last seq it has seen, even on an empty or final page
+            return alerts, alerts[-1]['seq'] if alerts else since
+        return alerts, alerts[-1]['seq'] if more else None
+
+    def latest(self, n=10):
+        with self._lock:
+            return [self._at(i) for i in range(max(0, self._count - n), self._count)]
+
+    def __len__(self):
+        return self._count
+
+    def stats(self):
+        return {
+            'in_memory': self._count,
+            'capacity': self.capacity,
+            'oldest_seq': self.oldest_seq if self._count else None,
+            'latest_seq': self._next_seq - 1 if self._count else None,
+            'patients': len(self._by_patient),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._file_day = None
@@ -0,0 +1,184 @@
+# anomaly_detector.py
+import bisect
+import threading
+from datetime import datetime
+
+SIGNAL_LABELS = {'heart_rate': 'Heart rate', 'spo2': 'SpO2', 'systolic_pressure': 'Systolic pressure',
+                 'diastolic_pressure': 'Diastolic pressure'}
+# Event times kept per (patient, signal, kind) for the cooldown of late samples
+FIRED_HISTORY = 32
+
+
+def _seconds(time_stamp):
+    """Epoch seconds of a row time stamp (datetime, ISO string or epoch number)"""
+    if isinstance(time_stamp, datetime):
+        return time_stamp.timestamp()
+    if isinstance(time_stamp, (int, float)):
+        return float(time_stamp)
+    return datetime.fromisoformat(str(time_stamp)).timestamp()
+
+
+def pi_vitals_values(vitals):
+    """Flatten a Pi vitals_update payload to {signal: value} (blood_pressure -> systolic / diastolic)"""
+    values = {'heart_rate': vitals.get('heart_rate'), 'spo2': vitals.get('spo2')}
+    bp = vitals.get('blood_pressure') or {}
+    values['systolic_pressure'] = bp.get('systolic')
+    values['diastolic_pressure'] = bp.get('diastolic')
+    return values
+
+
+class AnomalyDetector():
+    """
+    Incremental anomaly detection over ingested samples, per patient and signal.
+
+    Each (patient, signal) keeps a five-slot list: count, EWMA mean, EWMA
+    variance, last value and last time, so a sample costs O(1) time and memory
+    whatever the history. A sample is checked against the signal's rules before
+    it updates the statistics: out of [min, max], rate of change above
+    max_rate per second, and |z| above z_score against the running mean / std
+    once warmup samples were seen. A (patient, signal, kind) that fired stays
+    quiet within cooldown seconds of sample time of its events, before or
+    after them, so a value stuck out of range yields one event, not one per
+    sample, also when the stretch arrives late through a backfill.
+    """
+
+    def __init__(self, rules, alpha=0.05, warmup=30, cooldown=60.0):
+        self.rules = rules
+        self.alpha = alpha
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.samples = 0
+        self.events = 0
+        self.suppressed = 0
+        self._state = {}  # (patient_id, signal) -> [n, mean, var, last_value, last_time]
+        self._fired = {}  # (patient_id, signal, kind) -> sorted sample times of the latest events
+        self._lock = threading.Lock()
+
+    def observe(self, patient_id, values, time_stamp, source='watch'):
+        """Feed one sample ({signal: value}); returns the anomaly events it raised"""
+        t = _seconds(time_stamp)
+        events = []
+        with self._lock:
+            for signal, rule in self.rules.items():
+                value = values.get(signal)
+                if value is None or value == '':
+                    continue
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if value != value:  # NaN
+                    continue
+                self.samples += 1
+                key = (patient_id, signal)
+                state = self._state.get(key)
+                if state is None:
+                    self._state[key] = [1, value, 0.0, value, t]
+                    self._check_range(events, patient_id, signal, rule, value, t)
+                    continue
+                n, mean, var, last_value, last_time = state
+                self._check_range(events, patient_id, signal, rule, value, t)
+                max_rate = rule.get('max_rate')
+                if max_rate is not None and t > last_time:
+                    rate = abs(value - last_value) / max(t - last_time, 1.0)
+                    if rate > max_rate:
+                        self._fire(events, patient_id, signal, 'rate', value, t,
+                                   f"changed {value - last_value:+.1f} in {t - last_time:.0f} s")
+                z_limit = rule.get('z_score')
+                if z_limit is not None and n >= self.warmup:
+                    std = max(var ** 0.5, rule.get('min_std', 0.0))
+                    z = (value - mean) / std if std else 0.0
+                    if abs(z) > z_limit:
+                        self._fire(events, patient_id, signal, 'z_score', value, t,
+                                   f"{z:+.1f} std from its recent mean {mean:.1f}", z=round(z, 2))
+                diff = value - mean
+                increment = self.alpha * diff
+                state[0] = n + 1
+                state[1] = mean + increment
+                state[2] = (1 - self.alpha) * (var + diff * increment)
+                if t >= last_time:
+                    state[3] = value
+                    state[4] = t
+        for event in events:
+            event['source'] = source
+        return events
+
+    def observe_rows(self, patient_id, rows, source='watch'):
+        """observe() every row of an ingest batch"""
+        events = []
+        for row in rows:
+            events.extend(self.observe(patient_id, row, row['time_stamp'], source))
+        return events
+
+    def _check_range(self, events, patient_id, signal, rule, value, t):
+        if rule.get('min') is not None and value < rule['min']:
+            self._fire(events, patient_id, signal, 'low', value, t, f"below {rule['min']:g}")
+        elif rule.get('max') is not None and value > rule['max']:
+            self._fire(events, patient_id, signal, 'high', value, t, f"above {rule['max']:g}")
+
+    def _fire(self, events, patient_id, signal, kind, value, t, detail, **extra):
+        fired = self._fired.setdefault((patient_id, signal, kind), [])
+        i = bisect.bisect_left(fired, t)
+        if (i < len(fired) and fired[i] - t < self.cooldown) or (i and t - fired[i - 1] < self.cooldown):
+            self.suppressed += 1
+            return
+        fired.insert(i, t)
+        if len(fired) > FIRED_HISTORY:
+            del fired[0]
+        self.events += 1
+        label = SIGNAL_LABELS.get(signal, signal.replace('_', ' ').capitalize())
+        events.append(dict({
+            'patient_id': patient_id,
+            'signal': signal,
+            'kind': kind,
+            'value': value,
+            'time_stamp': datetime.fromtimestamp(t).isoformat(sep=' '),
+            'message': f"⚠️ Patient {patient_id}: {label} {round(value, 1):g} ({detail})",
+        }, **extra))
+
+    def baseline(self, patient_id, signal):
+        """{'count', 'mean', 'std', 'last_value'} of a patient's signal, or None"""
+        state = self._state.get((str(patient_id), signal))
+        if state is None:
+            return None
+        return {'count': state[0], 'mean': round(state[1], 2), 'std': round(state[2] ** 0.5, 2),
+                'last_value': state[3]}
+
+    def stats(self):
+        return {
+            'series': len(self._state),
+            'samples': self.samples,
+            'events': self.events,
+            'suppressed': self.suppressed,
+        }
+
+
+# ==================== Benchmark ====================
+if __name__ == '__main__':
+    import random
+    import time
+
+    from config import ANOMALY_RULES
+
+    detector = AnomalyDetector(ANOMALY_RULES)
+    n_patients, n_samples = 500, 200_000
+    start_time = time.time() - n_samples
+    rows = []
+    heart_rates = [75.0] * n_patients
+    for i in range(n_samples):
+        p = i % n_patients
+        heart_rates[p] += 0.1 * (75 - heart_rates[p]) + random.gauss(0, 1.5)  # mean-reverting walk
+        rows.append((f'{p:05d}', {
+            'time_stamp': datetime.fromtimestamp(start_time + i // n_patients),
+            'heart_rate': heart_rates[p] if random.random() > 0.001 else 160,  # rare spikes
+            'spo2': random.gauss(97, 0.7),
+        }))
+
+    start = time.perf_counter()
+    events = 0
+    for patient_id, row in rows:
+        events += len(detector.observe(patient_id, row, row['time_stamp']))
+    elapsed = time.perf_counter() - start
+    print(f"{n_samples:,} samples ({n_patients} patients, 2 signals each): {n_samples / elapsed:,.0f} samples/s, "
+          f"{elapsed / n_samples * 1e6:.1f} µs/sample, {events} events")
+    print(detector.stats())
@@ -2,36 +2,78 @@
 import eventlet
 eventlet.monkey_patch()  # Enable async for SocketIO
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
 from flask_socketio import SocketIO
 import pandas as pd
 from datetime import datetime, timedelta
 import os
+import re
+import json
 import threading
 import time
-import requests
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import socketio as client_socketio
+from collections import deque
 
 # Custom modules (make sure these are in your project)
-from nlp_engine import nlp_engine
-from utils import df_to_text, filter_raw_df, plot_vital_sign
-from request_to_openai import gpt
+from nlp_engine import nlp_engine, vision_cache
+from utils import df_to_text, filter_raw_df, plot_vital_sign, extract_patient_id_from_text, combine_data_and_time, lttb_indices
+from request_to_openai import gpt, gpt_stream, response_cache, image_encoder, ANSWER_CACHE_TTL, GENERAL_CACHE_TTL
+from sensor_store import SensorStore, WriteCoalescer
+from ring_buffer import RecentSamples
+from rollups import RollupStore, pick_resolution, coarser_resolutions
+from plot_cache import PlotCache
+from plot_renderer import PlotRenderer
+from series import downsample_series, encode_json, encode_binary
+from config import SENSOR_COLUMNS, ANOMALY_RULES
+from pipeline import Pipeline
+from pi_bridge import PiBridge
+from broadcast import VitalsBroadcaster
+from alert_store import AlertStore
+from frame_store import FrameStore, S3FrameBackend
+from anomaly_detector import AnomalyDetector, pi_vitals_values
+from patient_summary import PatientSummaries
+from intent_parser import parse_intent, MAX_RELATIVE_MINUTES
+from config_nlp_engine import SYSTEM_PROMPT_ENDPOINT
+from state_backend import backend_from_url, LeaderElection
 
 # -------------------------------
 # Flask & SocketIO setup
 # -------------------------------
 app = Flask(__name__)
-socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*")
+# Redis / Kombu URL carrying emits to the browsers of every worker (unset: relayed through STATE_BACKEND)
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
 
-# ==================== Raspberry Pi Client Setup ====================
-RASPBERRY_PI_URL = 'http://10.127.124.254:5000'  # Update with your Pi's IP
-sio_client = client_socketio.Client(reconnection=True, reconnection_attempts=0, reconnection_delay=5)
-pi_connected = False
+# -------------------------------
+# State shared by the web workers
+# -------------------------------
+# memory:// for a single worker; sqlite:///path/state.db (one host) or redis://host:port/db for several
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory://')
+state = backend_from_url(STATE_BACKEND)
+
+def is_maintainer():
+    """Background maintenance (compaction, rollup snapshots) runs on the leader worker only"""
+    return not state.shared or leader.is_leader
 
-latest_vitals_from_pi = {
+def emit_everywhere(event, data, to=None):
+    """Emit to the browsers connected to every worker, or to the socket `to` whichever worker holds it"""
+    socketio.emit(event, data, to=to)
+    held_here = to is not None and socketio.server.manager.is_connected(to, '/')
+    if state.shared and not SOCKETIO_MESSAGE_QUEUE and not held_here:
+        state.publish('emit', {'event': event, 'data': data, 'to': to})
+
+state.subscribe('emit', lambda message: socketio.emit(message['event'], message['data'], to=message.get('to')))
+
+# ==================== Raspberry Pi Client Setup ====================
+# Comma-separated, one URL per Pi (each Pi reports its own patients)
+RASPBERRY_PI_URLS = [url.strip() for url in os.environ.get(
+    'RASPBERRY_PI_URLS', 'http://10.127.124.254:5000').split(',') if url.strip()]  # Update with your Pi's IP
+RASPBERRY_PI_URL = RASPBERRY_PI_URLS[0] if RASPBERRY_PI_URLS else None
+# Chat answers use the pushed snapshot unless it is older than this; then the Pi is polled
+PI_VITALS_MAX_AGE = float(os.environ.get('PI_VITALS_MAX_AGE', 30))
+# Upper bound on vitals_update frames per second sent to one browser
+VITALS_MAX_RATE = float(os.environ.get('VITALS_MAX_RATE', 2))
+
+NO_VITALS = {
     'heart_rate': 0,
     'spo2': 0,
     'blood_pressure': {'systolic': 0, 'diastolic': 0},
@@ -41,196 +83,616 @@ latest_vitals_from_pi = {
     'patient_id': '00001'
 }
 
-fall_alerts = []
+# Last 10k fall alerts in memory, every alert in day logs under static/local_data/alerts/
+ALERT_ROOT = './static/local_data/alerts/'
+fall_alerts = AlertStore(ALERT_ROOT, capacity=10000)
+# Anomalies the streaming detector raises on ingested samples, stored like fall alerts
+ANOMALY_ROOT = './static/local_data/anomalies/'
+anomalies = AlertStore(ANOMALY_ROOT, capacity=10000)
+anomaly_detector = AnomalyDetector(ANOMALY_RULES, alpha=0.05, warmup=30, cooldown=60)
 
 # -------------------------------
-# CSV path for patient
+# Sensor storage (partitioned by patient and day)
 # -------------------------------
-PATIENT_CSV = './static/local_data/patient_00001.csv'
+SENSOR_DATA_ROOT = './static/local_data/sensor_data/'
+LEGACY_PATIENT_CSV = './static/local_data/patient_00001.csv'
+DEFAULT_PATIENT_ID = '00001'
 PLOT_FOLDER = './static/local_data/show_data/'
+PLOT_URL_PREFIX = '/static/local_data/show_data/'
 os.makedirs(PLOT_FOLDER, exist_ok=True)
 
-# Load or initialize patient CSV
-if os.path.exists(PATIENT_CSV):
-    patient_df = pd.read_csv(PATIENT_CSV)
-else:
-    patient_df = pd.DataFrame(columns=[
-        "time_stamp", "heart_rate", "steps",
-        "accelerometer_x", "accelerometer_y", "accelerometer_z",
-        "gyroscope_x", "gyroscope_y", "gyroscope_z",
-        "gravity_x", "gravity_y", "gravity_z",
-        "linear_accel_x", "linear_accel_y", "linear_accel_z",
-        "temperature", "pressure", "light", "proximity",
-        "rotation_0", "rotation_1", "rotation_2", "rotation_3", "rotation_4"
-    ])
-    patient_df.to_csv(PATIENT_CSV, index=False)
+# Append-only day partitions (recover torn writes on open)
+sensor_store = SensorStore(SENSOR_DATA_ROOT, SENSOR_COLUMNS, shared=state.shared)
+sensor_store.import_legacy_csv(LEGACY_PATIENT_CSV, DEFAULT_PATIENT_ID)
+sensor_store.start_compaction(interval_seconds=3600, enabled=is_maintainer)
+# Concurrent /sensor_data posts are flushed together every 50 ms or 500 rows
+write_coalescer = WriteCoalescer(sensor_store, max_rows=500, max_delay_ms=50)
+# Last hour of samples per patient kept in memory for "last N minutes" questions
+recent_samples = RecentSamples(retention_minutes=60, capacity=3600)
+recent_samples.warm_from_store(sensor_store)
+# 1 min / 30 min / daily aggregates for historical questions
+rollup_store = RollupStore(SENSOR_DATA_ROOT)
+rollup_store.warm_from_store(sensor_store)
+rollup_store.start_snapshots(interval_seconds=300, enabled=is_maintainer)
+# Rendered plots reused until the patient's data changes (LRU, bounded on disk, per worker)
+plot_cache = PlotCache(PLOT_FOLDER, PLOT_URL_PREFIX, max_files=200, max_bytes=50 * 1024 * 1024,
+                       namespace=os.getpid() if state.shared else None)
+# matplotlib runs in worker processes so renders never block the eventlet loop
+plot_renderer = PlotRenderer(max_workers=2)
+threading.Thread(target=plot_renderer.start, daemon=True).start()
+
+# -------------------------------
+# Camera frames (sharded by patient and month, indexed by time)
+# -------------------------------
+FRAME_ROOT = './static/local_data/frames/'
+FRAME_URL_PREFIX = '/static/local_data/frames/'
+# 's3' also keeps the frames in S3_BUCKET_NAME (S3_ENDPOINT_URL for an S3-compatible server)
+FRAME_BACKEND = os.environ.get('FRAME_BACKEND', '')
+frame_backend = None
+if FRAME_BACKEND == 's3':
+    frame_backend = S3FrameBackend(os.environ.get('S3_BUCKET_NAME', 'remoni'),
+                                   endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+                                   aws_access_key_id=os.environ.get('S3_KEY_ID'),
+                                   aws_secret_access_key=os.environ.get('S3_SECRET_KEY'),
+                                   region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+frame_store = FrameStore(FRAME_ROOT, backend=frame_backend)
+if frame_backend is not None:
+    frame_store.start_sync(interval_seconds=60)
 
 latest_watch_data = None
 
 # ==================== Raspberry Pi Event Handlers ====================
-@sio_client.event
-def connect():
-    global pi_connected
-    pi_connected = True
-    print(f'✓ CONNECTED TO RASPBERRY PI SERVER ({RASPBERRY_PI_URL})')
-    socketio.emit('pi_status', {'connected': True})
-
-@sio_client.event
-def disconnect():
-    global pi_connected
-    pi_connected = False
-    print('✗ DISCONNECTED FROM RASPBERRY PI SERVER')
-    socketio.emit('pi_status', {'connected': False})
-
-@sio_client.event
-def connect_error(data):
-    print(f'❌ CONNECTION ERROR: {data}')
-
-@sio_client.on('vitals_update')
+# Browsers only get the patients they watch, as rate-limited deltas
+vitals_broadcaster = VitalsBroadcaster(socketio, max_rate=VITALS_MAX_RATE, ack_timeout=5.0)
+
 def on_vitals_update(data):
-    global latest_vitals_from_pi
-    latest_vitals_from_pi = data
-    socketio.emit('vitals_update', data)
+    apply_vitals(data)
+    state.publish('vitals', data)
+
+def apply_vitals(data):
+    patient_id = str(data.get('patient_id') or DEFAULT_PATIENT_ID)
+    vitals_broadcaster.publish(patient_id, data)
+    record_anomalies(anomaly_detector.observe(patient_id, pi_vitals_values(data), data.get('timestamp') or time.time(),
+                                              source='pi'))
+
+def record_anomalies(events):
+    """
+    Store and push anomaly events. Every worker feeds its detector all samples
+    (keeping the baselines warm for a takeover); only the leader records events.
+    """
+    if not events or not is_maintainer():
+        return
+    for event in events:
+        anomaly = anomalies.add(event)
+        state.publish('anomaly', anomaly)
+        emit_everywhere('anomaly', anomaly)
 
-@sio_client.on('fall_alert')
 def on_fall_alert(data):
-    global fall_alerts
-    fall_alerts.append(data)
-    socketio.emit('fall_alert', data)
-
-def connect_to_raspberry_pi():
-    max_retries = 3
-    for retry_count in range(max_retries):
-        try:
-            print(f'🔌 Attempting to connect to Raspberry Pi ({retry_count+1}/{max_retries})...')
-            sio_client.connect(RASPBERRY_PI_URL, wait_timeout=10)
-            return True
-        except Exception as e:
-            print(f'❌ Connection failed: {e}')
-            time.sleep(3)
-    print('⚠️ Could not connect to Raspberry Pi, continuing without it.')
-    return False
-
-def reconnect_loop():
-    while True:
-        time.sleep(30)
-        if not pi_connected and not sio_client.connected:
-            print('🔄 Reconnection attempt...')
-            try:
-                connect_to_raspberry_pi()
-            except Exception as e:
-                print(f'❌ Reconnect failed: {e}')
+    alert = fall_alerts.add(data)
+    state.publish('fall_alert', alert)
+    emit_everywhere('fall_alert', alert)
+
+def on_pi_status(url, connected):
+    emit_everywhere('pi_status', {'connected': connected, 'url': url})
+
+pi_bridge = PiBridge(RASPBERRY_PI_URLS, max_age_seconds=PI_VITALS_MAX_AGE, pull_timeout=5,
+                     on_vitals=on_vitals_update, on_fall_alert=on_fall_alert, on_status=on_pi_status,
+                     state=state)
+
+# Workers that do not hold the Pi connections mirror what the leader receives
+state.subscribe('vitals', apply_vitals)
+state.subscribe('fall_alert', fall_alerts.replicate)
+state.subscribe('anomaly', anomalies.replicate)
+
+# Status snapshot per patient for broad questions (fixed-size prompt), rebuilt within 5 s of new rows
+patient_summaries = PatientSummaries(rollup_store, pi_bridge, fall_alerts, anomalies, max_age=30)
+patient_summaries.start_refresh(interval_seconds=5)
+
+# One worker holds the Pi connections; another takes over within ttl seconds if it dies
+leader = LeaderElection(state, 'pi-bridge', ttl=15, on_elected=pi_bridge.start, on_demoted=pi_bridge.stop)
+
+def start_background_services():
+    """Join the leader election (once per worker: __main__ or the gunicorn post_worker_init hook)"""
+    leader.start()
+
+# ==================== Browser Socket Events ====================
+@socketio.on('watch')
+def on_watch(data):
+    """{'patient_ids': [...], 'max_rate': frames/s} -> vitals_update frames for those patients"""
+    patient_ids = [str(p) for p in (data or {}).get('patient_ids', [])]
+    vitals_broadcaster.watch(request.sid, patient_ids, max_rate=(data or {}).get('max_rate'))
+    return {'watching': patient_ids}
+
+@socketio.on('vitals_ack')
+def on_vitals_ack(*args):
+    """The browser processed a vitals_update frame; the next one may be sent"""
+    vitals_broadcaster.ack(request.sid)
+
+@socketio.on('unwatch')
+def on_unwatch(data):
+    vitals_broadcaster.unwatch(request.sid, (data or {}).get('patient_ids'))
+
+@socketio.on('disconnect')
+def on_browser_disconnect(*args):
+    vitals_broadcaster.forget(request.sid)
 
 # ==================== Routes ====================
 @app.route("/")
 def index():
-    return render_template('doctor.html')
+    return render_template('doctor.html', patient_id=DEFAULT_PATIENT_ID, vitals_rate=min(VITALS_MAX_RATE, 1))
 
 @app.route("/api/pi_status", methods=['GET'])
 def get_pi_status():
-    return jsonify({'connected': pi_connected, 'url': RASPBERRY_PI_URL})
+    return jsonify({'connected': pi_bridge.connected(), 'url': RASPBERRY_PI_URL, 'pis': pi_bridge.status(),
+                    'worker': state.node_id, 'leader': leader.is_leader})
 
 @app.route("/api/latest_vitals_from_pi", methods=['GET'])
 def get_latest_vitals_from_pi():
-    return jsonify(latest_vitals_from_pi)
+    """Last pushed vitals (of patient_id, or the latest patient), with age_seconds / stale / source"""
+    snapshot = pi_bridge.snapshot(request.args.get('patient_id'))
+    if snapshot is None:
+        return jsonify(dict(NO_VITALS, age_seconds=None, stale=True, source=None))
+    return jsonify(dict(snapshot['vitals'], age_seconds=snapshot['age_seconds'],
+                        stale=snapshot['stale'], source=snapshot['source']))
 
 @app.route("/api/fall_alerts", methods=['GET'])
 def get_fall_alerts():
-    return jsonify({'total': len(fall_alerts), 'alerts': fall_alerts[-10:]})
+    """
+    Fall alerts, newest first; ?patient_id= filters, start= / end= bound the receive
+    time (ISO or epoch), limit= sets the page size (default 10, max 500).
+    Paging: before=<next_cursor> for older alerts; since=<seq> returns the alerts
+    after that seq oldest first (keep next_cursor to poll for new ones).
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 500)
+        return jsonify(query_alert_store(fall_alerts, limit))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route("/api/anomalies", methods=['GET'])
+def get_anomalies():
+    """
+    Anomalies raised by the streaming detector, with the /api/fall_alerts filters
+    and paging; signal= / kind= (low, high, rate, z_score) filter the page.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        response = query_alert_store(anomalies, limit)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    signal, kind = request.args.get('signal'), request.args.get('kind')
+    response['alerts'] = [a for a in response['alerts']
+                          if (not signal or a.get('signal') == signal) and (not kind or a.get('kind') == kind)]
+    response['detector'] = anomaly_detector.stats()
+    return jsonify(response)
+
+@app.route("/api/patient_summary", methods=['GET'])
+def get_patient_summary():
+    """Status snapshot of ?patient_id= (default patient) and the prompt text chat answers use"""
+    summary = patient_summaries.get(request.args.get('patient_id', DEFAULT_PATIENT_ID))
+    return jsonify(dict(summary, text=PatientSummaries.to_text(summary), cache=patient_summaries.stats()))
+
+def query_alert_store(store, limit):
+    """One page of an AlertStore for the request's patient_id / since / before / start / end"""
+    since, before = request.args.get('since'), request.args.get('before')
+    start, end = request.args.get('start'), request.args.get('end')
+    alerts, next_cursor = store.query(
+        patient_id=request.args.get('patient_id'),
+        since=int(since) if since else None,
+        before=int(before) if before else None,
+        start=parse_query_time(start).timestamp() if start else None,
+        end=parse_query_time(end).timestamp() if end else None,
+        limit=limit)
+    return {'total': len(store), 'alerts': alerts, 'next_cursor': next_cursor,
+            'oldest_seq': store.stats()['oldest_seq']}
+
+@app.route("/api/broadcast_stats", methods=['GET'])
+def get_broadcast_stats():
+    return jsonify(vitals_broadcaster.stats())
+
+@app.route("/api/render_stats", methods=['GET'])
+def get_render_stats():
+    return jsonify({'renderer': plot_renderer.stats(), 'plot_cache': plot_cache.stats()})
+
+@app.route("/api/llm_cache_stats", methods=['GET'])
+def get_llm_cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route("/api/image_cache_stats", methods=['GET'])
+def get_image_cache_stats():
+    return jsonify(image_encoder.stats())
+
+@app.route("/api/vision_cache_stats", methods=['GET'])
+def get_vision_cache_stats():
+    return jsonify(vision_cache.stats())
+
+@app.route("/api/series", methods=['GET'])
+def get_series():
+    """
+    Downsampled series for client-side charts.
+    ?patient_id=&signals=heart_rate,steps&minutes=60 (or start=&end= ISO times)
+    &width=<chart width in px>&format=json|binary
+    """
+    try:
+        patient_id = request.args.get('patient_id', DEFAULT_PATIENT_ID)
+        signals = [s for s in request.args.get('signals', 'heart_rate').split(',') if s in SENSOR_COLUMNS[1:]]
+        if not signals:
+            return jsonify({"status": "error", "message": "No known signals requested"}), 400
+        minutes = request.args.get('minutes', type=int)
+        start, end = request.args.get('start'), request.args.get('end')
+        if start or end:
+            df = sensor_store.query(patient_id, signals, start=parse_device_time(start) if start else None,
+                                    end=parse_device_time(end) if end else None)
+        else:
+            df = load_patient_window(patient_id, minutes)
+        series = downsample_series(df, signals, request.args.get('width', 800, type=int))
+        if request.args.get('format') == 'binary':
+            return Response(encode_binary(series), mimetype='application/octet-stream')
+        return jsonify({"patient_id": patient_id, "minutes": minutes, "series": encode_json(series)})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
 @app.route("/sensor_data", methods=['POST'])
 def receive_watch_sensor_data():
-    global patient_df, latest_watch_data
+    global latest_watch_data
     try:
         data = request.get_json()
+        patient_id = str(data.get('patient_id', DEFAULT_PATIENT_ID))
         latest_watch_data = data.get('sensors', {})
         row = {'time_stamp': datetime.now()}
         row.update(latest_watch_data)
-        patient_df = pd.concat([patient_df, pd.DataFrame([row])], ignore_index=True)
-        patient_df.to_csv(PATIENT_CSV, index=False)
+        ingest_rows(patient_id, [row])
         print(f"📱 Watch data saved: HR={latest_watch_data.get('heart_rate')}, Steps={latest_watch_data.get('steps')}")
         return jsonify({"status": "success"}), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/sensor_data/bulk", methods=['POST'])
+def receive_watch_sensor_data_bulk():
+    """Ingest samples buffered on the watch: JSON array or NDJSON of {'time_stamp', 'sensors'}"""
+    global latest_watch_data
+    try:
+        patient_id = request.args.get('patient_id', DEFAULT_PATIENT_ID)
+        rows = parse_bulk_samples(request.get_data(as_text=True))
+        if not rows:
+            return jsonify({"status": "error", "message": "No samples in request"}), 400
+        ingest_rows(patient_id, rows)
+        latest_watch_data = {k: v for k, v in rows[-1].items() if k != 'time_stamp'}
+        print(f"📱 Watch bulk upload saved: {len(rows)} samples")
+        return jsonify({"status": "success", "count": len(rows)}), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/frames", methods=['POST'])
+def receive_frame():
+    """Store a camera frame: raw image body (or multipart 'image'), ?patient_id=&time_stamp="""
+    try:
+        patient_id = request.args.get('patient_id', DEFAULT_PATIENT_ID)
+        upload = request.files.get('image')
+        data = upload.read() if upload else request.get_data()
+        if not data:
+            return jsonify({"status": "error", "message": "No image in request"}), 400
+        name = upload.filename if upload else ''
+        ext = name.rsplit('.', 1)[-1].lower() if '.' in name else 'jpg'
+        record = frame_store.add(patient_id, data, parse_device_time(request.args.get('time_stamp')), ext=ext)
+        return jsonify({"status": "success", "frame": dict(record, url=frame_url(record))}), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route("/api/frames", methods=['GET'])
+def get_frames():
+    """
+    ?patient_id=&time=<ISO>[&tolerance_minutes=] -> the nearest frame;
+    ?patient_id=&start=&end=&limit= -> frames in the range, newest first
+    """
+    try:
+        patient_id = request.args.get('patient_id', DEFAULT_PATIENT_ID)
+        if request.args.get('time'):
+            tolerance = request.args.get('tolerance_minutes', type=float)
+            records = frame_store.nearest(patient_id, [parse_device_time(request.args['time'])],
+                                          tolerance=timedelta(minutes=tolerance) if tolerance else None)
+        else:
+            start, end = request.args.get('start'), request.args.get('end')
+            records = frame_store.query(patient_id, parse_device_time(start) if start else None,
+                                        parse_device_time(end) if end else None)
+            records = records[::-1][:min(request.args.get('limit', 50, type=int), 500)]
+        return jsonify({"patient_id": patient_id, "frames": [dict(r, url=frame_url(r)) for r in records]})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
 # ==================== Helper Functions ====================
-def filter_df_by_time_range(df, minutes=10):
-    if df.empty:
-        return df
-    df['time_stamp'] = pd.to_datetime(df['time_stamp'])
-    cutoff_time = datetime.now() - timedelta(minutes=minutes)
-    return df[df['time_stamp'] >= cutoff_time].copy()
-
-def create_plot(df, vital_sign, time_range_minutes=None):
+def frame_url(record):
+    return FRAME_URL_PREFIX + os.path.relpath(record['path'], FRAME_ROOT).replace(os.sep, '/')
+
+def frames_for_intent(agent):
+    """Frames nearest the requested date/time slots (the latest frame when none were asked for)"""
+    if agent.intent_dict.get('list_date') or agent.intent_dict.get('list_time'):
+        agent.process_special_historical_data_retrieval()
+        slots = combine_data_and_time(agent.intent_dict['list_date'], agent.intent_dict['list_time'])
+        records = frame_store.nearest(agent.patient_id, slots, tolerance=timedelta(hours=1))
+    else:
+        latest = frame_store.latest(agent.patient_id)
+        records = [latest] if latest else []
+    return [r for r in records if frame_store.local_path(r)]
+
+def ingest_rows(patient_id, rows):
+    """Persist sensor rows and feed the in-memory views derived from them, on every worker"""
+    write_coalescer.submit(patient_id, rows)
+    rows = sorted(rows, key=lambda r: r['time_stamp'])
+    apply_rows(patient_id, rows)
+    state.publish('sensor_rows', {'patient_id': patient_id, 'rows': rows})
+
+def apply_rows(patient_id, rows):
+    recent_samples.add_rows(patient_id, rows)
+    rollup_store.add_rows(patient_id, rows)
+    plot_cache.bump_version(patient_id)
+    patient_summaries.mark_dirty(patient_id)
+    record_anomalies(anomaly_detector.observe_rows(str(patient_id), rows))
+
+state.subscribe('sensor_rows', lambda message: apply_rows(message['patient_id'], message['rows']))
+
+def parse_device_time(value):
+    """Parse a device timestamp (ISO string, epoch seconds or epoch milliseconds)"""
+    if value is None or value == '':
+        return datetime.now()
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+def parse_query_time(value):
+    """Query-string time: ISO string or epoch seconds / milliseconds"""
+    try:
+        return parse_device_time(float(value))
+    except ValueError:
+        return parse_device_time(value)
+
+def parse_bulk_samples(body):
+    """Turn a JSON array or NDJSON body into store rows"""
+    body = body.strip()
+    if not body:
+        return []
+    if body.startswith('['):
+        items = json.loads(body)
+    else:
+        items = [json.loads(line) for line in body.splitlines() if line.strip()]
+
+    rows = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f"Sample must be an object, got: {item!r}")
+        sensors = item.get('sensors', item)
+        row = {k: v for k, v in sensors.items() if k != 'time_stamp'}
+        row['time_stamp'] = parse_device_time(item.get('time_stamp', sensors.get('time_stamp')))
+        rows.append(row)
+    return rows
+
+def resolve_patient_id(question, intent_dict=None):
+    """Pick the patient from the intent, a 5-digit ID in the question, or the default"""
+    intent_id = str((intent_dict or {}).get('patient_id') or '')
+    if re.match(r'^\d{5}$', intent_id):
+        return intent_id
+    question_id = extract_patient_id_from_text(question)
+    return question_id if question_id != 'unknown' else DEFAULT_PATIENT_ID
+
+def load_patient_window(patient_id, minutes=None):
+    """Read a patient's samples from memory when recent enough, else from the window's day partitions"""
+    if recent_samples.covers(patient_id, minutes):
+        return recent_samples.window_df(patient_id, minutes)
+    start = datetime.now() - timedelta(minutes=minutes) if minutes else None
+    return sensor_store.query(patient_id, start=start)
+
+MAX_PLOT_POINTS = 2000
+
+def submit_plot(df, vital_sign, time_range_minutes=None, plot_filename=None):
+    """Queue a plot render in the renderer pool; returns (url, future) or (None, None) if there is nothing to plot"""
     if df.empty or vital_sign not in df.columns:
-        return None
-    df['time_stamp'] = pd.to_datetime(df['time_stamp'])
-    df_clean = df[df[vital_sign].notna()].sort_values('time_stamp')
-    if df_clean.empty: return None
-    plt.figure(figsize=(10,6))
-    plt.plot(df_clean['time_stamp'], df_clean[vital_sign], marker='o', linestyle='-', linewidth=2, markersize=6)
-    title = vital_sign.replace('_',' ').title()
-    if time_range_minutes: title += f" - Last {time_range_minutes} Minutes"
-    plt.title(title, fontsize=14, fontweight='bold')
-    plt.xlabel('Time', fontsize=12)
-    ylabel = vital_sign.replace('_',' ').title()
-    if vital_sign=='heart_rate': ylabel+=' (BPM)'
-    elif vital_sign=='temperature': ylabel+=' (°C)'
-    elif vital_sign=='pressure': ylabel+=' (hPa)'
-    elif vital_sign=='steps': ylabel+=' (count)'
-    plt.ylabel(ylabel, fontsize=12)
-    plt.xticks(rotation=45, ha='right')
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
-    plot_filename = f'plot_{vital_sign}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.png'
+        return None, None
+    df_clean = df[['time_stamp', vital_sign]].copy()
+    df_clean[vital_sign] = pd.to_numeric(df_clean[vital_sign], errors='coerce')
+    df_clean = df_clean[df_clean[vital_sign].notna()]
+    if df_clean.empty: return None, None
+    times_ns = pd.to_datetime(df_clean['time_stamp'], format='mixed').astype('datetime64[ns]').to_numpy().astype('int64')
+    order = times_ns.argsort(kind='stable')
+    df_clean = df_clean.iloc[order].reset_index(drop=True)
+    times_ns = times_ns[order]
+    if len(df_clean) > MAX_PLOT_POINTS:
+        keep = lttb_indices(df_clean, vital_sign, MAX_PLOT_POINTS)
+        df_clean, times_ns = df_clean.iloc[keep], times_ns[keep]
+    if plot_filename is None:
+        plot_filename = f'plot_{vital_sign}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.png'
     plot_path = os.path.join(PLOT_FOLDER, plot_filename)
-    plt.savefig(plot_path, dpi=100, bbox_inches='tight')
-    plt.close()
-    return f'/static/local_data/show_data/{plot_filename}'
+    future = plot_renderer.submit(plot_path, times_ns, df_clean[vital_sign].to_numpy(dtype=float),
+                                  vital_sign, time_range_minutes)
+    return PLOT_URL_PREFIX + plot_filename, future
+
+def create_plot(df, vital_sign, time_range_minutes=None, plot_filename=None):
+    url, future = submit_plot(df, vital_sign, time_range_minutes, plot_filename)
+    if future is None:
+        return None
+    future.result()
+    return url
+
+def series_handles(patient_id, vital_signs, time_range_minutes=None):
+    """/api/series URLs the browser fetches and draws itself, one chart per vital sign"""
+    query = f'patient_id={patient_id}' + (f'&minutes={time_range_minutes}' if time_range_minutes else '')
+    return [{'signal': vital_sign, 'title': vital_sign.replace('_', ' ').title(),
+             'url': f'/api/series?{query}&signals={vital_sign}'}
+            for vital_sign in vital_signs if vital_sign in SENSOR_COLUMNS]
+
+def cached_plots(patient_id, vital_signs, time_range_minutes=None, wait=True, df=None):
+    """
+    Plot URLs for each vital sign, rendering (and reading data) only on cache misses.
+    Misses render in parallel in the renderer pool; with wait=False the URLs are
+    returned straight away and the images appear once their jobs finish. df is
+    the already loaded window, if the caller has it.
+    """
+    urls = {}
+    pending = []
+    for vital_sign in vital_signs:
+        key = plot_cache.key(patient_id, vital_sign, time_range_minutes)
+        url = plot_cache.get(key)
+        if url is None:
+            if df is None:
+                df = load_patient_window(patient_id, time_range_minutes)
+            url, future = submit_plot(df, vital_sign, time_range_minutes, plot_cache.filename(key))
+            if future is None:
+                plot_cache.put(key, rendered=False)
+            else:
+                future.add_done_callback(lambda f, key=key: f.exception() is None and plot_cache.put(key))
+                pending.append((vital_sign, future))
+        urls[vital_sign] = url
+    if wait:
+        for vital_sign, future in pending:
+            if future.exception() is not None:
+                urls[vital_sign] = None
+    plot_paths = [urls[v] for v in vital_signs if urls[v]]
+    return plot_paths, df
+
+def llm_reply(body, prompt, system_prompt, cache_ttl=0):
+    """
+    GPT answer for a /chat request body. When the browser asked for streaming
+    ({"stream": true, "sid": <socket id>, "request_id": ...}) every token is also
+    pushed to its socket as a 'chat_token' event while the answer is generated;
+    the full text is returned either way for the JSON response.
+    """
+    if not (body.get("stream") and body.get("sid")):
+        return gpt(text=prompt, model_name="gpt-3.5-turbo", system_prompt=system_prompt, cache_ttl=cache_ttl)
+    tokens = []
+    for token in gpt_stream(text=prompt, model_name="gpt-3.5-turbo", system_prompt=system_prompt, cache_ttl=cache_ttl):
+        tokens.append(token)
+        # The POST may reach another worker than the one holding the socket
+        emit_everywhere('chat_token', {'request_id': body.get("request_id"), 'token': token}, to=body["sid"])
+    return ''.join(tokens)
 
 # ==================== Chat Endpoint ====================
 @app.route("/chat", methods=['POST'])
 def chat():
-    question = request.get_json().get("message", "")
+    body = request.get_json()
+    question = body.get("message", "")
     question_lower = question.lower()
+    time_range_minutes = parse_time_range(question_lower)
 
-    # Check for current vitals queries
+    # Independent stages start together; each later stage runs as soon as its inputs are ready
+    pipeline = Pipeline('chat')
+    is_summary_question = not time_range_minutes and is_status_question(question)
     vitals_keywords = ['latest', 'current', 'recent', 'vitals', 'blood pressure', 'spo2', 'oxygen']
-    if any(word in question_lower for word in vitals_keywords):
-        try:
-            resp = requests.get(f"{RASPBERRY_PI_URL}/get_current_vitals", timeout=5)
-            if resp.status_code == 200:
-                vitals_data = resp.json().get("current_vitals", {})
-                bp = vitals_data.get("blood_pressure", {})
-                vitals_text = (
-                    f"• Heart Rate: {vitals_data.get('heart_rate', 0)} BPM\n"
-                    f"• SpO2: {vitals_data.get('spo2', 0)}%\n"
-                    f"• Blood Pressure: {bp.get('systolic',0)}/{bp.get('diastolic',0)} mmHg\n"
-                    f"• Skin Temp: {vitals_data.get('skin_temperature',0)}°C\n"
-                    f"• Last Updated: {vitals_data.get('datetime','N/A')}"
-                )
-                prompt = f"User question: {question}\n\n{vitals_text}\n\nProvide professional response."
-                gpt_reply = gpt(text=prompt, model_name="gpt-3.5-turbo", system_prompt="You are a medical assistant.")
-                return jsonify({"answer": gpt_reply})
-            else:
-                return jsonify({"answer": "Could not fetch current vitals from server."})
-        except Exception as e:
-            return jsonify({"answer": f"Error fetching current vitals: {e}"})
-
-    # NLP and plotting logic
-    agent = nlp_engine()
-    agent.patient_id = '00001'
-    agent.intent_detection(question)
-    vital_signs_requested = agent.intent_dict.get('vital_sign', [])
-    is_plot = agent.intent_dict.get('is_plot', False)
-
-    # Time range detection
-    import re
+    is_vitals_question = not is_summary_question and any(word in question_lower for word in vitals_keywords)
+    if is_summary_question:
+        # Precomputed snapshot: no intent detection, no data read, same prompt size whatever the history
+        pipeline.add('summary', lambda: patient_summaries.get(resolve_patient_id(question)))
+        pipeline.add('answer', lambda summary: answer_summary(body, question, summary), deps=['summary'])
+    else:
+        pipeline.add('intent', lambda: detect_intent(question))
+        # Speculative read of the window named in the question, overlapping intent detection
+        pipeline.add('window', lambda: prefetch_window(question, time_range_minutes))
+        if is_vitals_question:
+            # Pi round trip overlapping intent detection; used unless the intent asks for history, plots or frames
+            pipeline.add('pi_vitals', lambda: pi_bridge.current_vitals(resolve_patient_id(question)))
+        pipeline.add('plot', lambda intent, window: plot_response(body, intent, window, time_range_minutes),
+                     deps=['intent', 'window'], optional=True)
+        pipeline.add('sensor_data', lambda intent, window: sensor_prompt(question, intent, window, time_range_minutes,
+                                                                         is_vitals_question),
+                     deps=['intent', 'window'], optional=True)
+        pipeline.add('frames', lambda intent: camera_frames(intent), deps=['intent'], optional=True)
+        pipeline.add('vision', lambda intent, records: describe_frames(intent, records),
+                     deps=['intent', 'frames'], optional=True)
+        deps = ['intent', 'plot', 'sensor_data', 'frames', 'vision'] + (['pi_vitals'] if is_vitals_question else [])
+        pipeline.add('answer', lambda *inputs: compose_answer(body, question, time_range_minutes, is_vitals_question,
+                                                              *inputs),
+                     deps=deps)
+    pipeline.run()
+
+    report = pipeline.report()
+    chat_timings.append(report)
+    print(f"⏱️ Chat pipeline {report['total_ms']} ms, critical path: {' -> '.join(report['critical_path'])}")
+    try:
+        response = pipeline.result('answer')
+    except Exception as e:
+        if 'pi_vitals' not in pipeline.errors:
+            raise
+        response = {"answer": f"Error fetching current vitals: {e}"}
+    response['timings'] = report
+    return jsonify(response)
+
+chat_timings = deque(maxlen=100)
+
+@app.route("/api/chat_timings", methods=['GET'])
+def get_chat_timings():
+    """Per-stage timings of recent /chat requests and the mean duration of each stage"""
+    durations = {}
+    for report in chat_timings:
+        for stage, timing in report['stages'].items():
+            durations.setdefault(stage, []).append(timing['ms'])
+    return jsonify({
+        'requests': len(chat_timings),
+        'mean_stage_ms': {stage: round(sum(ms) / len(ms), 1) for stage, ms in durations.items()},
+        'recent': list(chat_timings)[-10:],
+    })
+
+def parse_time_range(question_lower):
+    """'N minutes' / 'N hours' in the question, in minutes (None if the question names no window)"""
     time_range_minutes = None
     match_min = re.search(r'(\d+)\s*minute', question_lower)
     match_hr = re.search(r'(\d+)\s*hour', question_lower)
     if match_min: time_range_minutes = int(match_min.group(1))
     if match_hr: time_range_minutes = int(match_hr.group(1)) * 60
+    if time_range_minutes is not None and time_range_minutes > MAX_RELATIVE_MINUTES:
+        return None  # 'last 9999999999 hours' would overflow timedelta; the intent path handles it
+    return time_range_minutes
+
+def answer_pi_vitals(body, question, snapshot):
+    if snapshot is None:
+        return {"answer": "Could not fetch current vitals from server."}
+    vitals_data = snapshot['vitals']
+    bp = vitals_data.get("blood_pressure", {})
+    vitals_text = (
+        f"• Heart Rate: {vitals_data.get('heart_rate', 0)} BPM\n"
+        f"• SpO2: {vitals_data.get('spo2', 0)}%\n"
+        f"• Blood Pressure: {bp.get('systolic',0)}/{bp.get('diastolic',0)} mmHg\n"
+        f"• Skin Temp: {vitals_data.get('skin_temperature',0)}°C\n"
+        f"• Last Updated: {vitals_data.get('datetime','N/A')} (received {snapshot['age_seconds']:.0f} s ago"
+        f"{', may be outdated: the Raspberry Pi did not respond' if snapshot['stale'] else ''})"
+    )
+    prompt = f"User question: {question}\n\n{vitals_text}\n\nProvide professional response."
+    return {"answer": llm_reply(body, prompt, "You are a medical assistant.", ANSWER_CACHE_TTL)}
+
+# Whole phrases asking about the patient's overall state ("what was the patient doing" is activity recognition)
+SUMMARY_QUESTION = re.compile(r"\bhow(?: is|'s| are)(?: the)? patients?(?: \d{5})?(?: doing)?(?: today)?\W*$"
+                              r"|\b(?:overview|summary|summari[sz]e|overall (?:condition|status|health)"
+                              r"|general (?:condition|status))\b")
+
+def is_status_question(question):
+    """
+    Broad status question answered from the patient summary: a status phrase,
+    and the rule-based intent asks for no frames, plot or specific day / time
+    """
+    question = question.lower().strip()
+    if not SUMMARY_QUESTION.search(question):
+        return False
+    intent, _ = parse_intent(SUMMARY_QUESTION.sub(' ', question))  # 'doing' in the phrase is not an activity
+    today = [datetime.now().strftime("%Y-%m-%d")]
+    return not (intent['recognition'] or intent['is_image'] or intent['is_plot']
+                or intent['list_date'] not in ([], today) or intent['list_time'])
+
+def answer_summary(body, question, summary):
+    agent = nlp_engine()
+    agent.patient_id = summary['patient_id']
+    prompt = agent.endpoint_prompt(None, question, PatientSummaries.to_text(summary))
+    return {"answer": llm_reply(body, prompt, SYSTEM_PROMPT_ENDPOINT, ANSWER_CACHE_TTL)}
+
+def detect_intent(question):
+    """Intent of the question; returns (agent, vital signs requested, is_plot)"""
+    question_lower = question.lower()
+    agent = nlp_engine()
+    agent.intent_detection(question)
+    agent.patient_id = resolve_patient_id(question, agent.intent_dict)
+    vital_signs_requested = agent.intent_dict.get('vital_sign', [])
+    is_plot = agent.intent_dict.get('is_plot', False)
 
     # Fallback keywords mapping
     if not vital_signs_requested:
@@ -250,48 +712,153 @@ def chat():
     if not is_plot:
         plot_keywords = ['plot','graph','chart','visualize','show','trend','history','variation']
         is_plot = any(k in question_lower for k in plot_keywords)
-
-    # Plotting
-    if is_plot and vital_signs_requested:
-        df = pd.read_csv(PATIENT_CSV)
-        if df.empty: return jsonify({"answer":"No data to plot."})
-        if time_range_minutes: df = filter_df_by_time_range(df, time_range_minutes)
-        plot_paths = [create_plot(df, v, time_range_minutes) for v in vital_signs_requested if create_plot(df,v,time_range_minutes)]
-        if not plot_paths: return jsonify({"answer":"Could not generate plots."})
-        return jsonify({"answer": f"Plot for {', '.join(vital_signs_requested)}", "plots": plot_paths})
-
-    # Sensor data response
-    elif vital_signs_requested:
-        df = pd.read_csv(PATIENT_CSV)
-        if df.empty: return jsonify({"answer":"No sensor data available."})
-        if time_range_minutes: df = filter_df_by_time_range(df, time_range_minutes)
+    return agent, vital_signs_requested, is_plot
+
+def prefetch_window(question, time_range_minutes):
+    """(patient_id, window df) for "last N minutes/hours" questions; reading all data speculatively is too costly"""
+    if not time_range_minutes:
+        return None, None
+    patient_id = resolve_patient_id(question)
+    return patient_id, load_patient_window(patient_id, time_range_minutes)
+
+def window_for(agent, window):
+    """The prefetched window df, unless the intent named another patient than the prefetch guessed"""
+    window_patient_id, window_df = window
+    return window_df if window_patient_id == agent.patient_id else None
+
+def wants_pi_vitals(intent, time_range_minutes):
+    """Current-vitals question: no window, plot, specific day / time or camera frames asked for"""
+    agent, _, is_plot = intent
+    today = [datetime.now().strftime("%Y-%m-%d")]
+    return not (time_range_minutes or is_plot or agent.intent_dict.get('list_time')
+                or (agent.intent_dict.get('list_date') or []) not in ([], today)
+                or agent.intent_dict.get('recognition') or agent.intent_dict.get('is_image'))
+
+def plot_response(body, intent, window, time_range_minutes):
+    """Answer of a plot question (rendered plots or /api/series handles); None for other questions"""
+    agent, vital_signs_requested, is_plot = intent
+    if not (is_plot and vital_signs_requested):
+        return None
+    if body.get("client_charts", False):
+        # The browser draws the charts from /api/series; no server-side rendering
+        handles = series_handles(agent.patient_id, vital_signs_requested, time_range_minutes)
+        if not handles: return {"answer":"Could not generate plots."}
+        return {"answer": f"Plot for {', '.join(vital_signs_requested)}", "series": handles}
+    plot_paths, df = cached_plots(agent.patient_id, vital_signs_requested, time_range_minutes,
+                                  wait=not body.get("async_plots", False), df=window_for(agent, window))
+    if not plot_paths and df is not None and df.empty: return {"answer":"No data to plot."}
+    if not plot_paths: return {"answer":"Could not generate plots."}
+    return {"answer": f"Plot for {', '.join(vital_signs_requested)}", "plots": plot_paths}
+
+def sensor_prompt(question, intent, window, time_range_minutes, pi_scheduled=False):
+    """
+    LLM prompt with the sensor data a question asks for, or a final answer when
+    there is none; None for questions answered by another stage
+    """
+    agent, vital_signs_requested, is_plot = intent
+    if is_plot or not vital_signs_requested or (pi_scheduled and wants_pi_vitals(intent, time_range_minutes)):
+        return None
+    list_date = agent.intent_dict.get('list_date') or []
+    list_time = agent.intent_dict.get('list_time') or []
+    if not time_range_minutes and list_date and (len(list_date) > 1 or not list_time):
+        # Day-level question ("last 3 days", "last week"): answer from rollups
+        start = datetime.strptime(min(list_date), "%Y-%m-%d")
+        end = datetime.strptime(max(list_date), "%Y-%m-%d") + timedelta(days=1) - timedelta(microseconds=1)
+        resolution = pick_resolution(start, end)
+        df = rollup_store.query(agent.patient_id, resolution, vital_signs_requested, start, end)
+        for coarser in coarser_resolutions(resolution) if df.empty else []:
+            # Buckets pruned or not warmed for this range: try the longer-lived resolutions
+            resolution, df = coarser, rollup_store.query(agent.patient_id, coarser, vital_signs_requested, start, end)
+            if not df.empty: break
+        if df.empty:
+            # No rollups at all (e.g. older than the warm-up window): read the raw partitions
+            resolution = None
+            df = sensor_store.query(agent.patient_id, vital_signs_requested, start, end)
+        if df.empty: return {"answer":"No sensor data available for the requested days."}
+        sensor_data_text = df_to_text(df, {'vital_sign': vital_signs_requested}, resolution=resolution)
+    elif not time_range_minutes and (list_date or list_time):
+        # Historical question: nearest stored sample for each requested date/time slot
+        agent.process_special_historical_data_retrieval()
+        slots = combine_data_and_time(agent.intent_dict['list_date'], agent.intent_dict['list_time'])
+        df = sensor_store.nearest(agent.patient_id, slots, vital_signs_requested)
+        if df.empty: return {"answer":"No sensor data available for the requested times."}
+        sensor_data_text = df_to_text(df, {'vital_sign': vital_signs_requested})
+    else:
+        df = window_for(agent, window)
+        if df is None:
+            df = load_patient_window(agent.patient_id, time_range_minutes)
+        if df.empty: return {"answer":"No sensor data available."}
         sensor_data_text = ""
         for vital in vital_signs_requested:
             if vital in df.columns:
                 values = df[vital].dropna()
                 if len(values)>0: sensor_data_text += f"- {vital.replace('_',' ').title()}: {values.iloc[-1]}\n"
-        prompt = f"User question: {question}\n\n{sensor_data_text}\n\nProvide clear response."
-        gpt_reply = gpt(text=prompt, model_name="gpt-3.5-turbo", system_prompt="You are a medical assistant.")
-        return jsonify({"answer": gpt_reply})
+    return f"User question: {question}\n\n{sensor_data_text}\n\nProvide clear response."
+
+def camera_frames(intent):
+    """Frame records for questions about the camera (showing frames or the patient's activity); None otherwise"""
+    agent, vital_signs_requested, _ = intent
+    if vital_signs_requested or not (agent.intent_dict.get('recognition') or agent.intent_dict.get('is_image')):
+        return None
+    return frames_for_intent(agent)
+
+def describe_frames(intent, records):
+    """Vision LLM description of the frames when the question asks what the patient is doing"""
+    agent = intent[0]
+    if not records or not agent.intent_dict.get('recognition'):
+        return None
+    return agent.vision_llm([r['path'] for r in records])
+
+def compose_answer(body, question, time_range_minutes, pi_scheduled, intent, plot, sensor, records, description,
+                   vitals=None):
+    """Final answer from whichever stage handled the question; runs the answer LLM call when one is needed"""
+    agent = intent[0]
+    if plot is not None:
+        return plot
+    if sensor is not None:
+        if isinstance(sensor, dict): return sensor
+        return {"answer": llm_reply(body, sensor, "You are a medical assistant.", ANSWER_CACHE_TTL)}
+
+    # Camera frames: show them and / or describe the patient's activity and emotions
+    if records is not None:
+        if not records: return {"answer": "No camera frames available for the requested times."}
+        response = {}
+        if agent.intent_dict.get('is_image'):
+            response["show_list"] = [frame_url(r) for r in records]
+        if description is not None:
+            frame_times = ', '.join(r['time_stamp'][:19] for r in records)
+            prompt = f"User question: {question}\n\nCamera frames ({frame_times}): {description}\n\nProvide clear response."
+            response["answer"] = llm_reply(body, prompt, "You are a medical assistant.", ANSWER_CACHE_TTL)
+        else:
+            response["answer"] = f"Camera frames of patient {agent.patient_id}: {', '.join(r['time_stamp'][:19] for r in records)}"
+        return response
+
+    if pi_scheduled and wants_pi_vitals(intent, time_range_minutes):
+        return answer_pi_vitals(body, question, vitals)
 
     # General conversation
-    else:
-        gpt_reply = gpt(text=question, model_name="gpt-3.5-turbo", system_prompt="You are a helpful medical assistant.")
-        return jsonify({"answer": gpt_reply})
+    return {"answer": llm_reply(body, question, "You are a helpful medical assistant.", GENERAL_CACHE_TTL)}
 
 # ==================== Debug endpoint ====================
 @app.route("/debug_data", methods=['GET'])
 def debug_data():
     try:
-        df = pd.read_csv(PATIENT_CSV)
-        latest = df.iloc[-1].to_dict() if not df.empty else {}
+        patient_id = request.args.get('patient_id', DEFAULT_PATIENT_ID)
+        latest = recent_samples.latest_row(patient_id) or sensor_store.latest_row(patient_id)
         return jsonify({
-            "columns": list(df.columns),
-            "latest_row": latest,
-            "total_rows": len(df),
-            "pi_connected": pi_connected,
-            "latest_vitals_from_pi": latest_vitals_from_pi,
-            "fall_alerts_count": len(fall_alerts)
+            "patient_id": patient_id,
+            "patients": sensor_store.patients(),
+            "partitions": sensor_store.partition_days(patient_id),
+            "columns": sensor_store.columns,
+            "latest_row": {k: (str(v) if v is not None else None) for k, v in latest.items()},
+            "total_rows": sensor_store.row_count(patient_id),
+            "buffered_rows": recent_samples.buffered_count(patient_id),
+            "pi_connected": pi_bridge.connected(),
+            "latest_vitals_from_pi": pi_bridge.snapshot(),
+            "fall_alerts": fall_alerts.stats(),
+            "frames": frame_store.stats(),
+            "summaries": patient_summaries.stats(),
+            "anomalies": dict(anomalies.stats(), detector=anomaly_detector.stats())
         })
     except Exception as e:
         return jsonify({"error": str(e)})
@@ -301,6 +868,8 @@ wsgi_app = app
 
 # ==================== Local Testing ====================
 if __name__ == '__main__':
-    threading.Thread(target=connect_to_raspberry_pi, daemon=True).start()
-    threading.Thread(target=reconnect_loop, daemon=True).start()
-    socketio.run(app, host='0.0.0.0', port=5001, debug=True)
+    start_background_services()
+    try:
+        socketio.run(app, host='0.0.0.0', port=5001, debug=True)
+    finally:
+        plot_renderer.shutdown(wait=True)
@@ -0,0 +1,207 @@
+# broadcast.py
+import threading
+import time
+import uuid
+
+
+def patient_room(patient_id, prefix='patient'):
+    return f'{prefix}:{patient_id}'
+
+
+class VitalsBroadcaster():
+    """
+    Fan-out of Pi vitals to the browsers watching each patient.
+
+    Clients 'watch' patients (joining their per-patient rooms) at a max rate of
+    their choosing, capped at max_rate. Updates only mark the patient dirty for
+    its watchers; a flush loop sends each client at most one frame per interval
+    with the latest vitals of every dirty patient, so frames in between are
+    coalesced. Frames carry only the fields that changed since the last frame
+    the client got (full=True for the first one). The due clients that got the
+    same last vitals of a patient (normally all of them) share one delta,
+    emitted once to the patient's room while skipping the other members; the
+    rest get a catch-up frame addressed to their sid, after which they are back
+    in step with the room. Each frame must be acked (the 'vitals_ack' event)
+    before the next is sent: a slow consumer keeps coalescing into one pending
+    frame instead of growing a queue, and after ack_timeout its frames are
+    assumed lost and the next one is sent in full.
+
+    Rooms are named per broadcaster: every worker feeds its own broadcaster all
+    vitals, so with a message queue a shared room name would deliver each
+    worker's frames to the clients of the others too.
+    """
+
+    def __init__(self, socketio, event='vitals_update', max_rate=2.0, ack_timeout=5.0, tick=0.05, namespace='/'):
+        self.socketio = socketio
+        self.event = event
+        self.max_rate = max_rate
+        self.ack_timeout = ack_timeout
+        self.tick = tick
+        self.namespace = namespace
+        self.room_prefix = f'vitals:{uuid.uuid4().hex[:8]}'
+        self.updates = 0
+        self.frames = 0
+        self.room_frames = 0
+        self.coalesced = 0  # updates superseded before a watcher received them
+        self.ack_timeouts = 0
+        self._latest = {}    # patient_id -> vitals
+        self._watchers = {}  # patient_id -> set(sid)
+        self._clients = {}   # sid -> {'patients', 'interval', 'next_due', 'sent', 'dirty', 'in_flight', 'unacked'}
+        self._lock = threading.Lock()
+        self._task = None
+
+    # -------------------------------
+    # Subscriptions
+    # -------------------------------
+    def room(self, patient_id):
+        return patient_room(patient_id, self.room_prefix)
+
+    def watch(self, sid, patient_ids, max_rate=None):
+        """Subscribe a client to patients; the current vitals of each are sent with the next flush"""
+        rate = min(float(max_rate), self.max_rate) if max_rate else self.max_rate
+        with self._lock:
+            client = self._clients.setdefault(sid, {'patients': set(), 'interval': 1.0 / rate, 'next_due': 0.0,
+                                                    'sent': {}, 'dirty': set(), 'in_flight': None, 'unacked': 0})
+            client['interval'] = 1.0 / rate
+            for patient_id in map(str, patient_ids):
+                client['patients'].add(patient_id)
+                self._watchers.setdefault(patient_id, set()).add(sid)
+                if patient_id in self._latest:
+                    client['dirty'].add(patient_id)
+                self.socketio.server.enter_room(sid, self.room(patient_id), namespace=self.namespace)
+        self._ensure_started()
+
+    def unwatch(self, sid, patient_ids=None):
+        """Unsubscribe a client from some (or, when None, all) patients"""
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return
+            for patient_id in list(client['patients']) if patient_ids is None else map(str, patient_ids):
+                client['patients'].discard(patient_id)
+                client['sent'].pop(patient_id, None)
+                client['dirty'].discard(patient_id)
+                self._watchers.get(patient_id, set()).discard(sid)
+                self.socketio.server.leave_room(sid, self.room(patient_id), namespace=self.namespace)
+            if not client['patients']:
+                del self._clients[sid]
+
+    def forget(self, sid):
+        """Drop a disconnected client (its rooms are left by the server)"""
+        with self._lock:
+            client = self._clients.pop(sid, None)
+            for patient_id in client['patients'] if client else ():
+                self._watchers.get(patient_id, set()).discard(sid)
+
+    # -------------------------------
+    # Updates
+    # -------------------------------
+    def publish(self, patient_id, vitals):
+        patient_id = str(patient_id)
+        with self._lock:
+            self.updates += 1
+            self._latest[patient_id] = vitals
+            for sid in self._watchers.get(patient_id, ()):
+                dirty = self._clients[sid]['dirty']
+                if patient_id in dirty:
+                    self.coalesced += 1
+                dirty.add(patient_id)
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._flush_loop)
+
+    def _flush_loop(self):
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Vitals broadcast failed: {e}")
+            self.socketio.sleep(self.tick)
+
+    @staticmethod
+    def _delta(patient_id, previous, vitals):
+        """Update with the fields of vitals that differ from previous (all of them when previous lacks some)"""
+        full = previous is None or not set(previous) <= set(vitals)
+        changed = vitals if full else {k: v for k, v in vitals.items() if previous.get(k) != v}
+        return {'patient_id': patient_id, 'full': full, 'vitals': changed} if changed else None
+
+    def flush(self, now=None):
+        """Send the due clients one room frame per dirty patient, and a catch-up frame to those out of step"""
+        now = time.monotonic() if now is None else now
+        room_frames = []  # (patient_id, update, sids skipped)
+        direct = []       # (sid, updates)
+        with self._lock:
+            due = []
+            for sid, client in self._clients.items():
+                if not client['dirty'] or now < client['next_due']:
+                    continue
+                if client['in_flight'] is not None:
+                    if now - client['in_flight'] < self.ack_timeout:
+                        continue  # slow consumer: keep coalescing until the last frame is acked
+                    self.ack_timeouts += 1
+                    client['sent'].clear()
+                    client['in_flight'], client['unacked'] = None, 0
+                due.append(sid)
+
+            for patient_id in {p for sid in due for p in self._clients[sid]['dirty']}:
+                vitals = self._latest[patient_id]
+                groups = {}  # id(last vitals sent) -> (those vitals, sids)
+                for sid in due:
+                    client = self._clients[sid]
+                    if patient_id in client['dirty']:
+                        base = client['sent'].get(patient_id)
+                        groups.setdefault(id(base), (base, set()))[1].add(sid)
+                base, in_sync = max(groups.values(), key=lambda group: len(group[1]))
+                update = self._delta(patient_id, base, vitals)
+                if update:
+                    room_frames.append((patient_id, update, list(self._watchers[patient_id] - in_sync)))
+                for sid in in_sync:
+                    client = self._clients[sid]
+                    client['sent'][patient_id] = vitals
+                    client['dirty'].discard(patient_id)
+                    if update:
+                        client['in_flight'], client['unacked'] = now, client['unacked'] + 1
+
+            for sid in due:
+                client = self._clients[sid]
+                updates = []
+                for patient_id in client['dirty']:
+                    vitals = self._latest[patient_id]
+                    update = self._delta(patient_id, client['sent'].get(patient_id), vitals)
+                    if update:
+                        updates.append(update)
+                    client['sent'][patient_id] = vitals
+                client['dirty'].clear()
+                client['next_due'] = now + client['interval']
+                if updates:
+                    client['in_flight'], client['unacked'] = now, client['unacked'] + 1
+                    direct.append((sid, updates))
+
+        for patient_id, update, skip in room_frames:
+            self.room_frames += 1
+            self.socketio.emit(self.event, {'updates': [update]}, to=self.room(patient_id), skip_sid=skip,
+                               namespace=self.namespace)
+        for sid, updates in direct:
+            self.frames += 1
+            self.socketio.emit(self.event, {'updates': updates}, to=sid, namespace=self.namespace)
+
+    def ack(self, sid):
+        """A client processed a frame; once all its frames are acked it is sent the next one"""
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is not None:
+                client['unacked'] = max(client['unacked'] - 1, 0)
+                if not client['unacked']:
+                    client['in_flight'] = None
+
+    def stats(self):
+        return {
+            'clients': len(self._clients),
+            'patients': {patient_id: len(sids) for patient_id, sids in self._watchers.items() if sids},
+            'updates': self.updates,
+            'frames': self.frames,
+            'room_frames': self.room_frames,
+            'coalesced': self.coalesced,
+            'ack_timeouts': self.ack_timeouts,
+        }
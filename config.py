@@ -8,3 +8,24 @@ vital_sign_var_to_text = {
                 'body_temperature': 'Body Temperature', 
                 'oxygen_saturation': 'Oxygen Saturation'
             }
+
+# Fixed column schema of the watch sensor log (one row per /sensor_data sample)
+SENSOR_COLUMNS = [
+    "time_stamp", "heart_rate", "steps",
+    "accelerometer_x", "accelerometer_y", "accelerometer_z",
+    "gyroscope_x", "gyroscope_y", "gyroscope_z",
+    "gravity_x", "gravity_y", "gravity_z",
+    "linear_accel_x", "linear_accel_y", "linear_accel_z",
+    "temperature", "pressure", "light", "proximity",
+    "rotation_0", "rotation_1", "rotation_2", "rotation_3", "rotation_4"
+]
+
+# Streaming anomaly rules per signal (anomaly_detector.py): values outside [min, max],
+# changes faster than max_rate units per second, and |z| > z_score against the signal's
+# running EWMA mean / std once warmed up (std floored at min_std)
+ANOMALY_RULES = {
+    'heart_rate': {'min': 40, 'max': 130, 'max_rate': 30, 'z_score': 4, 'min_std': 3},
+    'spo2': {'min': 90, 'max_rate': 5, 'z_score': 4, 'min_std': 1},
+    'systolic_pressure': {'min': 90, 'max': 180, 'max_rate': 30, 'z_score': 4, 'min_std': 5},
+    'diastolic_pressure': {'min': 50, 'max': 110, 'max_rate': 20, 'z_score': 4, 'min_std': 4},
+}
@@ -1,3 +1,12 @@
+# Questions the rule-based parser (intent_parser.py) understands with at least this
+# confidence skip the LLM intent detection call
+INTENT_CONFIDENCE_THRESHOLD = 0.7
+
+# Camera frames whose perceptual hashes differ in at most this many of 64 bits reuse the
+# cached vision description (for up to VISION_CACHE_TTL seconds) instead of calling the model
+VISION_HASH_THRESHOLD = 5
+VISION_CACHE_TTL = 3600
+
 SYSTEM_PROMPT_INTENT_DETECTION = """
 The current time is {current_time}.
 You are a helpful assistant. Your task is to detect the user's intent and provide a response in the form of a JSON object complete with the following keys:
@@ -0,0 +1,73 @@
+# fake_pi.py
+"""
+Stand-in for the Raspberry Pi vitals server, for local development and tests.
+
+Serves GET /get_current_vitals?patient_id= and pushes 'vitals_update' for every
+simulated patient over Socket.IO every --interval seconds, plus an occasional
+'fall_alert'. Point the app at it with RASPBERRY_PI_URLS=http://127.0.0.1:5050
+(comma-separate several instances to simulate multiple Pis).
+
+    python fake_pi.py --port 5050 --patients 00001,00002 --interval 2
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import datetime
+
+from flask import Flask, jsonify, request
+from flask_socketio import SocketIO
+
+app = Flask(__name__)
+socketio = SocketIO(app, async_mode='threading', cors_allowed_origins="*")
+patients = ['00001']
+current_vitals = {}
+_lock = threading.Lock()
+
+
+def read_vitals(patient_id):
+    now = time.time()
+    return {
+        'heart_rate': random.randint(60, 100),
+        'spo2': random.randint(94, 100),
+        'blood_pressure': {'systolic': random.randint(110, 135), 'diastolic': random.randint(70, 88)},
+        'skin_temperature': round(random.uniform(33.5, 36.5), 1),
+        'timestamp': now,
+        'datetime': datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S'),
+        'patient_id': patient_id,
+    }
+
+
+@app.route('/get_current_vitals', methods=['GET'])
+def get_current_vitals():
+    patient_id = request.args.get('patient_id', patients[0])
+    if patient_id not in patients:
+        return jsonify({'error': f'Unknown patient {patient_id}'}), 404
+    with _lock:
+        current_vitals[patient_id] = read_vitals(patient_id)
+        return jsonify({'current_vitals': current_vitals[patient_id]})
+
+
+def broadcast_loop(interval_seconds, fall_probability):
+    while True:
+        time.sleep(interval_seconds)
+        for patient_id in patients:
+            with _lock:
+                current_vitals[patient_id] = read_vitals(patient_id)
+            socketio.emit('vitals_update', current_vitals[patient_id])
+            if random.random() < fall_probability:
+                socketio.emit('fall_alert', {'patient_id': patient_id, 'timestamp': time.time(),
+                                             'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                             'confidence': round(random.uniform(0.7, 0.99), 2)})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--patients', default='00001', help='comma-separated patient IDs served by this Pi')
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between vitals_update pushes')
+    parser.add_argument('--fall-probability', type=float, default=0.0, help='chance of a fall_alert per push')
+    args = parser.parse_args()
+    patients[:] = [p.strip() for p in args.patients.split(',') if p.strip()]
+    threading.Thread(target=broadcast_loop, args=(args.interval, args.fall_probability), daemon=True).start()
+    socketio.run(app, host='127.0.0.1', port=args.port, allow_unsafe_werkzeug=True)
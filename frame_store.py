@@ -0,0 +1,308 @@
+# frame_store.py
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from ring_buffer import to_epoch_ns
+from time_index import TimeIndex
+
+INDEX_FILE = 'index.csv'  # one "seq,time_stamp,filename" line per frame
+
+
+def shard_name(time_stamp):
+    """year_month shard of a frame (e.g. 2026_03)"""
+    return pd.Timestamp(time_stamp).strftime('%Y_%m')
+
+
+class S3FrameBackend():
+    """
+    Copy of the frame store in an S3 bucket (or any S3-compatible server via
+    endpoint_url, e.g. MinIO). Frames are uploaded as they are written, under
+    <prefix><patient_id>/<year_month>/<filename>; shard indexes are uploaded by
+    FrameStore.sync(). A host without the frames locally downloads them on first use.
+    """
+
+    def __init__(self, bucket, prefix='frames/', endpoint_url=None, client=None, **client_kwargs):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("The S3 frame backend needs boto3 (pip install boto3)")
+            client = boto3.client('s3', endpoint_url=endpoint_url, **client_kwargs)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client
+
+    def key(self, patient_id, shard, filename):
+        return f'{self.prefix}{patient_id}/{shard}/{filename}'
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def get(self, key):
+        """Object bytes, or None if it does not exist"""
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def shards(self, patient_id):
+        """year_month shards that have an uploaded index"""
+        prefix = f'{self.prefix}{patient_id}/'
+        paginator = self.client.get_paginator('list_objects_v2')
+        shards = set()
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                shard, _, filename = obj['Key'][len(prefix):].partition('/')
+                if filename == INDEX_FILE:
+                    shards.add(shard)
+        return sorted(shards)
+
+
+class FrameStore():
+    """
+    Camera frames on disk, sharded by patient and month:
+    <root>/<patient_id>/<year_month>/<seq:06d>.<ext> plus an index.csv per shard.
+
+    Each shard keeps its next sequence number and a TimeIndex (frame time ->
+    seq) in memory, loaded once from the index file, so writing a frame is O(1)
+    (no directory listing) and the frame nearest a requested time is a binary
+    search. Frame files are created exclusively, so a second process writing
+    the same shard skips to the next free seq; index lines it appended are read
+    on the next lookup. With an S3FrameBackend every frame is also uploaded,
+    and frames / indexes missing locally are fetched from the bucket.
+    """
+
+    def __init__(self, root, backend=None, remote_refresh=60):
+        self.root = root
+        self.backend = backend
+        self.remote_refresh = remote_refresh
+        self.writes = 0
+        self.downloads = 0
+        self._shards = {}  # (patient_id, shard) -> {'index', 'files', 'next_seq', 'size', 'loaded', 'dirty', 'lock'}
+        self._remote_shards = {}  # patient_id -> (listed_at, shards in the bucket)
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # -------------------------------
+    # Shards
+    # -------------------------------
+    def shard_dir(self, patient_id, shard):
+        return os.path.join(self.root, str(patient_id), shard)
+
+    def _shard(self, patient_id, shard):
+        key = (str(patient_id), shard)
+        with self._lock:
+            state = self._shards.get(key)
+            if state is None:
+                state = {'index': TimeIndex(), 'files': {}, 'next_seq': 1, 'size': 0, 'loaded': False,
+                         'dirty': False, 'lock': threading.Lock()}
+                self._shards[key] = state
+        with state['lock']:
+            if not state['loaded']:
+                self._fetch_index(patient_id, shard)
+                state['loaded'] = True
+            self._read_index(patient_id, shard, state)  # picks up lines other processes appended
+        return state
+
+    def _read_index(self, patient_id, shard, state):
+        path = os.path.join(self.shard_dir(patient_id, shard), INDEX_FILE)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size <= state['size']:
+            return
+        with open(path, 'rb') as f:
+            f.seek(state['size'])
+            chunk = f.read(size - state['size'])
+        complete = chunk.rfind(b'\n') + 1  # a line still being written is read next time
+        times, seqs = [], []
+        for line in chunk[:complete].decode('utf-8').splitlines():
+            try:
+                seq, time_stamp, filename = line.split(',')
+                times.append(to_epoch_ns(time_stamp))
+                seqs.append(int(seq))
+            except ValueError:
+                continue
+            state['files'][int(seq)] = filename
+            state['next_seq'] = max(state['next_seq'], int(seq) + 1)
+        state['index'].add(times, seqs)
+        state['size'] += complete
+
+    def _fetch_index(self, patient_id, shard):
+        """Download a shard index this host does not have yet"""
+        path = os.path.join(self.shard_dir(patient_id, shard), INDEX_FILE)
+        if self.backend is None or os.path.exists(path):
+            return
+        data = self.backend.get(self.backend.key(patient_id, shard, INDEX_FILE))
+        if data is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def shards(self, patient_id):
+        """year_month shards of a patient, oldest first"""
+        patient_dir = os.path.join(self.root, str(patient_id))
+        local = set(os.listdir(patient_dir)) if os.path.isdir(patient_dir) else set()
+        if self.backend is None:
+            return sorted(local)
+        listed_at, remote = self._remote_shards.get(str(patient_id), (0, set()))
+        if time.time() - listed_at > self.remote_refresh:
+            remote = set(self.backend.shards(patient_id))
+            self._remote_shards[str(patient_id)] = (time.time(), remote)
+        return sorted(local | remote)
+
+    # -------------------------------
+    # Writes
+    # -------------------------------
+    def add(self, patient_id, data, time_stamp=None, ext='jpg'):
+        """Store one frame (encoded image bytes); returns its record"""
+        time_stamp = pd.Timestamp(time_stamp if time_stamp is not None else pd.Timestamp.now())
+        shard = shard_name(time_stamp)
+        state = self._shard(patient_id, shard)
+        directory = self.shard_dir(patient_id, shard)
+        os.makedirs(directory, exist_ok=True)
+        with state['lock']:
+            while True:
+                seq = state['next_seq']
+                state['next_seq'] += 1
+                filename = f'{seq:06d}.{ext}'
+                try:
+                    fd = os.open(os.path.join(directory, filename), os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+                    break
+                except FileExistsError:
+                    continue  # taken by another process writing this shard
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            line = f'{seq},{time_stamp.isoformat(sep=" ")},{filename}\n'
+            with open(os.path.join(directory, INDEX_FILE), 'a', encoding='utf-8') as f:
+                f.write(line)
+            self._read_index(patient_id, shard, state)
+            state['dirty'] = True
+            self.writes += 1
+        if self.backend is not None:
+            self.backend.put(self.backend.key(patient_id, shard, filename), data)
+        return self._record(patient_id, shard, seq, filename, time_stamp.value)
+
+    def sync(self):
+        """Upload the indexes of shards written since the last sync"""
+        if self.backend is None:
+            return
+        for (patient_id, shard), state in list(self._shards.items()):
+            if not state['dirty']:
+                continue
+            state['dirty'] = False
+            with open(os.path.join(self.shard_dir(patient_id, shard), INDEX_FILE), 'rb') as f:
+                self.backend.put(self.backend.key(patient_id, shard, INDEX_FILE), f.read())
+
+    def start_sync(self, interval_seconds=60):
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"❌ Frame index upload failed: {e}")
+        threading.Thread(target=loop, daemon=True).start()
+
+    # -------------------------------
+    # Lookups
+    # -------------------------------
+    def _record(self, patient_id, shard, seq, filename, time_ns):
+        return {'patient_id': str(patient_id), 'seq': int(seq), 'shard': shard,
+                'time_stamp': pd.Timestamp(int(time_ns)).isoformat(sep=' '),
+                'path': os.path.join(self.shard_dir(patient_id, shard), filename)}
+
+    def nearest(self, patient_id, timestamps, tolerance=timedelta(minutes=15)):
+        """
+        For each requested time (e.g. the list_date x list_time slots from
+        combine_data_and_time) the record of the closest frame within tolerance
+        (None for no limit), with 'requested_time' added. Slots without a frame
+        are omitted.
+        """
+        tolerance_ns = None if tolerance is None else pd.Timedelta(tolerance).value
+        shards = self.shards(patient_id)
+        records = []
+        for requested in timestamps:
+            target = pd.Timestamp(requested)
+            candidates = shards
+            if tolerance_ns is not None:
+                # Months the tolerance window touches (slots near a month boundary look at both)
+                first, last = shard_name(target - pd.Timedelta(tolerance_ns)), shard_name(target + pd.Timedelta(tolerance_ns))
+                candidates = [shard for shard in shards if first <= shard <= last]
+            best = None
+            for shard in candidates:
+                state = self._shard(patient_id, shard)
+                with state['lock']:
+                    times, seqs = state['index'].nearest([target.value])
+                    if not len(times):
+                        continue
+                    distance = abs(int(times[0]) - target.value)
+                    if best is None or distance < best[0]:
+                        best = (distance, shard, int(seqs[0]), state['files'][int(seqs[0])], int(times[0]))
+            if best is None or (tolerance_ns is not None and best[0] > tolerance_ns):
+                continue
+            record = self._record(patient_id, *best[1:])
+            record['requested_time'] = target.isoformat(sep=' ')
+            records.append(record)
+        return records
+
+    def latest(self, patient_id):
+        """Record of the newest frame of a patient, or None"""
+        for shard in reversed(self.shards(patient_id)):
+            state = self._shard(patient_id, shard)
+            with state['lock']:
+                times, seqs = state['index'].arrays()
+                if len(times):
+                    seq = int(seqs[-1])
+                    return self._record(patient_id, shard, seq, state['files'][seq], int(times[-1]))
+        return None
+
+    def query(self, patient_id, start=None, end=None):
+        """Records of the frames with start <= time <= end, oldest first"""
+        start_ns = None if start is None else to_epoch_ns(start)
+        end_ns = None if end is None else to_epoch_ns(end)
+        first = None if start is None else shard_name(start)
+        last = None if end is None else shard_name(end)
+        records = []
+        for shard in self.shards(patient_id):
+            if (first and shard < first) or (last and shard > last):
+                continue
+            state = self._shard(patient_id, shard)
+            with state['lock']:
+                times, seqs = state['index'].arrays()
+                lo = 0 if start_ns is None else np.searchsorted(times, start_ns, side='left')
+                hi = len(times) if end_ns is None else np.searchsorted(times, end_ns, side='right')
+                records.extend(self._record(patient_id, shard, int(seq), state['files'][int(seq)], int(t))
+                               for t, seq in zip(times[lo:hi], seqs[lo:hi]))
+        return records
+
+    def local_path(self, record):
+        """Path of a frame on this host, downloading it from the backend when missing (None if unavailable)"""
+        path = record['path']
+        if os.path.exists(path) or self.backend is None:
+            return path if os.path.exists(path) else None
+        data = self.backend.get(self.backend.key(record['patient_id'], record['shard'], os.path.basename(path)))
+        if data is None:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.downloads += 1
+        return path
+
+    def stats(self):
+        return {
+            'shards_loaded': len(self._shards),
+            'frames_indexed': sum(len(state['index']) for state in self._shards.values()),
+            'writes': self.writes,
+            'downloads': self.downloads,
+            'backend': type(self.backend).__name__ if self.backend is not None else None,
+        }
@@ -0,0 +1,24 @@
+# gunicorn.conf.py
+import os
+
+# eventlet workers serve the SocketIO long-lived connections
+worker_class = 'eventlet'
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+timeout = 120
+
+if workers > 1 and os.environ.get('STATE_BACKEND', 'memory://').startswith('memory://'):
+    print("⚠️ WEB_CONCURRENCY > 1 with the in-process state backend: workers will not share vitals, "
+          "alerts or Pi connections (set STATE_BACKEND to sqlite:///... or redis://...)")
+
+
+def post_worker_init(worker):
+    """Each worker joins the Pi connection leader election once it has loaded the app"""
+    from app import start_background_services
+    start_background_services()
+
+
+def worker_exit(server, worker):
+    """Stop the worker's plot render processes with it"""
+    from app import plot_renderer
+    plot_renderer.shutdown(wait=True)
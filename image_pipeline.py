@@ -0,0 +1,214 @@
+# image_pipeline.py
+import base64
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, features
+
+# Longest side the API works from for each detail level: 'low' is a single 512px tile, 'high' fits 2048px
+DETAIL_SIZES = {'low': 512, 'high': 2048}
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+
+def encode_image(path, max_side, image_format='JPEG', quality=85):
+    """
+    Downscale an image file so its longest side is at most max_side and encode it.
+    JPEG sources are decoded at reduced scale (draft mode) when that is enough.
+    Returns (encoded bytes, width, height).
+    """
+    with Image.open(path) as image:
+        if image.format == 'JPEG':
+            image.draft('RGB', (max_side, max_side))
+        image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+        if image_format != 'PNG' and image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, 'white')  # JPEG has no alpha; flatten onto white
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        buffered = BytesIO()
+        image.save(buffered, format=image_format, quality=quality, optimize=image_format == 'JPEG')
+        return buffered.getvalue(), image.width, image.height
+
+
+def dhash(path, hash_size=8):
+    """
+    Difference hash of an image file: the grayscale image shrunk to
+    (hash_size + 1) x hash_size, one bit per horizontally adjacent pixel pair
+    (left brighter than right). Near-identical frames differ in a few bits.
+    """
+    with Image.open(path) as image:
+        if image.format == 'JPEG':
+            image.draft('L', (hash_size * 16, hash_size * 16))
+        pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (hash_size + 1) + col + 1])
+    return bits
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _green_threads():
+    """Whether eventlet has patched threading (threads would then all share one OS thread)"""
+    eventlet_patcher = sys.modules.get('eventlet.patcher')
+    return eventlet_patcher is not None and eventlet_patcher.is_monkey_patched('thread')
+
+
+class ImageEncoder():
+    """
+    Vision API payloads for local image files, encoded once and cached.
+
+    Each image is downscaled to the size the API works from at the requested
+    detail level and encoded as JPEG (or WebP) instead of a full-size PNG, then
+    kept as a base64 data URL keyed by path + mtime + size, so a camera frame
+    that is asked about again costs nothing and a replaced file is re-encoded.
+    The cache is LRU, bounded by the total size of the data URLs. Several frames
+    are encoded in parallel: Pillow releases the GIL while decoding, resizing
+    and encoding, so OS threads scale (eventlet's thread pool under the app).
+    """
+
+    def __init__(self, image_format='JPEG', quality=85, max_bytes=32 * 1024 * 1024, max_workers=4):
+        image_format = image_format.upper()
+        if image_format == 'WEBP' and not features.check('webp'):
+            print("⚠️ Pillow was built without WebP support, encoding vision images as JPEG")
+            image_format = 'JPEG'
+        self.image_format = image_format
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.source_bytes = 0   # size of the files encoded on misses
+        self.encoded_bytes = 0  # size of the data URLs they produced
+        self.encode_seconds = 0.0
+        self._entries = OrderedDict()  # (path, mtime_ns, size, detail) -> entry
+        self._current = {}  # (path, detail) -> key of the latest version encoded
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    # -------------------------------
+    # Encoding
+    # -------------------------------
+    def encode(self, path, detail='low'):
+        """
+        {'url', 'detail', 'bytes', 'width', 'height', 'encode_ms', 'cached'} for one
+        image file; raises FileNotFoundError (or Pillow's errors) like Image.open
+        """
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, detail)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry, cached=True)
+
+        start = time.perf_counter()
+        data, width, height = encode_image(path, DETAIL_SIZES.get(detail, DETAIL_SIZES['low']),
+                                           self.image_format, self.quality)
+        url = f"data:{MIME_TYPES[self.image_format]};base64,{base64.b64encode(data).decode('ascii')}"
+        entry = {'url': url, 'detail': detail, 'bytes': len(url), 'width': width, 'height': height,
+                 'encode_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+        with self._lock:
+            self.misses += 1
+            self.source_bytes += st.st_size
+            self.encoded_bytes += len(url)
+            self.encode_seconds += time.perf_counter() - start
+            if key not in self._entries:
+                stale = self._entries.pop(self._current.get((key[0], detail)), None)  # the file was replaced
+                if stale is not None:
+                    self._bytes -= stale['bytes']
+                self._entries[key] = entry
+                self._current[(key[0], detail)] = key
+                self._bytes += len(url)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted['bytes']
+                self._current.pop((evicted_key[0], evicted_key[3]), None)
+                self.evictions += 1
+        return dict(entry, cached=False)
+
+    def encode_many(self, paths, detail='low'):
+        """
+        encode() every path, in parallel; each result is the entry or the
+        exception raised for that path
+        """
+        def encode_one(path):
+            try:
+                return self.encode(path, detail)
+            except Exception as e:
+                return e
+
+        paths = list(paths)
+        if len(paths) <= 1:
+            return [encode_one(path) for path in paths]
+        if _green_threads():
+            from eventlet import GreenPool, tpool
+            return list(GreenPool(self.max_workers).imap(lambda path: tpool.execute(encode_one, path), paths))
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='image-encoder')
+        return list(self._pool.map(encode_one, paths))
+
+    # -------------------------------
+    # Stats
+    # -------------------------------
+    def stats(self):
+        misses = self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'format': self.image_format,
+            'hits': self.hits,
+            'misses': misses,
+            'evictions': self.evictions,
+            'source_bytes': self.source_bytes,
+            'encoded_bytes': self.encoded_bytes,
+            'mean_encode_ms': round(self.encode_seconds / misses * 1000, 1) if misses else None,
+        }
+
+
+# ==================== Benchmark ====================
+if __name__ == '__main__':
+    import tempfile
+
+    import numpy as np
+
+    # Camera-like frames (noise compresses like a real photo, unlike a flat test card)
+    tmp_dir = tempfile.mkdtemp()
+    paths = []
+    for i in range(4):
+        pixels = np.random.default_rng(i).integers(0, 255, (1080, 1920, 3), dtype=np.uint8)
+        path = os.path.join(tmp_dir, f'frame_{i}.png')
+        Image.fromarray(pixels).resize((480, 270)).resize((1920, 1080)).save(path)
+        paths.append(path)
+
+    def full_png(path):
+        buffered = BytesIO()
+        Image.open(path).save(buffered, format='PNG')
+        return len(base64.b64encode(buffered.getvalue()))
+
+    start = time.perf_counter()
+    png_bytes = sum(full_png(path) for path in paths)
+    png_ms = (time.perf_counter() - start) * 1000
+    print(f"full-size PNG per call:    {png_bytes / 1024:.0f} KiB, {png_ms:.0f} ms")
+
+    encoder = ImageEncoder()
+    for label in ('first call (encode):', 'repeat call (cached):'):
+        start = time.perf_counter()
+        entries = encoder.encode_many(paths)
+        print(f"{label:<26} {sum(e['bytes'] for e in entries) / 1024:.0f} KiB, "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
+    print(encoder.stats())
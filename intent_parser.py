@@ -0,0 +1,310 @@
+# intent_parser.py
+import re
+from datetime import datetime, timedelta
+
+from config import SENSOR_COLUMNS
+
+ALL_SIGNALS = [c for c in SENSOR_COLUMNS if c != 'time_stamp']
+
+
+def _axes(prefix):
+    return [f'{prefix}_x', f'{prefix}_y', f'{prefix}_z']
+
+
+# Synonyms from SYSTEM_PROMPT_INTENT_DETECTION, most specific first (matched text is consumed)
+SIGNAL_SYNONYMS = [
+    (r'all (?:the )?(?:sensors?|data|signals|sensor data|measurements)', ALL_SIGNALS),
+    (r'heart\s*rates?|heart\s*beats?|cardiac rate|pulse|\bbpm\b|\bhr\b', ['heart_rate']),
+    (r'step counts?|\bsteps?\b|walking|movement activity', ['steps']),
+    (r'linear acc\w*', _axes('linear_accel')),
+    (r'acceleromet\w*|accelerations?|\bmotion\b', _axes('accelerometer')),
+    (r'gyro\w*|rotation rate', _axes('gyroscope')),
+    (r'gravity(?: vector)?', _axes('gravity')),
+    (r'orientation|quaternion|\brotation\b', [f'rotation_{i}' for i in range(5)]),
+    (r'(?:ambient |device )?temperature|\btemp\b', ['temperature']),
+    (r'(?:atmospheric |air |barometric )?pressure', ['pressure']),
+    (r'ambient light|light level|brightness|\blight\b|\blux\b', ['light']),
+    (r'proximity(?: sensor)?', ['proximity']),
+]
+# Measurements the wearable does not record; only the LLM (or the Pi path) can make sense of these
+UNSUPPORTED = r'blood pressure|\bbp\b|spo2|oxygen|saturation|glucose|sugar|respirat\w*|breathing|\becg\b|\bekg\b'
+
+RECOGNITION = r'activit(?:y|ies)|emotions?|\bmood\b|feeling|\bdoing\b|recogni[sz]\w*|behaviou?r|\bstate of mind\b'
+IMAGE = r'\bimages?\b|photos?|pictures?|camera|snapshots?|\bframes?\b|footage|\bsee (?:him|her|them|the patient)\b'
+PLOT = r'\bplot\w*|graph\w*|charts?|visuali[sz]\w*|\bdraw\b|trends?|history|variation|over time'
+NEGATION = r"\bnot\b|n't\b|\bexcept\b|\bwithout\b|\bexclud\w*|\bother than\b"
+# Temporal words the parser does not understand; any left over after parsing lowers the confidence
+TEMPORAL_CUES = (r'\b(?:since|between|before|after|until|till|ago|weekend|month|year|week|days?|hours?|minutes?)\b|'
+                 r'\b(?:yesterday|today|tonight|morning|afternoon|evening|night|earlier|later)\b|'
+                 r'\b(?:breakfast|lunch|dinner|woke|wake|sleep\w*|o\'?clock)\b|\d')
+
+# Sessions of the day as defined in SYSTEM_PROMPT_INTENT_DETECTION (start hour, end hour)
+SESSIONS = {'morning': (5, 12), 'afternoon': (12, 17), 'evening': (17, 21), 'night': (21, 28)}
+NUMBER_WORDS = {'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+                'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'fifteen': 15, 'twenty': 20,
+                'thirty': 30, 'forty-five': 45, 'few': 3, 'couple of': 2}
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october',
+          'november', 'december']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+UNIT_MINUTES = {'min': 1, 'h': 60, 'day': 1440, 'week': 7 * 1440, 'month': 30 * 1440}
+# Longest relative spans the rules expand ("last N days" into dates, "last N hours" into 30-minute
+# slots, "N ... ago"); anything longer goes to the LLM
+MAX_RELATIVE_MINUTES = 366 * 1440
+MAX_WINDOW_MINUTES = 7 * 1440
+
+_NUMBER = r'(\d+|' + '|'.join(sorted(NUMBER_WORDS, key=len, reverse=True)) + r')'
+_MONTH = r'(' + '|'.join(m[:3] + r'[a-z]*' for m in MONTHS) + r')\.?'
+
+
+class _Text():
+    """Lower-cased question whose matched spans are blanked out as they are parsed"""
+
+    def __init__(self, question):
+        self.text = ' ' + question.lower() + ' '
+
+    def take(self, pattern):
+        """All matches of pattern; their text is consumed so later patterns cannot reuse it"""
+        matches = list(re.finditer(pattern, self.text))
+        for m in reversed(matches):
+            self.text = self.text[:m.start()] + ' ' * (m.end() - m.start()) + self.text[m.end():]
+        return matches
+
+    def has(self, pattern):
+        return re.search(pattern, self.text) is not None
+
+
+def _number(word):
+    return int(word) if word.isdigit() else NUMBER_WORDS[word]
+
+
+def _unit_minutes(unit):
+    return next(minutes for prefix, minutes in UNIT_MINUTES.items() if unit.startswith(prefix))
+
+
+def _slots(start, end):
+    """30-minute slot times (hh:mm:ss) from start to end inclusive, with the dates they fall on"""
+    t = start.replace(minute=start.minute - start.minute % 30, second=0, microsecond=0)
+    dates, times = [], []
+    while t <= end:
+        if t.strftime('%Y-%m-%d') not in dates:
+            dates.append(t.strftime('%Y-%m-%d'))
+        if t.strftime('%H:%M:%S') not in times:
+            times.append(t.strftime('%H:%M:%S'))
+        t += timedelta(minutes=30)
+    return dates, times
+
+
+def _session_times(session):
+    start, end = SESSIONS[session]
+    return [f'{(h // 2) % 24:02d}:{(h % 2) * 30:02d}:00' for h in range(start * 2, end * 2)]
+
+
+def _relative_minutes(number, unit, limit=MAX_RELATIVE_MINUTES):
+    """Minutes of 'N <unit>', or None beyond limit"""
+    minutes = (_number(number) if number else 1) * _unit_minutes(unit)
+    return minutes if minutes <= limit else None
+
+
+def _parse_time_of_day(text):
+    """
+    Explicit clock times ('10am', '3:30 pm', '14:00', 'noon'). Returns
+    (hh:mm:ss strings, invalid): invalid counts impossible times ('25am', '3:75 pm').
+    """
+    times = []
+    invalid = 0
+    for m in text.take(r'\b(?:at |around |about )?(\d{1,2})(?::(\d{2}))?\s*(a\.?m\.?|p\.?m\.?)(?=\W)'):
+        if not 1 <= int(m.group(1)) <= 12 or int(m.group(2) or 0) > 59:
+            invalid += 1
+            continue
+        hour, minute = int(m.group(1)) % 12, int(m.group(2) or 0)
+        if m.group(3).startswith('p'):
+            hour += 12
+        times.append(f'{hour:02d}:{minute:02d}:00')
+    for m in text.take(r'\b(?:at |around |about )?([01]?\d|2[0-3]):([0-5]\d)(?::[0-5]\d)?\b'):
+        times.append(f'{int(m.group(1)):02d}:{m.group(2)}:00')
+    for m in text.take(r'\b(?:at |around )?(noon|midday|midnight)\b'):
+        times.append('00:00:00' if m.group(1) == 'midnight' else '12:00:00')
+    return times, invalid
+
+
+def _parse_dates(text, now):
+    """
+    Explicit and relative days ('2024-03-05', 'March 5', 'yesterday', 'last 3 days', 'on monday').
+    Returns (dates, invalid): invalid counts explicit dates that do not exist ('February 30')
+    and relative windows longer than MAX_RELATIVE_MINUTES ('last 100000 weeks').
+    """
+    today = now.date()
+    dates = []
+    invalid = 0
+    for m in text.take(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b'):
+        try:
+            dates.append(datetime(int(m.group(1)), int(m.group(2)), int(m.group(3))).date())
+        except ValueError:
+            invalid += 1
+    for m in text.take(r'\b' + _MONTH + r'\s+(\d{1,2})(?:st|nd|rd|th)?\b') + \
+            text.take(r'\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?' + _MONTH):
+        month_name, day = (m.group(1), m.group(2)) if not m.group(1).isdigit() else (m.group(2), m.group(1))
+        month = next(i + 1 for i, name in enumerate(MONTHS) if name.startswith(month_name[:3]))
+        try:
+            date = datetime(today.year, month, int(day)).date()
+            dates.append(date if date <= today else date.replace(year=today.year - 1))
+        except ValueError:
+            invalid += 1
+    for m in text.take(r'\b(?:in the |over the |during the |for the )?(?:last|past|previous)\s+(?:' + _NUMBER +
+                       r'\s+)?(day|week|month)s?\b'):
+        minutes = _relative_minutes(m.group(1), m.group(2))
+        if minutes is None:
+            invalid += 1
+            continue
+        days = minutes // 1440
+        dates.extend(today - timedelta(days=d) for d in range(days - 1, -1, -1))
+    for m in text.take(r'\bthis week\b'):
+        dates.extend(today - timedelta(days=d) for d in range(today.weekday(), -1, -1))
+    for m in text.take(r'\b' + _NUMBER + r'\s+days?\s+ago\b'):
+        minutes = _relative_minutes(m.group(1), 'day')
+        if minutes is None:
+            invalid += 1
+            continue
+        dates.append(today - timedelta(minutes=minutes))
+    for m in text.take(r'\b(?:on\s+|last\s+)?(' + '|'.join(WEEKDAYS) + r')\b'):
+        back = (today.weekday() - WEEKDAYS.index(m.group(1))) % 7 or 7
+        dates.append(today - timedelta(days=back))
+    for _ in text.take(r'\bday before yesterday\b'):
+        dates.append(today - timedelta(days=2))
+    for _ in text.take(r'\byesterday\b|\blast night\b'):
+        dates.append(today - timedelta(days=1))
+    for _ in text.take(r'\btoday\b|\btonight\b|\bthis (?:morning|afternoon|evening)\b'):
+        dates.append(today)
+    return [d.strftime('%Y-%m-%d') for d in sorted(set(dates))], invalid
+
+
+def parse_intent(question, now=None):
+    """
+    Deterministic intent detection for the common question shapes.
+    Returns (intent_dict, confidence): intent_dict has the same keys as the LLM
+    intent (patient_id, list_date, list_time, vital_sign, is_plot, recognition,
+    is_image) and confidence in [0, 1] says how completely the question was
+    understood; below INTENT_CONFIDENCE_THRESHOLD the caller should ask the LLM.
+    """
+    now = now or datetime.now()
+    text = _Text(question)
+    confidence = 1.0
+
+    # Patient: 5-digit ID, or "patient 12" padded to the ID format
+    patient_id = ''
+    ids = text.take(r'\b\d{5}\b')
+    short_ids = text.take(r'\bpatient\s*(?:id|no\.?|number|#)?\s*(\d{1,4})\b')
+    if ids:
+        patient_id = ids[0].group(0)
+    elif short_ids:
+        patient_id = short_ids[0].group(1).zfill(5)
+    if len({m.group(0) for m in ids}) > 1:
+        confidence -= 0.5  # several patients in one question
+
+    if text.take(UNSUPPORTED):
+        confidence -= 0.5
+    vital_sign = []
+    for pattern, signals in SIGNAL_SYNONYMS:
+        if text.take(pattern):
+            vital_sign.extend(s for s in signals if s not in vital_sign)
+    recognition = bool(text.take(RECOGNITION))
+    is_image = bool(text.take(IMAGE))
+    is_plot = bool(text.take(PLOT)) or (bool(vital_sign) and not is_image and bool(text.take(r'\bshow\b')))
+    if text.has(NEGATION):
+        confidence -= 0.4
+    if not (vital_sign or recognition or is_image):
+        confidence -= 0.6  # nothing to retrieve: general question, or phrasing we do not know
+
+    # Time: relative windows become 30-minute slots, sessions their slots, clock times a slot each
+    list_date, list_time = [], []
+    window = text.take(r'\b(?:in the |over the |during the |for the |within the )?(?:last|past|previous)\s+(?:' +
+                       _NUMBER + r'\s+)?(min(?:ute)?|h(?:ou)?r)s?\b')
+    ago = text.take(r'\b' + _NUMBER + r'\s+(min(?:ute)?|h(?:ou)?r)s?\s+ago\b')
+    spans = [_relative_minutes(m.group(1), m.group(2), MAX_WINDOW_MINUTES) for m in window]
+    if None in spans:
+        confidence -= 0.6  # a window too long to expand into slots: let the LLM interpret it
+    elif window:
+        list_date, list_time = _slots(now - timedelta(minutes=max(spans)), now)
+    for m in ago:
+        minutes = _relative_minutes(m.group(1), m.group(2))
+        if minutes is None:
+            confidence -= 0.6
+            continue
+        dates, times = _slots(now - timedelta(minutes=minutes), now - timedelta(minutes=minutes))
+        list_date, list_time = sorted(set(list_date + dates)), list_time + times
+
+    if not window:
+        sessions = [s for s in SESSIONS if text.has(rf'\b{s}\b')] + (['night'] if text.has(r'\btonight\b') else [])
+        dates, invalid_dates = _parse_dates(text, now)
+        list_date = sorted(set(list_date + dates))
+        if invalid_dates:
+            confidence -= 0.6  # a date that does not exist or too long a span: let the LLM interpret the question
+        text.take(r'\b(?:in the |during the |this |that |at |last |yesterday |tonight)?(?:morning|afternoon|evening|night)\b')
+        clock_times, invalid_times = _parse_time_of_day(text)
+        if invalid_times:
+            confidence -= 0.6  # '25am'
+        for session in sessions if not clock_times else []:  # "9am this morning" is just 9am
+            list_time += [t for t in _session_times(session) if t not in list_time]
+        list_time += clock_times
+        if list_time and not list_date:
+            list_date = [now.strftime('%Y-%m-%d')]
+    text.take(r'\b(?:right )?now\b|\bcurrent(?:ly)?\b|\blatest\b|\bat the moment\b|\bmost recent\b|\brecent\b')
+
+    if text.has(TEMPORAL_CUES):
+        confidence -= 0.4  # a time expression we could not parse
+    intent_dict = {
+        'patient_id': patient_id,
+        'list_date': list_date,
+        'list_time': list_time,
+        'vital_sign': vital_sign,
+        'is_plot': is_plot,
+        'recognition': recognition,
+        'is_image': is_image,
+    }
+    return intent_dict, round(max(confidence, 0.0), 2)
+
+
+# ==================== Corpus report ====================
+if __name__ == '__main__':
+    import json
+    import sys
+    import time
+
+    from config_nlp_engine import INTENT_CONFIDENCE_THRESHOLD
+
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else 'intent_corpus.jsonl'
+    with open(corpus_path) as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    hits = correct = false_hits = 0
+    latencies = []
+    for item in corpus:
+        now = datetime.fromisoformat(item['now'])
+        start = time.perf_counter()
+        intent, confidence = parse_intent(item['question'], now)
+        latencies.append(time.perf_counter() - start)
+        expected = item['expected']
+        if confidence < INTENT_CONFIDENCE_THRESHOLD:
+            continue
+        hits += 1
+        if expected is None:
+            false_hits += 1
+            print(f"  answered, should defer: {item['question']!r} -> {intent}")
+            continue
+        mismatched = [k for k, v in expected.items()
+                      if (sorted(intent[k]) if k == 'vital_sign' else intent[k]) != (sorted(v) if k == 'vital_sign' else v)]
+        if mismatched:
+            print(f"  wrong {mismatched}: {item['question']!r} -> {intent}")
+        else:
+            correct += 1
+
+    latencies_us = sorted(t * 1e6 for t in latencies)
+    answerable = sum(item['expected'] is not None for item in corpus)
+    print(f"questions:        {len(corpus)} ({answerable} labelled answerable by rules, "
+          f"{len(corpus) - answerable} labelled for the LLM)")
+    print(f"rule hit rate:    {hits / len(corpus):.1%} of all questions "
+          f"({hits} answered locally at confidence >= {INTENT_CONFIDENCE_THRESHOLD})")
+    print(f"hit accuracy:     {correct}/{hits} correct, {false_hits} should have gone to the LLM")
+    print(f"recall:           {correct}/{answerable} answerable questions handled without the LLM")
+    print(f"latency:          mean {sum(latencies_us) / len(latencies_us):.0f} us, "
+          f"p95 {latencies_us[int(0.95 * (len(latencies_us) - 1))]:.0f} us per question")
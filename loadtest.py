@@ -0,0 +1,123 @@
+# loadtest.py
+"""
+Throughput of the app under gunicorn at different worker counts.
+
+    python loadtest.py --workers 1,2,4 --duration 15 --concurrency 32
+
+For each worker count a gunicorn server is started (eventlet workers, shared
+SQLite state backend), --samples one-second samples are seeded through /sensor_data/bulk,
+then client threads hammer /api/series (a partition read + downsampling per
+request) for the given duration. Reports requests/s and p50 / p95 latency.
+Each run seeds its own patient (99<workers>) and removes its partitions afterwards.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+
+def wait_until_up(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/pi_status', timeout=2).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def seed(base_url, patient_id, samples):
+    now = datetime.now()
+    rows = [{'time_stamp': (now - timedelta(seconds=samples - i)).isoformat(),
+             'sensors': {'heart_rate': random.randint(55, 110), 'steps': i}}
+            for i in range(samples)]
+    for i in range(0, samples, 5000):
+        body = '\n'.join(json.dumps(row) for row in rows[i:i + 5000])
+        requests.post(f'{base_url}/sensor_data/bulk?patient_id={patient_id}', data=body, timeout=60).raise_for_status()
+
+
+def hammer(url, deadline, latencies, errors):
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            requests.get(url, timeout=30).raise_for_status()
+            latencies.append(time.perf_counter() - started)
+        except requests.RequestException:
+            errors.append(1)
+
+
+def run(workers, args):
+    base_url = f'http://127.0.0.1:{args.port}'
+    patient_id = f'99{workers:03d}'
+    state_dir = tempfile.mkdtemp(prefix='remoni_state_')
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PORT=str(args.port),
+               STATE_BACKEND=f'sqlite:///{os.path.join(state_dir, "state.db")}', RASPBERRY_PI_URLS='')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        if not wait_until_up(base_url):
+            raise RuntimeError(f'gunicorn with {workers} workers did not come up')
+        seed(base_url, patient_id, args.samples)
+        url = f'{base_url}/api/series?patient_id={patient_id}&signals=heart_rate,steps&minutes=1440&width=800'
+        for _ in range(workers * 4):
+            requests.get(url, timeout=30)  # warm every worker's caches
+
+        latencies, errors = [], []
+        deadline = time.time() + args.duration
+        threads = [threading.Thread(target=hammer, args=(url, deadline, latencies, errors))
+                   for _ in range(args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        latencies.sort()
+        n = len(latencies)
+        return {
+            'workers': workers,
+            'requests': n,
+            'errors': len(errors),
+            'req_per_s': round(n / args.duration, 1),
+            'p50_ms': round(latencies[n // 2] * 1000, 1) if n else None,
+            'p95_ms': round(latencies[int(n * 0.95)] * 1000, 1) if n else None,
+        }
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(server.pid, signal.SIGKILL)  # workers still draining long-lived connections
+            server.wait()
+        shutil.rmtree(os.path.join('static', 'local_data', 'sensor_data', patient_id), ignore_errors=True)
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the app at several gunicorn worker counts')
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    parser.add_argument('--duration', type=float, default=15, help='seconds of load per worker count')
+    parser.add_argument('--concurrency', type=int, default=32, help='client threads')
+    parser.add_argument('--samples', type=int, default=20000, help='samples seeded before the run')
+    parser.add_argument('--port', type=int, default=5077)
+    args = parser.parse_args()
+
+    print(f'CPU cores: {os.cpu_count()}')
+    for workers in args.workers.split(','):
+        r = run(int(workers), args)
+        print(f"workers={r['workers']:<3} {r['req_per_s']:>8} req/s  p50={r['p50_ms']} ms  "
+              f"p95={r['p95_ms']} ms  errors={r['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,20 @@
 import os
-import pandas as pd
 import json
 from datetime import datetime
 from config_nlp_engine import SYSTEM_PROMPT_INTENT_DETECTION, \
     SYSTEM_PROMPT_VISION, \
     SYSTEM_PROMPT_ENDPOINT, \
     TEXT_ENDPOINT_FORMAT, \
-    INPUT_VISION
+    INPUT_VISION, \
+    INTENT_CONFIDENCE_THRESHOLD, \
+    VISION_HASH_THRESHOLD, \
+    VISION_CACHE_TTL
 
 from utils import *
-from request_to_openai import gpt
+from request_to_openai import gpt, INTENT_CACHE_TTL
+from intent_parser import parse_intent
+from patient_registry import PatientRegistry
+from vision_cache import VisionCache
 
 system_prompt_intent_detection = SYSTEM_PROMPT_INTENT_DETECTION  # .format(current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 system_prompt_vision = SYSTEM_PROMPT_VISION
@@ -17,7 +22,10 @@ system_prompt_endpoint = SYSTEM_PROMPT_ENDPOINT
 text_endpoint_format = TEXT_ENDPOINT_FORMAT
 # .format(patient_id, name, sex, address, phone, dob, age, image_description, vital_signs_data, question)
 
-patient_meta_df = pd.read_csv('./static/local_data/fake_patient_meta_data.csv')
+# Shared by every engine instance; re-read only when the file changes
+patient_registry = PatientRegistry('./static/local_data/fake_patient_meta_data.csv')
+# Descriptions of (near-)identical camera frames are reused instead of calling the vision model again
+vision_cache = VisionCache(threshold=VISION_HASH_THRESHOLD, ttl=VISION_CACHE_TTL)
 
 
 class nlp_engine():
@@ -28,23 +36,34 @@ class nlp_engine():
         self.vital_signs_text = 'None'
         self.show_data_list = []
         self.intent_dict = {}
-        self.patient_meta_df = pd.read_csv('./static/local_data/fake_patient_meta_data.csv')
+        self.intent_confidence = None
+        self.intent_source = None
 
     def intent_detection(self, doctor_question):
         if not doctor_question:
             return False
 
-        intent = gpt(
-            system_prompt=SYSTEM_PROMPT_INTENT_DETECTION.format(
-                current_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")), \
-            text=doctor_question, \
-            model_name="gpt-3.5-turbo", \
-            temperature=0.1
-        )
-        intent_dict = json.loads(intent)
+        # Common question shapes are parsed locally; the LLM only sees the ones the rules are unsure about
+        intent_dict, self.intent_confidence = parse_intent(doctor_question)
+        self.intent_source = 'rules'
+        if self.intent_confidence < INTENT_CONFIDENCE_THRESHOLD:
+            intent = gpt(
+                system_prompt=SYSTEM_PROMPT_INTENT_DETECTION.format(
+                    current_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")), \
+                text=doctor_question, \
+                model_name="gpt-3.5-turbo", \
+                temperature=0.1, \
+                cache_ttl=INTENT_CACHE_TTL, \
+                cache_similar=True
+            )
+            try:
+                intent_dict = json.loads(intent)
+                self.intent_source = 'llm'
+            except json.JSONDecodeError:
+                print(f'❌ Unparseable LLM intent, using the rule-based intent: {intent}')
         self.intent_dict = intent_dict
 
-        print('=========INTENT==========')
+        print(f'=========INTENT ({self.intent_source}, confidence {self.intent_confidence})==========')
         print(intent_dict)
         return True
 
@@ -59,33 +78,40 @@ class nlp_engine():
             if not os.path.exists(image_path):
                 return 'Can not find image'
 
-        image_description = gpt(
+        image_description = vision_cache.describe(image_path_list, lambda paths: gpt(
             text=INPUT_VISION,
             model_name="gpt-4-vision-preview",
-            image_path=image_path_list,
+            image_path=paths,
             ############################# TODO: change image path  ############################
             system_prompt=SYSTEM_PROMPT_VISION,
             temperature=0.4
-        )
+        ), context=INPUT_VISION)
         self.image_description = image_description
         return self.image_description
 
-    def endpoint_llm(self, patient_info, doctor_question):
-        text_endpoint = TEXT_ENDPOINT_FORMAT.format(
+    def endpoint_prompt(self, patient_info, doctor_question, summary_text=None):
+        # patient_info: registry record of the patient (looked up from self.patient_id when None)
+        # summary_text: fixed-size patient summary (PatientSummaries.to_text) used as the vital signs data
+        if patient_info is None:
+            patient_info = patient_registry.get(self.patient_id) or {}
+        return TEXT_ENDPOINT_FORMAT.format(
             current_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             patient_id=self.patient_id,
-            name=patient_info['name'].values[0],
-            sex=patient_info['sex'].values[0],
-            address=patient_info['address'].values[0],
-            phone=patient_info['phone'].values[0],
-            dob=patient_info['birth'].values[0],
-            age=patient_info['age'].values[0],
+            name=patient_info.get('name', 'Unknown'),
+            sex=patient_info.get('sex', 'Unknown'),
+            address=patient_info.get('address', 'Unknown'),
+            phone=patient_info.get('phone', 'Unknown'),
+            dob=patient_info.get('birth', 'Unknown'),
+            age=patient_info.get('age', 'Unknown'),
             image_description=self.image_description,
-            vital_signs_data=self.vital_signs_text,
+            vital_signs_data=summary_text if summary_text else self.vital_signs_text,
             question=doctor_question,
             temperature=0.5
         )
 
+    def endpoint_llm(self, patient_info, doctor_question, summary_text=None):
+        text_endpoint = self.endpoint_prompt(patient_info, doctor_question, summary_text)
+
         print('=========TEXT ENDPOINT==========')
         print(text_endpoint)
 
@@ -97,16 +123,9 @@ class nlp_engine():
         )
         return output
 
-    # check if the id_str is a valid patient id
+    # check if the intent's patient id is a valid patient id
     def _is_valid_id(self):
-        if bool(re.match(r'^\d{5}$', self.intent_dict['patient_id'])):  # check if the id_str follow id format
-            if int(self.intent_dict['patient_id']) in self.patient_meta_df[
-                'patient_id'].values:  # check if the id_str appears in the current database
-                return True
-            else:
-                return False
-        else:
-            return False
+        return is_valid_id(self.intent_dict['patient_id'])
 
     # return the valid id to retrieve patient data
     def _ask_for_id(self):  # TODO: need to be updated to capable of working with flask
@@ -119,7 +138,7 @@ class nlp_engine():
 
             temp_patient_id = extract_patient_id_from_text(temp)
 
-            if is_valid_id(temp_patient_id, self.patient_meta_df):
+            if is_valid_id(temp_patient_id):
                 break
 
         return temp_patient_id
@@ -152,6 +171,11 @@ class nlp_engine():
             self.intent_dict['list_time'] = ['01:00:00', '07:00:00', '13:00:00', '19:00:00']
 
 
+# check if the id_str follows the id format and appears in the current database
+def is_valid_id(id_str):
+    return bool(re.match(r'^\d{5}$', str(id_str or ''))) and id_str in patient_registry
+
+
 '''
 def NLP_engine(doctor_question):
     # initialize variables
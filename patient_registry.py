@@ -0,0 +1,85 @@
+# patient_registry.py
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+def patient_key(patient_id):
+    """'00001', '1' and 1 are the same patient; None for IDs that are not numeric"""
+    try:
+        return int(str(patient_id).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+class PatientRegistry():
+    """
+    Patient metadata loaded once and indexed by patient_id.
+
+    Lookups and validation are dict lookups, so they stay O(1) however many
+    patients the metadata file holds. The file is re-read when its mtime or size
+    changes, checked at most every check_interval seconds; the new index is
+    built aside and swapped in, so readers never see a half-loaded registry. A
+    file that fails to parse keeps the previous index.
+    """
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._records = {}  # patient_key -> {column: value}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        """Re-read the metadata file if it changed since the last load; returns True if it was reloaded"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = self._file_signature()
+            if signature is None or signature == self._signature:
+                return False
+            try:
+                df = pd.read_csv(self.path)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Keeping previous patient metadata, {self.path} is unreadable: {e}")
+                return False
+            records = {}
+            for record in df.to_dict('records'):
+                key = patient_key(record.get('patient_id'))
+                if key is not None:
+                    records[key] = record
+            self._records = records
+            self._signature = signature
+            self.reloads += 1
+            print(f"👥 Loaded {len(records)} patients from {self.path}")
+            return True
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+
+    def get(self, patient_id):
+        """Metadata record of the patient, or None if unknown"""
+        self._maybe_reload()
+        return self._records.get(patient_key(patient_id))
+
+    def __contains__(self, patient_id):
+        return self.get(patient_id) is not None
+
+    def __len__(self):
+        self._maybe_reload()
+        return len(self._records)
+
+    def stats(self):
+        return {'patients': len(self), 'reloads': self.reloads, 'path': self.path}
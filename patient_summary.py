@@ -0,0 +1,280 @@
+# patient_summary.py
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from config import vital_sign_var_to_text
+
+# label -> minutes, summarised from the 1-minute rollups (kept for a day)
+SUMMARY_WINDOWS = {'10 min': 10, '1 h': 60, '24 h': 24 * 60}
+
+
+def _label(signal):
+    return vital_sign_var_to_text.get(signal, signal.replace('_', ' ').title())
+
+
+def _fmt(value):
+    """Compact number: one decimal for readings, three significant digits for small ones"""
+    if value is None:
+        return 'n/a'
+    if abs(value) >= 1 or value == 0:
+        return f'{value:.1f}'.rstrip('0').rstrip('.')
+    return f'{value:.3g}'
+
+
+def _trend(starts, means, present):
+    """
+    Least-squares slope of the per-minute means of every signal (units per
+    hour) and its direction: 'rising' / 'falling' when the slope is more than
+    twice its standard error, else 'steady' (None below three minutes of data)
+    """
+    hours = (starts - starts[0]) / 3.6e12 if len(starts) else starts.astype(float)
+    w = present.astype(float)
+    n = w.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y = np.where(present, means, 0.0)
+        x_mean = (w * hours[:, None]).sum(axis=0) / n
+        y_mean = (w * y).sum(axis=0) / n
+        dx = np.where(present, hours[:, None] - x_mean, 0.0)
+        dy = np.where(present, y - y_mean, 0.0)
+        sxx = (dx * dx).sum(axis=0)
+        slope = (dx * dy).sum(axis=0) / sxx
+        residual = ((dy - slope * dx) ** 2).sum(axis=0)
+        stderr = np.sqrt(residual / np.maximum(n - 2, 1) / sxx)
+    directions = []
+    for i in range(len(n)):
+        if n[i] < 3 or not np.isfinite(slope[i]):
+            directions.append(None)
+        elif abs(slope[i]) > 2 * stderr[i]:
+            directions.append('rising' if slope[i] > 0 else 'falling')
+        else:
+            directions.append('steady')
+    return slope, directions
+
+
+class PatientSummaries():
+    """
+    Per-patient status snapshot for broad "how is the patient doing" questions.
+
+    A snapshot holds the latest value of every sensor column and its mean / min
+    / max / sample count / trend over the last 10 minutes, hour and day. The
+    window statistics are folded from the 1-minute rollups (at most 1440
+    buckets), so building one costs the same whether the patient has an hour of
+    history or a year. Ingest only marks the patient dirty; dirty snapshots are
+    rebuilt by a background timer, and a read rebuilds one older than max_age
+    seconds. The Pi vitals and recent fall alerts / anomalies are looked up on
+    every read (in-memory lookups). to_text() renders a snapshot in a bounded
+    number of lines, so the prompt does not grow with the history.
+    """
+
+    def __init__(self, rollups, pi_bridge=None, fall_alerts=None, anomalies=None, max_age=30, recent_alerts=3):
+        self.rollups = rollups
+        self.pi_bridge = pi_bridge
+        self.fall_alerts = fall_alerts
+        self.anomalies = anomalies
+        self.max_age = max_age
+        self.recent_alerts = recent_alerts
+        self.builds = 0
+        self.hits = 0
+        self.build_seconds = 0.0
+        self._snapshots = {}  # patient_id -> (built_at, snapshot)
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    # -------------------------------
+    # Snapshots
+    # -------------------------------
+    def mark_dirty(self, patient_id):
+        with self._lock:
+            self._dirty.add(str(patient_id))
+
+    def build(self, patient_id):
+        """Rebuild and cache the sensor part of a patient's snapshot"""
+        patient_id = str(patient_id)
+        started = time.perf_counter()
+        with self._lock:
+            self._dirty.discard(patient_id)
+        now = pd.Timestamp.now()
+        signals = self.rollups.signals
+
+        # Latest value per signal: the newest 'last' across the daily buckets (all history)
+        _, (count, _, _, _, last, last_time) = self.rollups.arrays(patient_id, '1day')
+        latest = {}
+        if len(count):
+            newest = np.argmax(np.where(count > 0, last_time, np.iinfo(np.int64).min), axis=0)
+            for col, signal in enumerate(signals):
+                row = newest[col]
+                if count[row, col] > 0:
+                    latest[signal] = {'value': float(last[row, col]),
+                                      'time_stamp': pd.Timestamp(int(last_time[row, col])).isoformat(sep=' ')}
+
+        windows = {}
+        longest = max(SUMMARY_WINDOWS.values())
+        starts, (count, total, low, high, _, _) = self.rollups.arrays(patient_id, '1min',
+                                                                      now - pd.Timedelta(minutes=longest))
+        for label, minutes in SUMMARY_WINDOWS.items():
+            keep = starts + 60 * 10**9 > (now - pd.Timedelta(minutes=minutes)).value
+            w_count = count[keep]
+            n = w_count.sum(axis=0) if len(w_count) else np.zeros(len(signals))
+            if not n.any():
+                windows[label] = {}
+                continue
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = total[keep] / w_count
+            slope, directions = _trend(starts[keep], means, w_count > 0)
+            stats = {}
+            for col, signal in enumerate(signals):
+                if n[col] == 0:
+                    continue
+                stats[signal] = {
+                    'mean': round(float(total[keep][:, col].sum() / n[col]), 3),
+                    'min': float(low[keep][:, col].min()),
+                    'max': float(high[keep][:, col].max()),
+                    'count': int(n[col]),
+                    'trend': directions[col],
+                    'per_hour': round(float(slope[col]), 3) if directions[col] else None,
+                }
+            windows[label] = stats
+
+        snapshot = {'patient_id': patient_id, 'built_at': now.isoformat(sep=' ', timespec='seconds'),
+                    'latest': latest, 'windows': windows}
+        with self._lock:
+            self._snapshots[patient_id] = (time.time(), snapshot)
+            self.builds += 1
+            self.build_seconds += time.perf_counter() - started
+        return snapshot
+
+    def get(self, patient_id):
+        """Snapshot of a patient with the live Pi vitals, fall alerts and anomalies added"""
+        patient_id = str(patient_id)
+        with self._lock:
+            entry = self._snapshots.get(patient_id)
+        if entry is None or time.time() - entry[0] > self.max_age:
+            snapshot = self.build(patient_id)
+        else:
+            snapshot = entry[1]
+            self.hits += 1
+        summary = dict(snapshot, pi_vitals=None, fall_alerts=[], anomalies=[])
+        if self.pi_bridge is not None:
+            summary['pi_vitals'] = self.pi_bridge.snapshot(patient_id)
+        if self.fall_alerts is not None:
+            summary['fall_alerts'] = self.fall_alerts.query(patient_id=patient_id, limit=self.recent_alerts)[0]
+        if self.anomalies is not None:
+            summary['anomalies'] = self.anomalies.query(patient_id=patient_id, limit=self.recent_alerts)[0]
+        return summary
+
+    def refresh(self):
+        """Rebuild the snapshots of the patients that received data since their last build"""
+        with self._lock:
+            dirty = list(self._dirty)
+        for patient_id in dirty:
+            self.build(patient_id)
+        return len(dirty)
+
+    def start_refresh(self, interval_seconds=5):
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"❌ Patient summary refresh failed: {e}")
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    # -------------------------------
+    # Prompt text
+    # -------------------------------
+    @staticmethod
+    def to_text(summary, max_message_chars=120):
+        """
+        Prompt text of a summary: one line per sensor column with data, then the
+        Pi vitals and up to recent_alerts fall alerts / anomalies (one line each)
+        """
+        lines = [f"Summary of patient {summary['patient_id']} at {summary['built_at']}."]
+        windows = summary['windows']
+        signals = list(summary['latest'])
+        if not signals:
+            lines.append('Watch sensors: no data received.')
+        for signal in signals:
+            latest = summary['latest'][signal]
+            parts = [f"latest {_fmt(latest['value'])} at {latest['time_stamp'][:19]}"]
+            for label, stats in windows.items():
+                s = stats.get(signal)
+                if s is None:
+                    parts.append(f'{label}: no data')
+                    continue
+                text = f"{label}: mean {_fmt(s['mean'])}, min {_fmt(s['min'])}, max {_fmt(s['max'])}"
+                if s['trend'] in ('rising', 'falling'):
+                    text += f", {s['trend']} {s['per_hour']:+.3g}/h"
+                elif s['trend']:
+                    text += ', steady'
+                parts.append(text)
+            lines.append(f"{_label(signal)}: {'; '.join(parts)}")
+
+        pi = summary.get('pi_vitals')
+        if pi is None:
+            lines.append('Raspberry Pi vitals: none received.')
+        else:
+            vitals = pi['vitals']
+            bp = vitals.get('blood_pressure') or {}
+            lines.append(
+                f"Raspberry Pi vitals (received {pi['age_seconds']:.0f} s ago{', may be outdated' if pi['stale'] else ''}): "
+                f"heart rate {vitals.get('heart_rate')} BPM, SpO2 {vitals.get('spo2')}%, "
+                f"blood pressure {bp.get('systolic')}/{bp.get('diastolic')} mmHg, "
+                f"skin temperature {vitals.get('skin_temperature')}°C")
+
+        for key, title in (('fall_alerts', 'Recent fall alerts'), ('anomalies', 'Recent anomalies')):
+            alerts = summary.get(key) or []
+            if not alerts:
+                lines.append(f'{title}: none.')
+                continue
+            lines.append(f'{title}:')
+            for alert in alerts:
+                received = datetime.fromtimestamp(alert['received_at']).isoformat(sep=' ', timespec='seconds')
+                message = str(alert.get('message') or alert.get('kind') or 'alert')[:max_message_chars]
+                lines.append(f"- {received}: {message}")
+        return '\n'.join(lines)
+
+    def stats(self):
+        return {
+            'patients': len(self._snapshots),
+            'dirty': len(self._dirty),
+            'builds': self.builds,
+            'hits': self.hits,
+            'mean_build_ms': round(self.build_seconds / self.builds * 1000, 2) if self.builds else None,
+        }
+
+
+# ==================== Benchmark ====================
+if __name__ == '__main__':
+    import tempfile
+    from datetime import timedelta
+
+    from rollups import RollupStore
+    from utils import df_to_text
+
+    rng = np.random.default_rng(0)
+    for hours in (1, 6, 24):
+        store = RollupStore(tempfile.mkdtemp())
+        now = datetime.now()
+        n = hours * 3600
+        rows = [{'time_stamp': now - timedelta(seconds=n - i), 'heart_rate': 70 + 10 * i / n + rng.normal(0, 2),
+                 'steps': i // 2, 'temperature': 36.5 + rng.normal(0, 0.1)} for i in range(n)]
+        store.add_rows('00001', rows)
+        raw_text = df_to_text(pd.DataFrame(rows), {'vital_sign': ['heart_rate', 'steps', 'temperature']},
+                              max_rows=n)
+        summaries = PatientSummaries(store)
+        start = time.perf_counter()
+        text = summaries.to_text(summaries.get('00001'))
+        build_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        summaries.get('00001')
+        hit_ms = (time.perf_counter() - start) * 1000
+        print(f"{hours:>2} h of 1 Hz samples: raw rows {len(raw_text):>9,} chars, summary {len(text):,} chars, "
+              f"build {build_ms:.1f} ms, cached read {hit_ms:.3f} ms")
+    print(text)
@@ -0,0 +1,201 @@
+# pi_bridge.py
+import threading
+import time
+
+import requests
+import socketio as client_socketio
+
+from state_backend import InProcessBackend
+
+DEFAULT_PATIENT_ID = '00001'
+
+
+class PiBridge():
+    """
+    Socket.IO connections to one or more Raspberry Pi servers and the latest vitals they pushed.
+
+    Each Pi gets its own client; every 'vitals_update' replaces the snapshot of
+    the patient it names, stamped with the local receive time and the Pi it
+    came from. Readers get the snapshot with its age, so chat answers are served
+    without a network round trip; only when the snapshot is older than
+    max_age_seconds (or missing) is /get_current_vitals pulled from the Pi that
+    last reported the patient, or from every Pi when none has yet.
+
+    Snapshots and connection states live in the state backend, so with several
+    web workers only the one running start() holds the Pi connections while
+    every worker answers from the same snapshots.
+    """
+
+    def __init__(self, urls, max_age_seconds=30, pull_timeout=5,
+                 on_vitals=None, on_fall_alert=None, on_status=None, state=None):
+        self.urls = list(urls)
+        self.max_age_seconds = max_age_seconds
+        self.pull_timeout = pull_timeout
+        self.on_vitals = on_vitals
+        self.on_fall_alert = on_fall_alert
+        self.on_status = on_status
+        self.pulls = 0
+        self.pull_failures = 0
+        self.state = state if state is not None else InProcessBackend()
+        self._clients = {url: self._make_client(url) for url in self.urls}
+        self._connected = {url: False for url in self.urls}
+        self._running = False
+
+    # -------------------------------
+    # Connections
+    # -------------------------------
+    def _make_client(self, url):
+        sio = client_socketio.Client(reconnection=True, reconnection_attempts=0, reconnection_delay=5)
+
+        @sio.event
+        def connect():
+            self._connected[url] = True
+            self.state.hset('pi_connected', url, True)
+            print(f'✓ CONNECTED TO RASPBERRY PI SERVER ({url})')
+            if self.on_status:
+                self.on_status(url, True)
+
+        @sio.event
+        def disconnect(*args):
+            self._connected[url] = False
+            self.state.hset('pi_connected', url, False)
+            print(f'✗ DISCONNECTED FROM RASPBERRY PI SERVER ({url})')
+            if self.on_status:
+                self.on_status(url, False)
+
+        @sio.event
+        def connect_error(data):
+            print(f'❌ CONNECTION ERROR ({url}): {data}')
+
+        @sio.on('vitals_update')
+        def on_vitals_update(data):
+            self.update(data, source=url, via='push')
+            if self.on_vitals:
+                self.on_vitals(data)
+
+        @sio.on('fall_alert')
+        def on_fall_alert(data):
+            if self.on_fall_alert:
+                self.on_fall_alert(data)
+
+        return sio
+
+    def connect(self, url, max_retries=3):
+        sio = self._clients[url]
+        for retry_count in range(max_retries):
+            try:
+                print(f'🔌 Attempting to connect to Raspberry Pi {url} ({retry_count+1}/{max_retries})...')
+                sio.connect(url, wait_timeout=10)
+                return True
+            except Exception as e:
+                print(f'❌ Connection failed ({url}): {e}')
+                time.sleep(3)
+        print(f'⚠️ Could not connect to Raspberry Pi {url}, continuing without it.')
+        return False
+
+    def reconnect_loop(self, interval_seconds=30):
+        while self._running:
+            time.sleep(interval_seconds)
+            for url, sio in self._clients.items():
+                if not self._running:
+                    break
+                if not self._connected[url] and not sio.connected:
+                    print(f'🔄 Reconnection attempt ({url})...')
+                    try:
+                        self.connect(url)
+                    except Exception as e:
+                        print(f'❌ Reconnect failed ({url}): {e}')
+
+    def start(self):
+        """Connect to every Pi and keep reconnecting in background threads"""
+        if self._running:
+            return
+        self._running = True
+        for url in self.urls:
+            threading.Thread(target=self.connect, args=(url,), daemon=True).start()
+        threading.Thread(target=self.reconnect_loop, daemon=True).start()
+
+    def stop(self):
+        """Disconnect from every Pi (another worker took over)"""
+        self._running = False
+        for url, sio in self._clients.items():
+            try:
+                sio.disconnect()
+            except Exception as e:
+                print(f'❌ Disconnect failed ({url}): {e}')
+
+    def connected(self, url=None):
+        """Whether the given Pi (or any Pi) is connected, as seen by the worker holding the connections"""
+        connected = self.state.hgetall('pi_connected')
+        if url is not None:
+            return bool(connected.get(url, False))
+        return any(connected.get(u, False) for u in self.urls)
+
+    def status(self):
+        connected = self.state.hgetall('pi_connected')
+        snapshots = self.state.hgetall('pi_vitals')
+        return {url: {'connected': bool(connected.get(url, False)),
+                      'patients': sorted(p for p, s in snapshots.items() if s['source'] == url)}
+                for url in self.urls}
+
+    # -------------------------------
+    # Snapshots
+    # -------------------------------
+    def update(self, vitals, source=None, via='push'):
+        patient_id = str(vitals.get('patient_id') or DEFAULT_PATIENT_ID)
+        self.state.hset('pi_vitals', patient_id, {'vitals': vitals, 'received_at': time.time(),
+                                                  'source': source, 'via': via})
+
+    def snapshot(self, patient_id=None):
+        """
+        {'vitals', 'patient_id', 'received_at', 'age_seconds', 'stale', 'source', 'via'}
+        for the patient (the most recently updated one when None), or None if
+        nothing was received yet
+        """
+        if patient_id is None:
+            snapshots = self.state.hgetall('pi_vitals')
+            if not snapshots:
+                return None
+            patient_id = max(snapshots, key=lambda p: snapshots[p]['received_at'])
+            entry = snapshots[patient_id]
+        else:
+            entry = self.state.hget('pi_vitals', str(patient_id))
+        if entry is None:
+            return None
+        age = time.time() - entry['received_at']
+        return dict(entry, patient_id=str(patient_id), age_seconds=round(age, 1),
+                    stale=age > self.max_age_seconds)
+
+    def current_vitals(self, patient_id=DEFAULT_PATIENT_ID, max_age_seconds=None):
+        """
+        Snapshot of the patient's vitals, pulled from the Pi first when older than
+        max_age_seconds (defaults to the bridge setting). If the pull fails the
+        stale snapshot is returned as is (stale=True); None when there is none.
+        """
+        max_age = self.max_age_seconds if max_age_seconds is None else max_age_seconds
+        snapshot = self.snapshot(patient_id)
+        if snapshot is not None and snapshot['age_seconds'] <= max_age:
+            return snapshot
+        sources = [snapshot['source']] if snapshot is not None and snapshot['source'] else self.urls
+        for url in sources:
+            if self.pull(url, patient_id):
+                return self.snapshot(patient_id)
+        return snapshot
+
+    def pull(self, url, patient_id=None):
+        """GET /get_current_vitals from one Pi into the snapshots; True if it returned the patient"""
+        self.pulls += 1
+        try:
+            params = {'patient_id': patient_id} if patient_id else None
+            resp = requests.get(f"{url}/get_current_vitals", params=params, timeout=self.pull_timeout)
+            resp.raise_for_status()
+            vitals = resp.json().get("current_vitals")
+        except (requests.RequestException, ValueError) as e:
+            self.pull_failures += 1
+            print(f'❌ Vitals pull from {url} failed: {e}')
+            return False
+        if not vitals:
+            return False
+        vitals.setdefault('patient_id', patient_id or DEFAULT_PATIENT_ID)
+        self.update(vitals, source=url, via='pull')
+        return patient_id is None or str(vitals['patient_id']) == str(patient_id)
@@ -0,0 +1,93 @@
+# pipeline.py
+import threading
+import time
+
+
+class Pipeline():
+    """
+    Minimal DAG executor for the stages of one request.
+
+    A stage is a function of the results of the stages it depends on. Every
+    stage runs in its own thread (a green thread once eventlet has patched
+    threading) and starts as soon as its dependencies have finished, so
+    independent I/O such as an LLM call and a partition read overlaps. Start and
+    end times are recorded per stage to show the critical path.
+    """
+
+    def __init__(self, name='pipeline'):
+        self.name = name
+        self.results = {}
+        self.errors = {}
+        self.timings = {}  # stage -> (start, end) seconds since run() started
+        self._stages = {}  # stage -> (fn, deps, optional), in insertion order
+        self._done = {}
+
+    def add(self, name, fn, deps=(), optional=False):
+        """
+        Register a stage; its dependencies must already be registered (so the
+        graph stays acyclic). An optional stage returning None did not apply to
+        the request: it is left out of the timings and the critical path.
+        """
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        missing = [d for d in deps if d not in self._stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages: {missing}")
+        self._stages[name] = (fn, tuple(deps), optional)
+        return self
+
+    def run(self):
+        """Run every stage as soon as its inputs are ready; returns once all stages finished"""
+        self._start = time.perf_counter()
+        self._done = {name: threading.Event() for name in self._stages}
+        threads = [threading.Thread(target=self._run_stage, args=(name,), daemon=True) for name in self._stages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.total = time.perf_counter() - self._start
+        return self
+
+    def _run_stage(self, name):
+        fn, deps, optional = self._stages[name]
+        try:
+            for dep in deps:
+                self._done[dep].wait()
+            failed = [dep for dep in deps if dep in self.errors]
+            if failed:
+                self.errors[name] = self.errors[failed[0]]  # skipped: an input is missing
+                return
+            start = time.perf_counter() - self._start
+            try:
+                self.results[name] = fn(*[self.results[dep] for dep in deps])
+            except Exception as e:
+                self.errors[name] = e
+            if not (optional and self.results.get(name, 0) is None):
+                self.timings[name] = (start, time.perf_counter() - self._start)
+        finally:
+            self._done[name].set()
+
+    def result(self, name):
+        """Result of a stage; re-raises the exception of the stage (or of the input that made it skip)"""
+        if name in self.errors:
+            raise self.errors[name]
+        return self.results[name]
+
+    def critical_path(self):
+        """Stages on the longest chain: from the last stage to finish, follow the input that finished last"""
+        if not self.timings:
+            return []
+        path = [max(self.timings, key=lambda name: self.timings[name][1])]
+        while True:
+            deps = [dep for dep in self._stages[path[-1]][1] if dep in self.timings]
+            if not deps:
+                return path[::-1]
+            path.append(max(deps, key=lambda dep: self.timings[dep][1]))
+
+    def report(self):
+        return {
+            'total_ms': round(self.total * 1000, 1),
+            'stages': {name: {'start_ms': round(start * 1000, 1), 'ms': round((end - start) * 1000, 1)}
+                       for name, (start, end) in self.timings.items()},
+            'critical_path': self.critical_path(),
+        }
@@ -0,0 +1,127 @@
+# plot_cache.py
+import os
+import re
+import threading
+from collections import OrderedDict
+
+
+class PlotCache():
+    """
+    LRU cache of rendered plot images keyed by (patient, signal, window, data version).
+
+    The data version of a patient is bumped whenever new samples are ingested,
+    so a cached image is reused until the data behind it changes. Cached files
+    live in the plot folder under deterministic names and are deleted when the
+    cache exceeds max_files or max_bytes.
+
+    When several worker processes share the folder each passes a namespace
+    (its pid): versions are per process, so file names must not collide, and
+    only the files of processes that are gone are cleaned up on startup.
+    """
+
+    FILE_PATTERN = re.compile(r'^cached_plot_(?:w(\d+)_)?.*\.png$')
+
+    def __init__(self, folder, url_prefix, max_files=200, max_bytes=50 * 1024 * 1024, namespace=None):
+        self.folder = folder
+        self.url_prefix = url_prefix
+        self.namespace = namespace
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (filename, size)
+        self._versions = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        # Versions restart at 0, so files from a previous run cannot be trusted
+        os.makedirs(folder, exist_ok=True)
+        for filename in os.listdir(folder):
+            match = self.FILE_PATTERN.match(filename)
+            if match and not (match.group(1) and _process_alive(int(match.group(1)))):
+                try:
+                    os.remove(os.path.join(folder, filename))
+                except FileNotFoundError:
+                    pass  # another worker cleaned it up first
+
+    # -------------------------------
+    # Data versions
+    # -------------------------------
+    def bump_version(self, patient_id):
+        with self._lock:
+            self._versions[str(patient_id)] = self._versions.get(str(patient_id), 0) + 1
+
+    def version(self, patient_id):
+        return self._versions.get(str(patient_id), 0)
+
+    # -------------------------------
+    # Cache
+    # -------------------------------
+    def key(self, patient_id, vital_sign, time_range_minutes=None):
+        return (str(patient_id), vital_sign, time_range_minutes or 'all', self.version(patient_id))
+
+    def filename(self, key):
+        patient_id, vital_sign, window, version = key
+        prefix = f'w{self.namespace}_' if self.namespace is not None else ''
+        return f'cached_plot_{prefix}{patient_id}_{vital_sign}_{window}_v{version}.png'
+
+    def get(self, key):
+        """URL of the cached image for key, '' if key is known to have nothing to plot, None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return ''
+            if entry is not None and os.path.exists(os.path.join(self.folder, entry[0])):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self.url_prefix + entry[0]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, rendered=True):
+        """Register the file rendered for key (or that there was nothing to plot) and evict LRU images"""
+        filename = self.filename(key) if rendered else None
+        path = os.path.join(self.folder, filename) if rendered else None
+        if rendered and not os.path.exists(path):
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            size = os.path.getsize(path) if rendered else 0
+            self._entries[key] = (filename, size)
+            self._total_bytes += size
+            # Older versions of the same plot can never be hit again
+            for old_key in [k for k in self._entries if k[:3] == key[:3] and k[3] < key[3]]:
+                self._remove(old_key)
+            while self._entries and (len(self._entries) > self.max_files or self._total_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+        return self.url_prefix + filename if rendered else ''
+
+    def _remove(self, key):
+        filename, size = self._entries.pop(key)
+        self._total_bytes -= size
+        if filename is None:
+            return
+        try:
+            os.remove(os.path.join(self.folder, filename))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self._total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return False  # a previous process that had our pid
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
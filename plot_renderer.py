@@ -0,0 +1,150 @@
+# plot_renderer.py
+import atexit
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+Y_UNITS = {'heart_rate': ' (BPM)', 'temperature': ' (°C)', 'pressure': ' (hPa)', 'steps': ' (count)'}
+
+
+def render_plot(path, times_ns, values, vital_sign, time_range_minutes=None):
+    """
+    Render a vital-sign line plot to PNG.
+    Uses the object-oriented Figure API on an Agg canvas, so no pyplot global
+    state is touched and it is safe to run in any worker. Returns the render time.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    start = time.perf_counter()
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(np.asarray(times_ns, dtype=np.int64).astype('datetime64[ns]'), values,
+            marker='o', linestyle='-', linewidth=2, markersize=6)
+    title = vital_sign.replace('_', ' ').title()
+    if time_range_minutes:
+        title += f" - Last {time_range_minutes} Minutes"
+    ax.set_title(title, fontsize=14, fontweight='bold')
+    ax.set_xlabel('Time', fontsize=12)
+    ax.set_ylabel(vital_sign.replace('_', ' ').title() + Y_UNITS.get(vital_sign, ''), fontsize=12)
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    tmp_path = path + '.tmp.png'
+    fig.savefig(tmp_path, dpi=100, bbox_inches='tight')
+    os.replace(tmp_path, path)  # readers never see a half-written image
+    return time.perf_counter() - start
+
+
+def _warm_up():
+    """Pay the matplotlib import and font cache cost once per worker"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(1, 1))
+    FigureCanvasAgg(fig)
+    fig.add_subplot().set_title('warm-up')
+    fig.canvas.draw()
+    time.sleep(0.1)  # keeps the worker busy so each warm-up job lands on its own process
+
+
+class PlotRenderer():
+    """
+    Process pool that renders plots off the request thread.
+
+    matplotlib rendering is CPU-bound and would block the single eventlet
+    worker; here each job runs render_plot() in a separate process, several
+    signals render in parallel, and callers either wait on the returned
+    futures or hand out the image URL straight away.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._render_times = deque(maxlen=200)
+        self._pool = None
+        self._lock = threading.Lock()
+        # Otherwise interpreter exit under eventlet hangs on the pool's manager thread
+        # and the spawned workers leak their semaphores
+        atexit.register(self.shutdown, wait=True)
+
+    def _start_pool(self):
+        pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        # spawn re-runs the main script in each worker unless it cannot find it. When the
+        # app is started with `python app.py` that would re-run all of its startup code, so
+        # hide the path while the workers are being launched (they only need this module).
+        main = sys.modules['__main__']
+        main_file = main.__dict__.pop('__file__', None)
+        try:
+            wait([pool.submit(_warm_up) for _ in range(self.max_workers)])
+        finally:
+            if main_file is not None:
+                main.__file__ = main_file
+        return pool
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._start_pool()
+            return self._pool
+
+    def start(self):
+        """Launch the worker processes now instead of on the first render"""
+        try:
+            self._get_pool()
+        except Exception as e:
+            print(f"❌ Could not start plot render workers: {e}")
+
+    def submit(self, path, times_ns, values, vital_sign, time_range_minutes=None):
+        """Queue a render job; returns a Future resolving to the render time in seconds"""
+        try:
+            future = self._get_pool().submit(render_plot, path, times_ns, values, vital_sign, time_range_minutes)
+        except BrokenProcessPool:
+            with self._lock:
+                self._pool = None
+            future = self._get_pool().submit(render_plot, path, times_ns, values, vital_sign, time_range_minutes)
+        with self._lock:
+            self.submitted += 1
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        with self._lock:
+            if future.exception() is not None:
+                self.failed += 1
+                print(f"❌ Plot render failed: {future.exception()}")
+            else:
+                self.completed += 1
+                self._render_times.append(future.result())
+
+    def stats(self):
+        with self._lock:
+            times_ms = sorted(t * 1000 for t in self._render_times)
+            return {
+                'workers': self.max_workers,
+                'queue_depth': self.submitted - self.completed - self.failed,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'render_ms_avg': round(sum(times_ms) / len(times_ms), 1) if times_ms else None,
+                'render_ms_p95': round(times_ms[int(0.95 * (len(times_ms) - 1))], 1) if times_ms else None,
+            }
+
+    def shutdown(self, wait=False):
+        """Stop the worker processes (pending renders are cancelled); wait=True joins them"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
@@ -1,64 +1,80 @@
 # request_to_openai.py
-import base64
+import asyncio
+import atexit
+import json
+import random
+import threading
+import time
 import requests
-from PIL import Image
-from io import BytesIO
+from requests.adapters import HTTPAdapter
 import os
 from dotenv import load_dotenv
+from response_cache import ResponseCache
+from image_pipeline import ImageEncoder
 
 # Load .env variables
 load_dotenv()
 API_KEY = os.getenv("OPENAI_KEY")
-OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+# Point at a local stub server for tests / benchmarks, e.g. OPENAI_BASE_URL=http://127.0.0.1:8000/v1
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_CHAT_URL = OPENAI_BASE_URL.rstrip('/') + "/chat/completions"
 
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", 60))
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 8))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 3))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5  # seconds; attempt n waits up to BACKOFF_BASE * 2**n (full jitter)
+BACKOFF_MAX = 8
 
-def _encode_image(image_path):
-    """
-    Encode a local image file to base64 string (PNG format)
-    """
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Image not found: {image_path}")
+# Completion cache: intent parses and general answers change rarely, answers embedding live vitals go stale fast
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./.llm_cache.json")
+INTENT_CACHE_TTL = float(os.getenv("LLM_INTENT_CACHE_TTL", 3600))
+ANSWER_CACHE_TTL = float(os.getenv("LLM_ANSWER_CACHE_TTL", 30))
+GENERAL_CACHE_TTL = float(os.getenv("LLM_GENERAL_CACHE_TTL", 3600))
 
-    image = Image.open(image_path)
-    buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+# Vision images: downscaled to the detail size and encoded once (JPEG or WEBP), cached by path + mtime + size
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "JPEG")
+VISION_IMAGE_DETAIL = os.getenv("VISION_IMAGE_DETAIL", "low")
+VISION_IMAGE_CACHE_MB = float(os.getenv("VISION_IMAGE_CACHE_MB", 32))
 
+# One keep-alive connection pool shared by every call (no TLS handshake per request)
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY))
+_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY))
+# Calls beyond MAX_CONCURRENCY wait for a slot instead of piling onto the API
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+# httpx.AsyncClient and asyncio.Semaphore are bound to the loop they are first used on: one pair per event loop
+_async_pools = {}  # loop -> (client, semaphore)
+
+response_cache = ResponseCache(LLM_CACHE_PATH, max_entries=2000)
+response_cache.start_autosave(interval_seconds=60)
+atexit.register(response_cache.save)
+
+image_encoder = ImageEncoder(VISION_IMAGE_FORMAT, max_bytes=int(VISION_IMAGE_CACHE_MB * 1024 * 1024))
 
-def gpt(
-        text: str,
-        model_name: str = "gpt-3.5-turbo",
-        image_path: list = None,
-        system_prompt: str = "You are a helpful assistant.",
-        temperature: float = 0.2,
-        max_tokens: int = 500
-):
-    """
-    Call OpenAI Chat API (text or image) and return response safely.
-    """
-    if image_path is None:
-        image_path = []
 
+def _build_payload(text, model_name, image_path, system_prompt, temperature, max_tokens):
     # Prepare system and user content
     system_content = [{"type": "text", "text": system_prompt}]
     user_content = [{"type": "text", "text": text}]
 
-    # Attach images if provided
-    for img_path in image_path:
-        try:
-            b64_img = _encode_image(img_path)
-            user_content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/png;base64,{b64_img}",
-                    "detail": "low"
-                }
-            })
-        except Exception as e:
-            print(f"❌ Failed to encode image {img_path}: {e}")
-
-    # Prepare payload
-    payload = {
+    # Attach images if provided (encoded in parallel, or served from the encoder cache)
+    image_paths = list(image_path or [])
+    for img_path, encoded in zip(image_paths, image_encoder.encode_many(image_paths, VISION_IMAGE_DETAIL)):
+        if isinstance(encoded, Exception):
+            print(f"❌ Failed to encode image {img_path}: {encoded}")
+            continue
+        user_content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": encoded["url"],
+                "detail": encoded["detail"]
+            }
+        })
+
+    return {
         "model": model_name,
         "messages": [
             {"role": "system", "content": system_content},
@@ -68,26 +84,322 @@ def gpt(
         "max_tokens": max_tokens
     }
 
-    headers = {
+
+def _headers():
+    return {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {API_KEY}"
     }
 
+
+def _parse_response(response_json):
+    # Check if 'choices' exists
+    if "choices" in response_json and len(response_json["choices"]) > 0:
+        return response_json["choices"][0]["message"]["content"]
+    print(f"❌ No 'choices' in response: {response_json}")
+    return "No response returned from OpenAI API."
+
+
+def _cache_get(text, model_name, image_path, system_prompt, temperature, max_tokens, cache_ttl, cache_similar):
+    if not cache_ttl or image_path:
+        return None
+    return response_cache.get(system_prompt, text, model_name, temperature, max_tokens, similar=cache_similar)
+
+
+def _cache_put(complete, content, text, model_name, image_path, system_prompt, temperature, max_tokens,
+               cache_ttl, cache_similar):
+    if cache_ttl and not image_path and complete:
+        response_cache.put(system_prompt, text, model_name, temperature, max_tokens, content,
+                           ttl=cache_ttl, similar=cache_similar)
+
+
+def _backoff(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt (Retry-After wins if the server sent one)"""
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), BACKOFF_MAX)
+    except ValueError:
+        pass
+    return random.uniform(0, min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX))
+
+
+def gpt(
+        text: str,
+        model_name: str = "gpt-3.5-turbo",
+        image_path: list = None,
+        system_prompt: str = "You are a helpful assistant.",
+        temperature: float = 0.2,
+        max_tokens: int = 500,
+        cache_ttl: float = 0,
+        cache_similar: bool = False
+):
+    """
+    Call OpenAI Chat API (text or image) and return response safely.
+    Uses the shared keep-alive session with connect/read timeouts, at most
+    MAX_CONCURRENCY calls in flight, and jittered retries on 429/5xx and
+    connection errors.
+    With cache_ttl > 0 (text-only calls) completions are served from / stored in
+    response_cache for cache_ttl seconds; cache_similar also matches near-duplicate
+    questions.
+    """
+    cache_args = (text, model_name, image_path, system_prompt, temperature, max_tokens, cache_ttl, cache_similar)
+    cached = _cache_get(*cache_args)
+    if cached is not None:
+        return cached
+    payload = _build_payload(text, model_name, image_path, system_prompt, temperature, max_tokens)
+
+    if not _slots.acquire(timeout=READ_TIMEOUT):
+        print("❌ GPT request failed: too many concurrent requests")
+        return "Error: too many concurrent requests to OpenAI API, please try again."
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = _session.post(OPENAI_CHAT_URL, headers=_headers(), json=payload,
+                                         timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+                if response.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+                    delay = _backoff(attempt, response.headers.get("Retry-After"))
+                    print(f"⚠️ OpenAI API returned {response.status_code}, retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+                response.raise_for_status()
+                response_json = response.json()
+                content = _parse_response(response_json)
+                _cache_put(bool(response_json.get("choices")), content, *cache_args)
+                return content
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt < MAX_RETRIES:
+                    delay = _backoff(attempt)
+                    print(f"⚠️ OpenAI API unreachable ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+                print(f"❌ GPT request failed: {e}")
+                return f"Error: {e}"
+            except requests.exceptions.HTTPError as e:
+                print(f"❌ HTTP error: {e}")
+                return f"HTTP error: {e}"
+            except Exception as e:
+                print(f"❌ GPT request failed: {e}")
+                return f"Error: {e}"
+    finally:
+        _slots.release()
+
+
+def gpt_stream(
+        text: str,
+        model_name: str = "gpt-3.5-turbo",
+        image_path: list = None,
+        system_prompt: str = "You are a helpful assistant.",
+        temperature: float = 0.2,
+        max_tokens: int = 500,
+        cache_ttl: float = 0,
+        cache_similar: bool = False
+):
+    """
+    Streaming variant of gpt(): yields the completion's content deltas as the
+    API's server-sent events arrive. Retries only happen before the first token;
+    errors are yielded as text like gpt() returns them. A cached completion is
+    yielded in one piece, and a completed stream is cached like gpt().
+    """
+    cache_args = (text, model_name, image_path, system_prompt, temperature, max_tokens, cache_ttl, cache_similar)
+    cached = _cache_get(*cache_args)
+    if cached is not None:
+        yield cached
+        return
+    payload = _build_payload(text, model_name, image_path, system_prompt, temperature, max_tokens)
+    payload["stream"] = True
+
+    if not _slots.acquire(timeout=READ_TIMEOUT):
+        print("❌ GPT request failed: too many concurrent requests")
+        yield "Error: too many concurrent requests to OpenAI API, please try again."
+        return
+    parts = []
     try:
-        response = requests.post(OPENAI_CHAT_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        response_json = response.json()
-
-        # Check if 'choices' exists
-        if "choices" in response_json and len(response_json["choices"]) > 0:
-            return response_json["choices"][0]["message"]["content"]
-        else:
-            print(f"❌ No 'choices' in response: {response_json}")
-            return "No response returned from OpenAI API."
-
-    except requests.exceptions.HTTPError as e:
-        print(f"❌ HTTP error: {e}")
-        return f"HTTP error: {e}"
-    except Exception as e:
-        print(f"❌ GPT request failed: {e}")
-        return f"Error: {e}"
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = _session.post(OPENAI_CHAT_URL, headers=_headers(), json=payload, stream=True,
+                                         timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+                if response.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+                    response.close()
+                    delay = _backoff(attempt, response.headers.get("Retry-After"))
+                    print(f"⚠️ OpenAI API returned {response.status_code}, retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+                with response:
+                    response.raise_for_status()
+                    for raw_line in response.iter_lines():
+                        line = raw_line.decode("utf-8")  # SSE is always UTF-8, whatever the headers say
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        choices = json.loads(data).get("choices") or [{}]
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+                content = "".join(parts)
+                _cache_put(bool(content), content, *cache_args)
+                return
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt < MAX_RETRIES and not parts:
+                    delay = _backoff(attempt)
+                    print(f"⚠️ OpenAI API unreachable ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+                print(f"❌ GPT request failed: {e}")
+                yield f"Error: {e}"
+                return
+            except requests.exceptions.HTTPError as e:
+                print(f"❌ HTTP error: {e}")
+                yield f"HTTP error: {e}"
+                return
+            except Exception as e:
+                print(f"❌ GPT request failed: {e}")
+                yield f"Error: {e}"
+                return
+    finally:
+        _slots.release()
+
+
+async def agpt(
+        text: str,
+        model_name: str = "gpt-3.5-turbo",
+        image_path: list = None,
+        system_prompt: str = "You are a helpful assistant.",
+        temperature: float = 0.2,
+        max_tokens: int = 500,
+        cache_ttl: float = 0,
+        cache_similar: bool = False
+):
+    """
+    asyncio variant of gpt() on a pooled httpx.AsyncClient, with the same
+    timeouts, concurrency bound, retry policy and response cache.
+    """
+    import httpx
+
+    cache_args = (text, model_name, image_path, system_prompt, temperature, max_tokens, cache_ttl, cache_similar)
+    cached = _cache_get(*cache_args)
+    if cached is not None:
+        return cached
+
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        for closed in [l for l in _async_pools if l.is_closed()]:
+            del _async_pools[closed]  # left behind by an earlier asyncio.run()
+        pool = _async_pools[loop] = (
+            httpx.AsyncClient(
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY)),
+            asyncio.Semaphore(MAX_CONCURRENCY))
+    _async_client, _async_slots = pool
+
+    payload = _build_payload(text, model_name, image_path, system_prompt, temperature, max_tokens)
+    async with _async_slots:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = await _async_client.post(OPENAI_CHAT_URL, headers=_headers(), json=payload)
+                if response.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+                    await asyncio.sleep(_backoff(attempt, response.headers.get("Retry-After")))
+                    continue
+                response.raise_for_status()
+                response_json = response.json()
+                content = _parse_response(response_json)
+                _cache_put(bool(response_json.get("choices")), content, *cache_args)
+                return content
+
+            except (httpx.ConnectError, httpx.TimeoutException) as e:
+                if attempt < MAX_RETRIES:
+                    await asyncio.sleep(_backoff(attempt))
+                    continue
+                print(f"❌ GPT request failed: {e}")
+                return f"Error: {e}"
+            except httpx.HTTPStatusError as e:
+                print(f"❌ HTTP error: {e}")
+                return f"HTTP error: {e}"
+            except Exception as e:
+                print(f"❌ GPT request failed: {e}")
+                return f"Error: {e}"
+
+
+# ==================== Benchmark (local stub server) ====================
+if __name__ == '__main__':
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True
+        calls = 0
+
+        def do_POST(self):
+            request_json = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if request_json.get("stream"):
+                return self.stream_reply()
+            StubHandler.calls += 1
+            if StubHandler.calls % 10 == 0:  # every 10th call is throttled once
+                status, body = 429, b'{"error": "rate limited"}'
+            else:
+                status, body = 200, json.dumps({"choices": [{"message": {"content": "ok"}}]}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def stream_reply(self, n_tokens=100, token_delay=0.02):
+            """Server-sent events, one token every 20 ms (a ~2 s answer)"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(n_tokens + 1):
+                time.sleep(token_delay)
+                if i < n_tokens:
+                    event = {"choices": [{"delta": {"content": f"tok{i} "}}]}
+                    chunk = f"data: {json.dumps(event)}\n\n".encode()
+                else:
+                    chunk = b"data: [DONE]\n\n"
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    OPENAI_CHAT_URL = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    BACKOFF_BASE = 0.01
+
+    n_calls = 200
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        requests.post(OPENAI_CHAT_URL, json={}, timeout=5)
+    print(f"fresh connection per call: {(time.perf_counter() - start) / n_calls * 1000:.2f} ms/call")
+
+    start = time.perf_counter()
+    replies = [gpt("ping") for _ in range(n_calls)]
+    print(f"pooled gpt():              {(time.perf_counter() - start) / n_calls * 1000:.2f} ms/call "
+          f"({replies.count('ok')}/{n_calls} ok after retries)")
+
+    async def run_async():
+        return await asyncio.gather(*[agpt("ping") for _ in range(n_calls)])
+
+    start = time.perf_counter()
+    replies = asyncio.run(run_async())
+    print(f"agpt() x{n_calls} concurrent:   {(time.perf_counter() - start) * 1000:.1f} ms total "
+          f"({replies.count('ok')}/{n_calls} ok after retries)")
+
+    start = time.perf_counter()
+    first_token_ms = None
+    tokens = []
+    for token in gpt_stream("ping"):
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - start) * 1000
+        tokens.append(token)
+    print(f"gpt_stream():              first token after {first_token_ms:.0f} ms, "
+          f"{len(tokens)} tokens after {(time.perf_counter() - start) * 1000:.0f} ms")
+    server.shutdown()
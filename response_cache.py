@@ -0,0 +1,214 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+_TIMESTAMP = re.compile(r'(\d{4}-\d{2}-\d{2})[ T](\d{2}):\d{2}:\d{2}(?:\.\d+)?')
+_NUMBERS = re.compile(r'\d+(?:\.\d+)?')
+
+
+def normalize(text):
+    """Lower-case, collapse whitespace, drop trailing punctuation; timestamps are kept to the hour"""
+    text = _TIMESTAMP.sub(r'\1 \2:00', text or '')
+    return re.sub(r'\s+', ' ', text.lower()).strip().rstrip('?.! ')
+
+
+# Words that do not change what is being asked; dropped before similarity matching
+_FILLER = {'what', 'whats', 'is', 'are', 'was', 'the', 'a', 'an', 'of', 'for', 'please', 'me', 'tell', 'give',
+           'can', 'could', 'you', 'i', 'to', 'know', 'want', 'would', 'like', 'patient', 'patients', 's'}
+
+
+def similarity_text(text):
+    """normalize() minus punctuation and filler words, as compared by the trigram index"""
+    words = re.findall(r"[a-z0-9]+", normalize(text).replace("'s", ' is'))
+    return ' '.join(w for w in words if w not in _FILLER)
+
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ResponseCache():
+    """
+    TTL + LRU cache of LLM completions keyed by normalized prompt, model and sampling settings.
+
+    Exact hits compare the normalized system prompt and question. Entries put with
+    similar=True (intent parses) are also indexed by character trigrams of the
+    question without filler words, so "current heart rate of 00001?" hits an entry
+    for "what's the current heart rate of patient 00001" when the trigram Jaccard
+    similarity reaches the threshold and both contain the same numbers (patient
+    IDs, times). Entries are persisted to a JSON file and reloaded, minus expired
+    ones, on restart.
+    """
+
+    def __init__(self, path=None, max_entries=2000, similarity=0.85):
+        self.path = path
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> {'value', 'expires', 'group', 'text', 'similar'}
+        self._grams = {}  # group -> {trigram: set(keys)}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    # -------------------------------
+    # Keys
+    # -------------------------------
+    @staticmethod
+    def group(system_prompt, model_name, temperature, max_tokens):
+        """Prompts are only comparable within the same system prompt and settings"""
+        raw = json.dumps([normalize(system_prompt), model_name, temperature, max_tokens])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def key(group, text):
+        return hashlib.sha1(f'{group}\n{normalize(text)}'.encode('utf-8')).hexdigest()
+
+    # -------------------------------
+    # Cache
+    # -------------------------------
+    def get(self, system_prompt, text, model_name, temperature, max_tokens, similar=False):
+        """Cached completion for the prompt (or a near-duplicate of it when similar=True), else None"""
+        group = self.group(system_prompt, model_name, temperature, max_tokens)
+        key = self.key(group, text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires'] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry['value']
+            if entry is not None:
+                self._remove(key)
+            if similar:
+                match = self._most_similar(group, similarity_text(text), now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.similar_hits += 1
+                    return self._entries[match]['value']
+            self.misses += 1
+            return None
+
+    def put(self, system_prompt, text, model_name, temperature, max_tokens, value, ttl, similar=False):
+        """Store a completion for ttl seconds and evict least recently used entries beyond max_entries"""
+        if not ttl or ttl <= 0:
+            return
+        group = self.group(system_prompt, model_name, temperature, max_tokens)
+        key = self.key(group, text)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._add(key, {'value': value, 'expires': time.time() + ttl, 'group': group,
+                            'text': similarity_text(text) if similar else None, 'similar': similar})
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._dirty = True
+
+    def _add(self, key, entry):
+        self._entries[key] = entry
+        if entry['similar']:
+            index = self._grams.setdefault(entry['group'], {})
+            for gram in _trigrams(entry['text']):
+                index.setdefault(gram, set()).add(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        if entry['similar']:
+            index = self._grams.get(entry['group'], {})
+            for gram in _trigrams(entry['text']):
+                keys = index.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[gram]
+        self._dirty = True
+
+    def _most_similar(self, group, text, now):
+        index = self._grams.get(group)
+        if not index:
+            return None
+        grams = _trigrams(text)
+        numbers = _NUMBERS.findall(text)
+        shared = Counter(key for gram in grams for key in index.get(gram, ()))
+        best, best_score = None, self.similarity
+        for key, n_shared in shared.most_common(20):
+            entry = self._entries[key]
+            score = n_shared / (len(grams) + len(_trigrams(entry['text'])) - n_shared)
+            if score >= best_score and entry['expires'] > now and _NUMBERS.findall(entry['text']) == numbers:
+                best, best_score = key, score
+        return best
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._grams.clear()
+            self._dirty = True
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            data = [[key, entry] for key, entry in self._entries.items() if entry['expires'] > now]
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable LLM cache {self.path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, entry in data[-self.max_entries:]:
+                if entry['expires'] > now:
+                    self._add(key, entry)
+
+    def start_autosave(self, interval_seconds=60):
+        """Persist the cache every interval_seconds in a background thread (only when it changed)"""
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"❌ LLM cache save failed: {e}")
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round((self.hits + self.similar_hits) / lookups, 3) if lookups else None,
+        }
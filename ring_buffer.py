@@ -0,0 +1,193 @@
+# ring_buffer.py
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from config import SENSOR_COLUMNS
+
+
+def to_epoch_ns(time_stamp):
+    """Convert a datetime/str timestamp to int64 nanoseconds (naive local time)"""
+    return pd.Timestamp(time_stamp).value
+
+
+class SignalRingBuffer():
+    """
+    Fixed-capacity buffer of recent samples for one patient.
+
+    Storage is preallocated: an int64 timestamp array and a float32 matrix with
+    one column per signal. Every sample is written twice (at i and i + capacity)
+    so the live window is always one contiguous, time-sorted slice and range
+    lookups are a pair of np.searchsorted calls instead of a boolean mask.
+    """
+
+    def __init__(self, signals, capacity=3600):
+        self.signals = list(signals)
+        self.capacity = capacity
+        self._index = {s: i for i, s in enumerate(self.signals)}
+        self._times = np.zeros(2 * capacity, dtype=np.int64)
+        self._values = np.full((2 * capacity, len(self.signals)), np.nan, dtype=np.float32)
+        self._head = 0   # next write position in [0, capacity)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def _row(self, values):
+        row = np.full(len(self.signals), np.nan, dtype=np.float32)
+        for signal, value in values.items():
+            col = self._index.get(signal)
+            if col is None or value is None or value == '':
+                continue
+            try:
+                row[col] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return row
+
+    def append(self, time_ns, values):
+        """Insert one sample ({signal: value}) in time order"""
+        self.extend([time_ns], [values])
+
+    def extend(self, times_ns, rows):
+        """
+        Insert samples ({signal: value} dicts) in time order. Samples older than
+        the newest buffered one (late or backfilled data) are merged in: the
+        buffered samples after the oldest incoming one are rewound and written
+        back with the new ones in sorted order. Once full the oldest samples are
+        evicted, so a late sample older than everything kept is dropped.
+        """
+        times = np.asarray(times_ns, dtype=np.int64)
+        if not len(times):
+            return
+        values = np.array([self._row(row) for row in rows], dtype=np.float32).reshape(len(times), len(self.signals))
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+
+        with self._lock:
+            live_times, live_values = self._live()
+            if self._count and times[0] < live_times[-1]:
+                keep = int(np.searchsorted(live_times, times[0], side='right'))
+                merged_times = np.concatenate([live_times[keep:], times])
+                order = np.argsort(merged_times, kind='stable')
+                times = merged_times[order]
+                values = np.concatenate([live_values[keep:], values])[order]
+                self._head = (self._head - (self._count - keep)) % self.capacity
+                self._count = keep
+
+            n = len(times)
+            if n > self.capacity:
+                times, values = times[-self.capacity:], values[-self.capacity:]
+                self._head = (self._head + n - self.capacity) % self.capacity
+            positions = (self._head + np.arange(len(times))) % self.capacity
+            self._times[positions] = self._times[positions + self.capacity] = times
+            self._values[positions] = self._values[positions + self.capacity] = values
+            self._head = (self._head + len(times)) % self.capacity
+            self._count = min(self._count + n, self.capacity)
+
+    def _live(self):
+        """Contiguous (times, values) views of the buffered samples, oldest first"""
+        end = self._head + self.capacity
+        start = end - self._count
+        return self._times[start:end], self._values[start:end]
+
+    def window(self, start_ns=None, end_ns=None, signals=None):
+        """Copy of the samples with start_ns <= time <= end_ns"""
+        with self._lock:
+            times, values = self._live()
+            lo = 0 if start_ns is None else np.searchsorted(times, start_ns, side='left')
+            hi = len(times) if end_ns is None else np.searchsorted(times, end_ns, side='right')
+            cols = slice(None) if signals is None else [self._index[s] for s in signals if s in self._index]
+            return times[lo:hi].copy(), values[lo:hi][:, cols].copy()
+
+    def oldest_time(self):
+        with self._lock:
+            return int(self._live()[0][0]) if self._count else None
+
+    def is_full(self):
+        return self._count == self.capacity
+
+    def latest(self):
+        """(time_ns, {signal: value}) of the newest sample, or (None, {})"""
+        with self._lock:
+            if not self._count:
+                return None, {}
+            pos = self._head + self.capacity - 1
+            return int(self._times[pos]), dict(zip(self.signals, self._values[pos].tolist()))
+
+
+class RecentSamples():
+    """Per-patient ring buffers covering the last retention_minutes of sensor data"""
+
+    def __init__(self, signals=None, retention_minutes=60, capacity=3600):
+        if signals is None:
+            signals = [c for c in SENSOR_COLUMNS if c != 'time_stamp']
+        self.signals = list(signals)
+        self.retention_minutes = retention_minutes
+        self.capacity = capacity
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def _buffer(self, patient_id):
+        patient_id = str(patient_id)
+        buffer = self._buffers.get(patient_id)
+        if buffer is None:
+            with self._lock:
+                buffer = self._buffers.setdefault(patient_id, SignalRingBuffer(self.signals, self.capacity))
+        return buffer
+
+    def add_rows(self, patient_id, rows):
+        """Feed ingested rows (dicts with 'time_stamp') into the patient's buffer"""
+        self._buffer(patient_id).extend([to_epoch_ns(row['time_stamp']) for row in rows], rows)
+
+    def warm_from_store(self, store):
+        """Fill the buffers from disk for every patient with data in the retention window"""
+        start = datetime.now() - timedelta(minutes=self.retention_minutes)
+        for patient_id in store.patients():
+            df = store.query(patient_id, start=start)
+            if df.empty:
+                continue
+            df = df.sort_values('time_stamp', key=lambda s: pd.to_datetime(s, format='mixed'))
+            self.add_rows(patient_id, df.astype(object).where(df.notna(), None).to_dict('records'))
+
+    def covers(self, patient_id, minutes, now=None):
+        """True if the last `minutes` of this patient's data are fully held in memory"""
+        if minutes is None or minutes > self.retention_minutes:
+            return False
+        buffer = self._buffers.get(str(patient_id))
+        if buffer is None or not buffer.is_full():
+            return True
+        # Buffer wrapped: only covered if the oldest kept sample predates the window
+        start_ns = to_epoch_ns((now or datetime.now()) - timedelta(minutes=minutes))
+        return buffer.oldest_time() <= start_ns
+
+    def window_df(self, patient_id, minutes=None, signals=None, now=None):
+        """DataFrame of the last `minutes` of samples, served from memory"""
+        now = now or datetime.now()
+        minutes = self.retention_minutes if minutes is None else min(minutes, self.retention_minutes)
+        start_ns = to_epoch_ns(now - timedelta(minutes=minutes))
+        signals = [s for s in (signals or self.signals) if s in self.signals]
+
+        buffer = self._buffers.get(str(patient_id))
+        if buffer is None:
+            return pd.DataFrame(columns=['time_stamp'] + signals)
+        times, values = buffer.window(start_ns=start_ns, signals=signals)
+        df = pd.DataFrame(values.astype(np.float64), columns=signals)
+        df.insert(0, 'time_stamp', pd.to_datetime(times))
+        return df
+
+    def latest_row(self, patient_id):
+        buffer = self._buffers.get(str(patient_id))
+        time_ns, values = buffer.latest() if buffer is not None else (None, {})
+        if time_ns is None:
+            return {}
+        row = {'time_stamp': pd.Timestamp(time_ns)}
+        row.update({k: (None if np.isnan(v) else v) for k, v in values.items()})
+        return row
+
+    def buffered_count(self, patient_id):
+        buffer = self._buffers.get(str(patient_id))
+        return len(buffer) if buffer is not None else 0
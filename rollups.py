@@ -0,0 +1,280 @@
+# rollups.py
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from config import SENSOR_COLUMNS
+
+# resolution -> (bucket width in seconds, how long buckets are kept)
+RESOLUTIONS = {
+    '1min': (60, timedelta(days=1)),
+    '30min': (30 * 60, timedelta(days=30)),
+    '1day': (24 * 60 * 60, None),
+}
+# Partitions modified up to this long before a snapshot was taken are re-folded on startup
+# (rows can reach the store shortly before they are folded into the rollups)
+SNAPSHOT_MARGIN_S = 60
+
+
+class RollupSeries():
+    """
+    min/max/sum/count/last per signal for consecutive buckets of one width.
+
+    Buckets are keyed by their start (epoch ns, naive local time, so daily
+    buckets start at local midnight). Each sample updates one bucket with a
+    handful of vectorised numpy operations over the signal columns.
+    """
+
+    def __init__(self, n_signals, width_s, retention=None):
+        self.width_ns = width_s * 10**9
+        self.retention_ns = int(retention.total_seconds() * 10**9) if retention else None
+        self.n_signals = n_signals
+        self.buckets = {}  # start_ns -> [count, sum, min, max, last, last_time] arrays
+
+    def _new_bucket(self):
+        return [np.zeros(self.n_signals), np.zeros(self.n_signals),
+                np.full(self.n_signals, np.inf), np.full(self.n_signals, -np.inf),
+                np.full(self.n_signals, np.nan), np.full(self.n_signals, np.iinfo(np.int64).min)]
+
+    def add(self, time_ns, values):
+        """Fold one sample (float array with NaN for missing signals) into its bucket"""
+        start = time_ns - time_ns % self.width_ns
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            bucket = self.buckets[start] = self._new_bucket()
+            self._prune(start)
+        count, total, low, high, last, last_time = bucket
+        present = ~np.isnan(values)
+        count += present
+        total += np.where(present, values, 0.0)
+        np.minimum(low, np.where(present, values, np.inf), out=low)
+        np.maximum(high, np.where(present, values, -np.inf), out=high)
+        newer = present & (time_ns >= last_time)
+        last[newer] = values[newer]
+        last_time[newer] = time_ns
+
+    def _prune(self, newest_start):
+        if self.retention_ns is None:
+            return
+        cutoff = newest_start - self.retention_ns
+        for start in [s for s in self.buckets if s < cutoff]:
+            del self.buckets[start]
+
+    def frame(self, signals, signal_index, start_ns=None, end_ns=None):
+        """DataFrame with one row per bucket and <signal>_<stat> columns"""
+        starts = sorted(s for s in self.buckets
+                        if (start_ns is None or s + self.width_ns > start_ns) and (end_ns is None or s <= end_ns))
+        data = {'time_stamp': pd.to_datetime(np.asarray(starts, dtype=np.int64))}
+        for signal in signals:
+            col = signal_index[signal]
+            count = np.array([self.buckets[s][0][col] for s in starts])
+            total = np.array([self.buckets[s][1][col] for s in starts])
+            has_data = count > 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                data[f'{signal}_mean'] = np.where(has_data, total / np.maximum(count, 1), np.nan)
+            data[f'{signal}_min'] = np.where(has_data, [self.buckets[s][2][col] for s in starts], np.nan)
+            data[f'{signal}_max'] = np.where(has_data, [self.buckets[s][3][col] for s in starts], np.nan)
+            data[f'{signal}_count'] = count.astype(np.int64)
+            data[f'{signal}_last'] = [self.buckets[s][4][col] for s in starts]
+        return pd.DataFrame(data)
+
+    def drop(self, start_ns, end_ns):
+        """Remove the buckets starting in [start_ns, end_ns)"""
+        for start in [s for s in self.buckets if start_ns <= s < end_ns]:
+            del self.buckets[start]
+
+    def to_arrays(self, start_ns=None):
+        """Bucket starts and the stacked [count, sum, min, max, last, last_time] arrays (buckets x signals)"""
+        starts = np.array(sorted(s for s in self.buckets if start_ns is None or s + self.width_ns > start_ns),
+                          dtype=np.int64)
+        stacked = [np.array([self.buckets[s][i] for s in starts]).reshape(len(starts), self.n_signals)
+                   for i in range(6)]
+        return starts, stacked
+
+    def load_arrays(self, starts, stacked):
+        for row, start in enumerate(starts):
+            self.buckets[int(start)] = [stacked[i][row].copy() for i in range(6)]
+
+
+class RollupStore():
+    """
+    Per-patient rollups at 1-minute, 30-minute and daily resolution,
+    maintained incrementally as sensor rows are ingested.
+
+    State is snapshotted to <root>/<patient_id>/rollups.npz; on startup the
+    snapshot is loaded and only raw rows newer than it are replayed.
+    """
+
+    def __init__(self, root, signals=None):
+        if signals is None:
+            signals = [c for c in SENSOR_COLUMNS if c != 'time_stamp']
+        self.root = root
+        self.signals = list(signals)
+        self._index = {s: i for i, s in enumerate(self.signals)}
+        self._series = {}  # patient_id -> {resolution: RollupSeries}
+        self._newest = {}  # patient_id -> newest sample time (ns) folded in
+        self._lock = threading.Lock()
+
+    def _patient(self, patient_id):
+        patient_id = str(patient_id)
+        series = self._series.get(patient_id)
+        if series is None:
+            series = self._series[patient_id] = {
+                res: RollupSeries(len(self.signals), width, retention)
+                for res, (width, retention) in RESOLUTIONS.items()}
+        return series
+
+    def _row_values(self, row):
+        values = np.full(len(self.signals), np.nan)
+        for signal, col in self._index.items():
+            value = row.get(signal)
+            if value is None or value == '':
+                continue
+            try:
+                values[col] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return values
+
+    def add_rows(self, patient_id, rows):
+        """Fold ingested rows into every resolution"""
+        with self._lock:
+            series = self._patient(patient_id)
+            for row in rows:
+                time_ns = pd.Timestamp(row['time_stamp']).value
+                values = self._row_values(row)
+                for rollup in series.values():
+                    rollup.add(time_ns, values)
+                self._newest[str(patient_id)] = max(self._newest.get(str(patient_id), time_ns), time_ns)
+
+    def query(self, patient_id, resolution, signals, start=None, end=None):
+        """Rollup rows for [start, end] at the given resolution"""
+        signals = [s for s in signals if s in self._index]
+        start_ns = pd.Timestamp(start).value if start is not None else None
+        end_ns = pd.Timestamp(end).value if end is not None else None
+        with self._lock:
+            return self._patient(patient_id)[resolution].frame(signals, self._index, start_ns, end_ns)
+
+    def arrays(self, patient_id, resolution, start=None):
+        """(starts, [count, sum, min, max, last, last_time]) of the buckets ending after start, all signals"""
+        start_ns = pd.Timestamp(start).value if start is not None else None
+        with self._lock:
+            return self._patient(patient_id)[resolution].to_arrays(start_ns)
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def _snapshot_path(self, patient_id):
+        return os.path.join(self.root, str(patient_id), 'rollups.npz')
+
+    def save(self, patient_id):
+        with self._lock:
+            if str(patient_id) not in self._series:
+                return
+            arrays = {'newest': np.int64(self._newest.get(str(patient_id), 0)),
+                      'saved_at': np.float64(time.time()),
+                      'signals': np.array(self.signals)}
+            for res, rollup in self._series[str(patient_id)].items():
+                starts, stacked = rollup.to_arrays()
+                arrays[f'{res}_starts'] = starts
+                for i, values in enumerate(stacked):
+                    arrays[f'{res}_{i}'] = values
+        path = self._snapshot_path(patient_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path + '.tmp.npz', **arrays)
+        os.replace(path + '.tmp.npz', path)
+
+    def save_all(self):
+        for patient_id in list(self._series):
+            self.save(patient_id)
+
+    def load(self, patient_id):
+        """Load a snapshot; returns when it was taken (epoch seconds), or None"""
+        path = self._snapshot_path(patient_id)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as saved:
+            if list(saved['signals']) != self.signals:
+                return None
+            with self._lock:
+                series = self._patient(patient_id)
+                for res, rollup in series.items():
+                    rollup.load_arrays(saved[f'{res}_starts'], [saved[f'{res}_{i}'] for i in range(6)])
+                self._newest[str(patient_id)] = int(saved['newest'])
+            if 'saved_at' in saved:
+                return float(saved['saved_at'])
+            return pd.Timestamp(int(saved['newest'])).to_pydatetime().timestamp()  # older snapshot format
+
+    def _drop_day(self, patient_id, day_start):
+        start_ns = pd.Timestamp(day_start).value
+        with self._lock:
+            for rollup in self._patient(patient_id).values():
+                rollup.drop(start_ns, start_ns + 24 * 3600 * 10**9)
+
+    def warm_from_store(self, store, max_days=90):
+        """
+        Load snapshots, then re-fold every day partition written since its
+        snapshot was taken. Replaying by partition rather than by sample time
+        also picks up late or backfilled rows older than the snapshot's newest
+        sample; a re-folded day's buckets are dropped first so no row counts twice.
+        """
+        for patient_id in store.patients():
+            try:
+                saved_at = self.load(patient_id)
+            except Exception as e:
+                print(f"⚠️ Ignoring unreadable rollup snapshot for {patient_id}: {e}")
+                saved_at = None
+            if saved_at is None:
+                df = store.query(patient_id, start=datetime.now() - timedelta(days=max_days))
+                if not df.empty:
+                    self.add_rows(patient_id, df.astype(object).where(df.notna(), None).to_dict('records'))
+                continue
+            for day in store.partition_days(patient_id):
+                if os.path.getmtime(store.partition_path(patient_id, day)) < saved_at - SNAPSHOT_MARGIN_S:
+                    continue
+                day_start = datetime.strptime(day, '%Y-%m-%d')
+                self._drop_day(patient_id, day_start)
+                df = store.query(patient_id, start=day_start, end=day_start + timedelta(days=1, microseconds=-1))
+                if not df.empty:
+                    self.add_rows(patient_id, df.astype(object).where(df.notna(), None).to_dict('records'))
+
+    def start_snapshots(self, interval_seconds=300, enabled=None):
+        """Periodically persist all patients' rollups in a background thread, skipped while enabled() is False"""
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                if enabled is not None and not enabled():
+                    continue
+                try:
+                    self.save_all()
+                except Exception as e:
+                    print(f"❌ Rollup snapshot failed: {e}")
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+
+def pick_resolution(start, end, max_buckets=100, now=None):
+    """
+    Finest rollup resolution that keeps [start, end] within max_buckets rows and
+    whose retention still covers start (30min buckets are gone after 30 days)
+    """
+    span_s = max((end - start).total_seconds(), 1)
+    now = now or datetime.now()
+    for res, (width, retention) in RESOLUTIONS.items():
+        if retention is not None and start < now - retention:
+            continue
+        if span_s / width <= max_buckets:
+            return res
+    return '1day'
+
+
+def coarser_resolutions(resolution):
+    """The resolutions after `resolution`, finest first"""
+    names = list(RESOLUTIONS)
+    return names[names.index(resolution) + 1:]
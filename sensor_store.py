@@ -0,0 +1,683 @@
+# sensor_store.py
+import csv
+import io
+import os
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from config import SENSOR_COLUMNS
+from time_index import TimeIndex, index_path, read_rows_at, scan_rows
+
+try:
+    import fcntl
+except ImportError:  # no cross-process locking (Windows); shared=True needs it
+    fcntl = None
+
+
+class PartitionLog():
+    """
+    Append-only CSV log of watch sensor samples with a fixed column schema.
+
+    Each append writes a single line to the end of the file, so ingest cost does
+    not depend on how much history is already stored. On startup a torn last
+    line (process killed mid-write) is truncated away, and compact() rewrites
+    the log sorted by time with malformed rows dropped.
+
+    A TimeIndex of (epoch ns, byte offset) per row is maintained on append and
+    persisted next to the file on close/compaction, so range and nearest-sample
+    lookups read only the lines they need.
+
+    With shared=True several processes may append to the same file: appends and
+    compaction hold an flock on <file>.lock, and before each append or query the
+    index catches up with rows other processes appended (or is rebuilt if the
+    file was replaced by a compaction).
+    """
+
+    def __init__(self, path, columns=SENSOR_COLUMNS, fsync=False, shared=False):
+        self.path = path
+        self.columns = list(columns)
+        self.fsync = fsync
+        self.shared = shared and fcntl is not None
+        self.row_count = 0
+        self.latest_row = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._lock_file = None
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if self.shared:
+            self._lock_file = open(self.path + '.lock', 'a')
+        with self._file_lock(exclusive=True):
+            self._recover()
+            self.index = self._load_index()
+            self._file = open(self.path, 'ab')
+            self._indexed_size = os.fstat(self._file.fileno()).st_size
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """Cross-process lock of the partition (no-op unless shared)"""
+        if not self.shared:
+            yield
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Catch up with appends / compactions by other processes (file lock held)"""
+        if not self.shared or self._file is None:
+            return
+        stat = os.stat(self.path)
+        if stat.st_ino != os.fstat(self._file.fileno()).st_ino:
+            self._file.close()
+            self._file = open(self.path, 'ab')
+            self.index = TimeIndex.build(self.path)
+            self._indexed_size = stat.st_size
+            with open(self.path, 'rb') as f:
+                lines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
+            self.row_count = max(lines - 1, 0)
+            self.latest_row = self._read_last_row()
+        elif stat.st_size > self._indexed_size:
+            times, offsets, end = scan_rows(self.path, self._indexed_size)
+            self.index.add(times, offsets)
+            self._indexed_size = end
+            self.row_count += len(offsets)
+            self.latest_row = self._read_last_row()
+
+    def _load_index(self):
+        index = TimeIndex.load(index_path(self.path), os.path.getsize(self.path))
+        return index if index is not None else TimeIndex.build(self.path)
+
+    def save_index(self):
+        self.index.save(index_path(self.path), os.path.getsize(self.path))
+
+    # -------------------------------
+    # Startup recovery
+    # -------------------------------
+    def _recover(self):
+        """Repair the log left by a previous run and rebuild the row counters"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            self._write_header()
+            return
+
+        with open(self.path, 'rb+') as f:
+            # Drop a partial trailing line from an interrupted write
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(size - 1)
+            if f.read(1) != b'\n':
+                pos = size
+                while pos > 0:
+                    step = min(64 * 1024, pos)
+                    pos -= step
+                    f.seek(pos)
+                    idx = f.read(step).rfind(b'\n')
+                    if idx != -1:
+                        f.truncate(pos + idx + 1)
+                        print(f"⚠️ Truncated torn write at end of {self.path}")
+                        break
+                else:
+                    f.truncate(0)
+
+        with open(self.path, newline='') as f:
+            header = next(csv.reader(f), None)
+
+        if header != self.columns:
+            # Legacy file written by pd.concat/to_csv with a drifting schema
+            self.compact()
+            return
+
+        with open(self.path, 'rb') as f:
+            lines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
+        self.row_count = max(lines - 1, 0)
+        self.latest_row = self._read_last_row()
+
+    def _write_header(self):
+        with open(self.path, 'w', newline='') as f:
+            csv.writer(f, lineterminator='\n').writerow(self.columns)
+        self.row_count = 0
+        self.latest_row = {}
+
+    def _read_last_row(self):
+        if self.row_count == 0:
+            return {}
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - 64 * 1024, 0))
+            last_line = f.read().rstrip(b'\r\n').rsplit(b'\n', 1)[-1].decode('utf-8').rstrip('\r')
+        values = next(csv.reader([last_line]))
+        return dict(zip(self.columns, values))
+
+    # -------------------------------
+    # Write path
+    # -------------------------------
+    def _format_row(self, row):
+        """Project a sample onto the fixed schema; unknown keys are dropped"""
+        values = []
+        for col in self.columns:
+            value = row.get(col)
+            values.append('' if value is None else value)
+        return values
+
+    def append(self, row):
+        """Append one sample in O(1)"""
+        self.append_many([row])
+
+    def append_many(self, rows):
+        """Append several samples with a single write and flush"""
+        if not rows:
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        lines = []
+        for row in rows:
+            writer.writerow(self._format_row(row))
+            lines.append(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+        times = [pd.Timestamp(row['time_stamp']).value for row in rows]
+        data = b''.join(lines)
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            start = self._indexed_size if self.shared else self._file.tell()
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._indexed_size = start + len(data)
+            offsets = start + np.cumsum([0] + [len(line) for line in lines[:-1]])
+            self.index.add(times, offsets)
+            self.row_count += len(rows)
+            self.latest_row = {col: rows[-1].get(col) for col in self.columns}
+
+    # -------------------------------
+    # Read path
+    # -------------------------------
+    def read_df(self):
+        """Load the full history as a DataFrame"""
+        with self._lock:
+            if self._file:
+                self._file.flush()
+            return pd.read_csv(self.path)
+
+    def query(self, start_ns=None, end_ns=None):
+        """Rows with start_ns <= time <= end_ns, sorted by time, located through the index"""
+        with self._file_lock(exclusive=False):
+            with self._lock:
+                if self._file:
+                    self._file.flush()
+                self._sync()
+                offsets = self.index.range_offsets(start_ns, end_ns).copy()
+            return query_rows(self.path, self.index, offsets, self.columns, start_ns, end_ns)
+
+    # -------------------------------
+    # Maintenance
+    # -------------------------------
+    def compact(self):
+        """Rewrite the log sorted by time, dropping rows without a valid timestamp"""
+        with self._lock, self._file_lock(exclusive=True):
+            if self._file:
+                self._file.flush()
+            try:
+                df = pd.read_csv(self.path, on_bad_lines='skip')
+            except pd.errors.EmptyDataError:
+                df = pd.DataFrame(columns=self.columns)
+            df = df.reindex(columns=self.columns)
+            parsed = pd.to_datetime(df['time_stamp'], errors='coerce', format='mixed')
+            df = df[parsed.notna()].iloc[parsed[parsed.notna()].argsort(kind='stable')]
+
+            tmp_path = self.path + '.tmp'
+            df.to_csv(tmp_path, index=False)
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            was_open = self._file is not None
+            if was_open:
+                self._file.close()
+            os.replace(tmp_path, self.path)
+            self.index = TimeIndex.build(self.path)
+            self.save_index()
+            if was_open:
+                self._file = open(self.path, 'ab')
+            self._indexed_size = os.path.getsize(self.path)
+
+            self.row_count = len(df)
+            self.latest_row = df.iloc[-1].to_dict() if len(df) else {}
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                with self._file_lock(exclusive=True):
+                    self._sync()
+                    self._file.close()
+                    self._file = None
+                    self.save_index()
+            if self._lock_file:
+                self._lock_file.close()
+                self._lock_file = None
+
+
+def query_rows(path, index, offsets, columns, start_ns=None, end_ns=None):
+    """Read indexed rows and apply the exact time bounds"""
+    df = read_rows_at(path, offsets, columns)
+    if df.empty:
+        return df
+    times = pd.to_datetime(df['time_stamp'], format='mixed').astype('datetime64[ns]').astype('int64')
+    mask = pd.Series(True, index=df.index)
+    if start_ns is not None:
+        mask &= times >= start_ns
+    if end_ns is not None:
+        mask &= times <= end_ns
+    order = np.argsort(times[mask].to_numpy(), kind='stable')
+    return df[mask].iloc[order].reset_index(drop=True)
+
+
+class SensorStore():
+    """
+    Multi-patient sensor storage partitioned by patient and day.
+
+    Samples live in <root>/<patient_id>/<yyyy-mm-dd>.csv, one PartitionLog per
+    file. Only the partition currently receiving writes is kept open per
+    patient; when a patient rolls over to a new day the previous partition is
+    compacted and closed. Time-range reads only open the partitions whose day
+    overlaps the requested range.
+
+    shared=True when several processes write the same root (see PartitionLog);
+    indexes of partitions this process does not write are then extended with
+    the rows appended since they were read.
+    """
+
+    def __init__(self, root, columns=SENSOR_COLUMNS, fsync=False, shared=False):
+        self.root = root
+        self.columns = list(columns)
+        self.fsync = fsync
+        self.shared = shared
+        self._logs = {}  # (patient_id, day) -> PartitionLog, active partitions only
+        self._retiring = set()  # keys of _logs for earlier days, compacted and closed outside _lock
+        self._latest_rows = {}
+        self._indexes = {}  # path -> ((inode, indexed size), TimeIndex) for partitions not open here
+        self.index_cache_size = 256
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # -------------------------------
+    # Layout
+    # -------------------------------
+    def _patient_dir(self, patient_id):
+        patient_id = str(patient_id)
+        if not re.match(r'^\w+$', patient_id):
+            raise ValueError(f"Invalid patient_id: {patient_id!r}")
+        return os.path.join(self.root, patient_id)
+
+    def partition_path(self, patient_id, day):
+        return os.path.join(self._patient_dir(patient_id), f'{day}.csv')
+
+    def patients(self):
+        """List patient IDs that have stored data"""
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def partition_days(self, patient_id):
+        """Sorted list of days (yyyy-mm-dd) stored for a patient"""
+        folder = self._patient_dir(patient_id)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(f[:-4] for f in os.listdir(folder) if re.match(r'^\d{4}-\d{2}-\d{2}\.csv$', f))
+
+    def _get_log(self, patient_id, day):
+        """Partition log receiving a day's rows (store lock held)"""
+        key = (str(patient_id), day)
+        log = self._logs.get(key)
+        if log is None:
+            # The patient's partitions for earlier days are compacted and closed by _retire_logs
+            self._retiring.update(k for k in self._logs if k[0] == key[0] and k[1] < day)
+            os.makedirs(self._patient_dir(patient_id), exist_ok=True)
+            log = PartitionLog(self.partition_path(patient_id, day), self.columns, self.fsync, self.shared)
+            self._logs[key] = log
+        return log
+
+    # -------------------------------
+    # Write path
+    # -------------------------------
+    def append(self, patient_id, row):
+        """Append one sample for a patient"""
+        self.append_many(patient_id, [row])
+
+    def append_many(self, patient_id, rows):
+        """Append samples for a patient, routing each to its day partition"""
+        if not rows:
+            return
+        by_day = {}
+        newest = None
+        for row in rows:
+            time_stamp = row.get('time_stamp')
+            if not isinstance(time_stamp, datetime):
+                time_stamp = pd.Timestamp(time_stamp).to_pydatetime() if time_stamp else datetime.now()
+                row = dict(row, time_stamp=time_stamp)
+            by_day.setdefault(time_stamp.strftime('%Y-%m-%d'), []).append(row)
+            if newest is None or time_stamp >= newest['time_stamp']:
+                newest = row
+
+        latest = self.latest_row(patient_id)
+        with self._lock:
+            for day in sorted(by_day):
+                self._get_log(patient_id, day).append_many(by_day[day])
+            if not latest.get('time_stamp') or newest['time_stamp'] >= pd.Timestamp(str(latest['time_stamp'])):
+                self._latest_rows[str(patient_id)] = {col: newest.get(col) for col in self.columns}
+        if self._retiring:
+            self._retire_logs()
+
+    def _retire_logs(self):
+        """
+        Compact and close the partitions left behind by a day rollover. Runs
+        outside the store lock, so only late rows for the day being compacted
+        wait (on that partition's own lock); other patients keep ingesting.
+        """
+        with self._lock:
+            keys, self._retiring = self._retiring, set()
+            logs = [(key, self._logs[key]) for key in sorted(keys) if key in self._logs]
+        for key, log in logs:
+            try:
+                log.compact()
+            except Exception as e:
+                print(f"❌ Compaction of {log.path} failed: {e}")
+            with self._lock:
+                if self._logs.get(key) is log:
+                    del self._logs[key]
+                log.close()
+
+    # -------------------------------
+    # Read path
+    # -------------------------------
+    def _partition_index(self, patient_id, day):
+        """TimeIndex of a partition: live for the active one, loaded (and cached) for closed ones"""
+        log = self._logs.get((str(patient_id), day))
+        if log is not None:
+            return log.index
+        path = self.partition_path(patient_id, day)
+        stat = os.stat(path)
+        cached = self._indexes.get(path)
+        if cached is not None and cached[0] == (stat.st_ino, stat.st_size):
+            return cached[1]
+        if cached is not None and cached[0][0] == stat.st_ino and cached[0][1] < stat.st_size:
+            # Another process appended: index only the new rows
+            index = cached[1]
+            times, offsets, end = scan_rows(path, cached[0][1])
+            index.add(times, offsets)
+            self._indexes[path] = ((stat.st_ino, end), index)
+            return index
+        index = TimeIndex.load(index_path(path), stat.st_size)
+        if index is None:
+            index = TimeIndex.build(path)
+            index.save(index_path(path), stat.st_size)
+        self._indexes[path] = ((stat.st_ino, stat.st_size), index)
+        while len(self._indexes) > self.index_cache_size:
+            self._indexes.pop(next(iter(self._indexes)))
+        return index
+
+    def _days_between(self, patient_id, start=None, end=None):
+        start_day = start.strftime('%Y-%m-%d') if start is not None else None
+        end_day = end.strftime('%Y-%m-%d') if end is not None else None
+        return [d for d in self.partition_days(patient_id)
+                if (start_day is None or d >= start_day) and (end_day is None or d <= end_day)]
+
+    def query(self, patient_id, signals=None, start=None, end=None):
+        """
+        Rows of a patient with start <= time_stamp <= end, restricted to `signals`.
+        Only partitions whose day overlaps the range are touched, and within each
+        one the sorted time index locates the rows (np.searchsorted) so only the
+        matching lines are read.
+        """
+        start_ns = pd.Timestamp(start).value if start is not None else None
+        end_ns = pd.Timestamp(end).value if end is not None else None
+        columns = self.columns if signals is None else ['time_stamp'] + [s for s in signals if s != 'time_stamp']
+
+        frames = []
+        for day in self._days_between(patient_id, start, end):
+            log = self._logs.get((str(patient_id), day))
+            if log is not None:
+                frames.append(log.query(start_ns, end_ns))
+                continue
+            index = self._partition_index(patient_id, day)
+            offsets = index.range_offsets(start_ns, end_ns)
+            frames.append(query_rows(self.partition_path(patient_id, day), index, offsets,
+                                     self.columns, start_ns, end_ns))
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True).reindex(columns=columns)
+
+    def nearest(self, patient_id, timestamps, signals=None, tolerance=timedelta(minutes=15)):
+        """
+        For each requested timestamp (e.g. the list_date x list_time slots from
+        combine_data_and_time) return the closest stored sample within tolerance.
+        The result has a 'requested_time' column; slots without data are omitted.
+        """
+        columns = self.columns if signals is None else ['time_stamp'] + [s for s in signals if s != 'time_stamp']
+        targets = pd.to_datetime(pd.Series(list(timestamps)), format='mixed')
+        tolerance_ns = pd.Timedelta(tolerance).value
+
+        frames = []
+        days = set(self.partition_days(patient_id))
+        for day, group in targets.groupby(targets.dt.strftime('%Y-%m-%d')):
+            # Candidates from the slot's own day and its neighbours (slots near midnight)
+            best_times, best_offsets, best_paths = None, None, None
+            target_ns = group.astype('datetime64[ns]').astype('int64').to_numpy()
+            for offset_days in (-1, 0, 1):
+                candidate = (pd.Timestamp(day) + pd.Timedelta(days=offset_days)).strftime('%Y-%m-%d')
+                if candidate not in days:
+                    continue
+                times, offsets = self._partition_index(patient_id, candidate).nearest(target_ns)
+                if not len(times):
+                    continue
+                path = self.partition_path(patient_id, candidate)
+                if best_times is None:
+                    best_times, best_offsets = times, offsets
+                    best_paths = np.full(len(times), path, dtype=object)
+                    continue
+                closer = np.abs(times - target_ns) < np.abs(best_times - target_ns)
+                best_times = np.where(closer, times, best_times)
+                best_offsets = np.where(closer, offsets, best_offsets)
+                best_paths = np.where(closer, path, best_paths)
+            if best_times is None:
+                continue
+
+            within = np.abs(best_times - target_ns) <= tolerance_ns
+            for path in set(best_paths[within]):
+                pick = within & (best_paths == path)
+                self._flush_partition(path)
+                # Lines come back once each in file order; map them back onto their slots
+                unique_offsets, slot_rows = np.unique(best_offsets[pick], return_inverse=True)
+                rows = read_rows_at(path, unique_offsets, self.columns).reindex(columns=columns)
+                rows = rows.iloc[slot_rows].reset_index(drop=True)
+                rows.insert(0, 'requested_time', group[pick].dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy())
+                frames.append(rows)
+        if not frames:
+            return pd.DataFrame(columns=['requested_time'] + columns)
+        return pd.concat(frames, ignore_index=True).sort_values('requested_time').reset_index(drop=True)
+
+    def _flush_partition(self, path):
+        for log in list(self._logs.values()):
+            if log.path == path and log._file:
+                with log._lock:
+                    log._file.flush()
+
+    def read_df(self, patient_id):
+        """Load a patient's full history"""
+        return self.query(patient_id)
+
+    def latest_row(self, patient_id):
+        """Most recent sample for a patient, without reading the history"""
+        patient_id = str(patient_id)
+        if patient_id not in self._latest_rows:
+            days = self.partition_days(patient_id)
+            if not days:
+                return {}
+            log = self._logs.get((patient_id, days[-1]))
+            if log is None:
+                log = PartitionLog(self.partition_path(patient_id, days[-1]), self.columns, shared=self.shared)
+                log.close()
+            self._latest_rows[patient_id] = log.latest_row
+        return self._latest_rows[patient_id]
+
+    def row_count(self, patient_id):
+        """Number of stored samples for a patient (counts lines of closed partitions)"""
+        total = 0
+        for day in self.partition_days(patient_id):
+            log = self._logs.get((str(patient_id), day))
+            if log is not None:
+                total += log.row_count
+                continue
+            with open(self.partition_path(patient_id, day), 'rb') as f:
+                lines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
+            total += max(lines - 1, 0)
+        return total
+
+    # -------------------------------
+    # Maintenance
+    # -------------------------------
+    def import_legacy_csv(self, path, patient_id):
+        """Split a single-file patient CSV into day partitions, then retire it"""
+        if not os.path.exists(path):
+            return 0
+        df = pd.read_csv(path, on_bad_lines='skip').reindex(columns=self.columns)
+        df['time_stamp'] = pd.to_datetime(df['time_stamp'], errors='coerce', format='mixed')
+        df = df[df['time_stamp'].notna()]
+        rows = df.astype(object).where(df.notna(), None).to_dict('records')
+        for row in rows:
+            row['time_stamp'] = row['time_stamp'].to_pydatetime()
+        self.append_many(patient_id, rows)
+        os.replace(path, path + '.migrated')
+        print(f"✓ Migrated {len(rows)} rows from {path} into {self._patient_dir(patient_id)}")
+        return len(rows)
+
+    def compact(self):
+        """Compact the active partitions"""
+        with self._lock:
+            logs = list(self._logs.values())
+        for log in logs:
+            log.compact()
+
+    def start_compaction(self, interval_seconds=3600, enabled=None):
+        """Run compact() periodically in a background thread, skipped while enabled() is False"""
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                if enabled is not None and not enabled():
+                    continue
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"❌ Compaction failed for {self.root}: {e}")
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        with self._lock:
+            for log in self._logs.values():
+                log.close()
+            self._logs = {}
+
+
+class WriteCoalescer():
+    """
+    Groups concurrent appends into one store write per patient.
+
+    Rows submitted by different requests are buffered and flushed together
+    every max_delay_ms milliseconds or as soon as max_rows are pending,
+    whichever comes first. submit() blocks until its rows have been written,
+    so callers still only acknowledge data that reached the log.
+    """
+
+    def __init__(self, store, max_rows=500, max_delay_ms=50):
+        self.store = store
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000.0
+        self.flush_count = 0
+        self.row_count = 0
+        self._pending = {}
+        self._pending_rows = 0
+        self._batch_done = self._new_batch()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, patient_id, rows, wait=True):
+        """Queue rows for the next flush; returns once written when wait=True"""
+        if not rows:
+            return
+        with self._lock:
+            self._pending.setdefault(str(patient_id), []).extend(rows)
+            self._pending_rows += len(rows)
+            done = self._batch_done
+            if self._pending_rows >= self.max_rows:
+                self._wakeup.set()
+        if wait:
+            done.wait()
+            error = done.errors.get(str(patient_id))
+            if error is not None:
+                raise error
+
+    @staticmethod
+    def _new_batch():
+        done = threading.Event()
+        done.errors = {}  # patient_id -> exception of its failed append
+        return done
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_rows = 0
+            done, self._batch_done = self._batch_done, self._new_batch()
+        written = 0
+        try:
+            # One patient's failure only fails that patient's submitters; the others' rows are still written
+            for patient_id, rows in pending.items():
+                try:
+                    self.store.append_many(patient_id, rows)
+                    written += len(rows)
+                except Exception as e:
+                    print(f"❌ Coalesced write of {len(rows)} rows for patient {patient_id} failed: {e}")
+                    done.errors[patient_id] = e
+            if written:
+                self.flush_count += 1
+                self.row_count += written
+        finally:
+            done.set()
+
+
+# ==================== Benchmark ====================
+if __name__ == '__main__':
+    import tempfile
+
+    sample = {col: 1.0 for col in SENSOR_COLUMNS}
+    with tempfile.TemporaryDirectory() as tmp:
+        log = PartitionLog(os.path.join(tmp, 'bench.csv'))
+        checkpoints = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+        for target in checkpoints:
+            # Bulk-fill up to the checkpoint, then time single-row appends
+            filler = [dict(sample, time_stamp=datetime.now())] * 10_000
+            while log.row_count < target:
+                log.append_many(filler[:target - log.row_count])
+            start = time.perf_counter()
+            for _ in range(1_000):
+                log.append(dict(sample, time_stamp=datetime.now()))
+            per_row_us = (time.perf_counter() - start) / 1_000 * 1e6
+            print(f"{log.row_count:>12,} rows stored: {per_row_us:8.1f} µs per append")
+        log.close()
@@ -0,0 +1,69 @@
+# series.py
+import struct
+
+import numpy as np
+import pandas as pd
+
+from utils import lttb
+
+MAX_WIDTH = 4000
+BINARY_MAGIC = b'RMSR'
+BINARY_VERSION = 1
+
+
+def downsample_series(df, signals, width=800):
+    """
+    Per-signal (times_ms, values, raw_count) downsampled with LTTB to at most
+    width points, i.e. about one point per horizontal pixel of the chart.
+    Times are epoch milliseconds of the naive local timestamps.
+    """
+    width = max(3, min(int(width), MAX_WIDTH))
+    series = {}
+    if df.empty:
+        return series
+    times_ns = pd.to_datetime(df['time_stamp'], format='mixed').astype('datetime64[ns]').to_numpy().astype(np.int64)
+    order = times_ns.argsort(kind='stable')
+    times_ns = times_ns[order]
+    for signal in signals:
+        if signal not in df.columns:
+            continue
+        values = pd.to_numeric(df[signal], errors='coerce').to_numpy(dtype=float)[order]
+        valid = ~np.isnan(values)
+        x, y = times_ns[valid], values[valid]
+        keep = lttb(x, y, width)
+        series[signal] = (x[keep] // 10**6, y[keep], int(valid.sum()))
+    return series
+
+
+def encode_json(series):
+    """{signal: {'t0', 'dt', 'v', 'raw_points'}} with timestamps delta-encoded in ms"""
+    out = {}
+    for signal, (times_ms, values, raw_count) in series.items():
+        out[signal] = {
+            't0': int(times_ms[0]) if len(times_ms) else None,
+            'dt': np.diff(times_ms).tolist(),
+            'v': np.round(values.astype(np.float32).astype(float), 3).tolist(),
+            'raw_points': raw_count,
+        }
+    return out
+
+
+def encode_binary(series):
+    """
+    Little-endian binary payload:
+        'RMSR' | uint16 version | uint16 n_series
+        per series: uint16 name_len | name (utf-8) | uint32 n | uint32 raw_points |
+                    float64 t0_ms | uint32[n-1] dt_ms | float32[n] values
+    Raises ValueError if a gap between two points does not fit in uint32 ms (~49 days).
+    """
+    parts = [BINARY_MAGIC, struct.pack('<HH', BINARY_VERSION, len(series))]
+    for signal, (times_ms, values, raw_count) in series.items():
+        name = signal.encode('utf-8')
+        deltas = np.diff(times_ms)
+        if len(deltas) and deltas.max() > np.iinfo(np.uint32).max:
+            raise ValueError(f"Gap in {signal} too large for the binary format, use format=json")
+        parts.append(struct.pack('<H', len(name)) + name)
+        parts.append(struct.pack('<IId', len(times_ms), raw_count, float(times_ms[0]) if len(times_ms) else 0.0))
+        parts.append(deltas.astype('<u4').tobytes())
+        parts.append(values.astype('<f4').tobytes())
+    return b''.join(parts)
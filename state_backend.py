@@ -0,0 +1,358 @@
+# state_backend.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+
+class StateBackend():
+    """
+    State shared by the web workers: JSON values, hashes, leases for leader
+    election and a publish / subscribe channel.
+
+    Messages published by a worker are delivered to the subscribers of every
+    other worker (not its own, which already applied the change locally).
+    shared is False for the in-process backend, i.e. when there is only one
+    worker and nothing needs to be replicated.
+    """
+
+    shared = True
+
+    def __init__(self):
+        self.node_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._callbacks = {}  # channel -> [callback]
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def hset(self, name, field, value):
+        raise NotImplementedError
+
+    def hget(self, name, field, default=None):
+        raise NotImplementedError
+
+    def hgetall(self, name):
+        raise NotImplementedError
+
+    def acquire_lease(self, name, ttl):
+        """Take or renew the named lease for this node; True while this node holds it"""
+        raise NotImplementedError
+
+    def release_lease(self, name):
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel, callback):
+        """Call callback(message) for every message other workers publish on channel"""
+        self._callbacks.setdefault(channel, []).append(callback)
+
+    def _dispatch(self, channel, envelope):
+        if envelope.get('origin') == self.node_id:
+            return
+        for callback in self._callbacks.get(channel, []):
+            try:
+                callback(envelope['message'])
+            except Exception as e:
+                print(f"❌ State subscriber for {channel} failed: {e}")
+
+    def _envelope(self, message):
+        return json.dumps({'origin': self.node_id, 'message': message}, default=str)
+
+
+class InProcessBackend(StateBackend):
+    """Plain dicts, for a single worker; publish() has nobody to deliver to"""
+
+    shared = False
+
+    def __init__(self):
+        super().__init__()
+        self._values = {}  # key -> (value, expires)
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        value, expires = self._values.get(key, (default, None))
+        if expires is not None and expires < time.time():
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    def hset(self, name, field, value):
+        with self._lock:
+            self._hashes.setdefault(name, {})[field] = value
+
+    def hget(self, name, field, default=None):
+        return self._hashes.get(name, {}).get(field, default)
+
+    def hgetall(self, name):
+        return dict(self._hashes.get(name, {}))
+
+    def acquire_lease(self, name, ttl):
+        with self._lock:
+            owner = self.get(f'lease:{name}')
+            if owner not in (None, self.node_id):
+                return False
+            self.set(f'lease:{name}', self.node_id, ttl)
+            return True
+
+    def release_lease(self, name):
+        with self._lock:
+            if self.get(f'lease:{name}') == self.node_id:
+                self._values.pop(f'lease:{name}', None)
+
+    def publish(self, channel, message):
+        pass
+
+
+class SQLiteBackend(StateBackend):
+    """
+    One SQLite file (WAL mode) shared by the workers of a host. Published
+    messages go to an events table that every worker polls every poll_interval
+    seconds; events older than event_retention seconds are pruned.
+    """
+
+    def __init__(self, path, poll_interval=0.1, event_retention=60):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.event_retention = event_retention
+        self._local = threading.local()
+        self._poller = None
+        self._last_event = 0
+        self._published = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS hashes (name TEXT, field TEXT, value TEXT NOT NULL, '
+                       'PRIMARY KEY (name, field))')
+            db.execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'channel TEXT NOT NULL, envelope TEXT NOT NULL, created REAL NOT NULL)')
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def get(self, key, default=None):
+        row = self._connect().execute('SELECT value, expires FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        self._connect().execute('INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)',
+                                (key, json.dumps(value, default=str), time.time() + ttl if ttl else None))
+
+    def hset(self, name, field, value):
+        self._connect().execute('INSERT OR REPLACE INTO hashes (name, field, value) VALUES (?, ?, ?)',
+                                (name, field, json.dumps(value, default=str)))
+
+    def hget(self, name, field, default=None):
+        row = self._connect().execute('SELECT value FROM hashes WHERE name = ? AND field = ?',
+                                      (name, field)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def hgetall(self, name):
+        rows = self._connect().execute('SELECT field, value FROM hashes WHERE name = ?', (name,)).fetchall()
+        return {field: json.loads(value) for field, value in rows}
+
+    def acquire_lease(self, name, ttl):
+        db = self._connect()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT value, expires FROM kv WHERE key = ?', (f'lease:{name}',)).fetchone()
+            held = row is not None and row[1] is not None and row[1] >= now and json.loads(row[0]) != self.node_id
+            if not held:
+                db.execute('INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)',
+                           (f'lease:{name}', json.dumps(self.node_id), now + ttl))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return not held
+
+    def release_lease(self, name):
+        self._connect().execute('DELETE FROM kv WHERE key = ? AND value = ?',
+                                (f'lease:{name}', json.dumps(self.node_id)))
+
+    def publish(self, channel, message):
+        db = self._connect()
+        now = time.time()
+        db.execute('INSERT INTO events (channel, envelope, created) VALUES (?, ?, ?)',
+                   (channel, self._envelope(message), now))
+        self._published += 1
+        if self._published % 1000 == 0:
+            db.execute('DELETE FROM events WHERE created < ?', (now - self.event_retention,))
+
+    def subscribe(self, channel, callback):
+        super().subscribe(channel, callback)
+        if self._poller is None:
+            row = self._connect().execute('SELECT MAX(id) FROM events').fetchone()
+            self._last_event = row[0] or 0
+            self._poller = threading.Thread(target=self._poll_loop, daemon=True)
+            self._poller.start()
+
+    def _poll_loop(self):
+        while True:
+            rows = []
+            try:
+                rows = self._connect().execute(
+                    'SELECT id, channel, envelope FROM events WHERE id > ? ORDER BY id LIMIT 1000',
+                    (self._last_event,)).fetchall()
+                for event_id, channel, envelope in rows:
+                    self._last_event = event_id
+                    self._dispatch(channel, json.loads(envelope))
+            except sqlite3.Error as e:
+                print(f"❌ State event poll failed: {e}")
+            if len(rows) < 1000:
+                time.sleep(self.poll_interval)
+
+
+class RedisBackend(StateBackend):
+    """
+    Any Redis-compatible server (Redis, Valkey, KeyDB, ...). Keys are prefixed
+    so the database can be shared with the SocketIO message queue. Needs the
+    optional redis package.
+    """
+
+    # Renew the lease if this node holds it, else take it only if nobody does
+    _LEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, url, prefix='remoni:'):
+        super().__init__()
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis://... needs the redis package (pip install redis)") from e
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._lease = self._redis.register_script(self._LEASE_SCRIPT)
+        self._pubsub = None
+        self._pubsub_thread = None
+
+    def get(self, key, default=None):
+        value = self._redis.get(self.prefix + key)
+        return json.loads(value) if value is not None else default
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self.prefix + key, json.dumps(value, default=str), px=int(ttl * 1000) if ttl else None)
+
+    def hset(self, name, field, value):
+        self._redis.hset(self.prefix + name, field, json.dumps(value, default=str))
+
+    def hget(self, name, field, default=None):
+        value = self._redis.hget(self.prefix + name, field)
+        return json.loads(value) if value is not None else default
+
+    def hgetall(self, name):
+        return {field.decode('utf-8'): json.loads(value)
+                for field, value in self._redis.hgetall(self.prefix + name).items()}
+
+    def acquire_lease(self, name, ttl):
+        return bool(self._lease(keys=[f'{self.prefix}lease:{name}'], args=[self.node_id, int(ttl * 1000)]))
+
+    def release_lease(self, name):
+        key = f'{self.prefix}lease:{name}'
+        if self._redis.get(key) == self.node_id.encode('utf-8'):
+            self._redis.delete(key)
+
+    def publish(self, channel, message):
+        self._redis.publish(self.prefix + channel, self._envelope(message))
+
+    def subscribe(self, channel, callback):
+        super().subscribe(channel, callback)
+        if self._pubsub is None:
+            self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        if len(self._callbacks[channel]) == 1:
+            self._pubsub.subscribe(**{self.prefix + channel: self._on_message})
+        if self._pubsub_thread is None:
+            self._pubsub_thread = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
+    def _on_message(self, item):
+        channel = item['channel'].decode('utf-8')[len(self.prefix):]
+        self._dispatch(channel, json.loads(item['data']))
+
+
+def backend_from_url(url):
+    """memory:// (default), sqlite:///path/to/state.db or redis://host:port/db"""
+    parsed = urlparse(url or 'memory://')
+    if parsed.scheme in ('', 'memory'):
+        return InProcessBackend()
+    if parsed.scheme == 'sqlite':
+        return SQLiteBackend(parsed.netloc + parsed.path if parsed.netloc else parsed.path)
+    if parsed.scheme in ('redis', 'rediss'):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown STATE_BACKEND scheme: {url}")
+
+
+class LeaderElection():
+    """
+    Keeps one worker in charge of a job through a lease in the state backend.
+
+    Every worker tries to take (or renew) the lease every ttl / 3 seconds; the
+    holder runs on_elected once when it wins and on_demoted if it fails to
+    renew, so another worker takes over at most ttl seconds after the leader
+    dies.
+    """
+
+    def __init__(self, backend, name, ttl=15, on_elected=None, on_demoted=None):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.is_leader = False
+        self._thread = None
+
+    def step(self):
+        try:
+            leader = self.backend.acquire_lease(self.name, self.ttl)
+        except Exception as e:
+            print(f"❌ Lease renewal for {self.name} failed: {e}")
+            leader = False
+        if leader and not self.is_leader:
+            self.is_leader = True
+            print(f"👑 Worker {self.backend.node_id} now leads {self.name}")
+            if self.on_elected:
+                self.on_elected()
+        elif not leader and self.is_leader:
+            self.is_leader = False
+            print(f"⚠️ Worker {self.backend.node_id} lost the {self.name} lease")
+            if self.on_demoted:
+                self.on_demoted()
+        return self.is_leader
+
+    def start(self):
+        if self._thread is not None:
+            return self._thread
+
+        def loop():
+            while True:
+                self.step()
+                time.sleep(self.ttl / 3)
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+        return self._thread
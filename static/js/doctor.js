@@ -44,8 +44,42 @@ class Chatbox {
         };
         displayNextMessage();
         
-        // Connect to the WebSocket server
-        const socket = io();
+        // Connect to the WebSocket server (websocket only: with several gunicorn workers
+        // the polling requests of one session could land on different workers)
+        const socket = io({ transports: ['websocket'] });
+        this.socket = socket;
+
+        // Streamed answers: append tokens to the reply of the matching request as they arrive
+        socket.on('chat_token', (data) => {
+            let reply = this.messages.find(item => item.request_id === data.request_id);
+            if (!reply) {
+                reply = { name: "REMONI", message: "", request_id: data.request_id };
+                this.messages.push(reply);
+            }
+            if (reply.done) {
+                return;  // the POST reply already delivered the full answer
+            }
+            reply.message += data.token;
+            this.scheduleUpdate(chatBox);
+        });
+
+        // Vitals of watched patients arrive as deltas: merge them, then ack so the server sends the next frame
+        this.vitals = {};
+        this.watching = null;
+        socket.on('vitals_update', (data) => {
+            (data.updates || []).forEach(update => {
+                const previous = update.full ? {} : (this.vitals[update.patient_id] || {});
+                this.vitals[update.patient_id] = Object.assign({}, previous, update.vitals);
+            });
+            this.updateVitals();
+            socket.emit('vitals_ack');
+        });
+        socket.on('connect', () => {
+            if (this.watching) {
+                socket.emit('watch', this.watching);  // subscriptions do not survive a reconnect
+            }
+        });
+        this.watchPatients([$PATIENT_ID], $VITALS_RATE);
 
         // Listen for the fall_alert event
         socket.on('fall_alert', (data) => {
@@ -55,6 +89,32 @@ class Chatbox {
             this.messages.push({ name: "REMONI", message: data.message });
             this.updateChatText(chatBox);
         });
+
+        // Anomalies the server detected in incoming vitals
+        socket.on('anomaly', (data) => {
+            this.messages.push({ name: "REMONI", message: data.message });
+            this.updateChatText(chatBox);
+        });
+    }
+
+    // Receive vitals_update frames for these patients, at most maxRate per second
+    watchPatients(patientIds, maxRate) {
+        this.watching = { patient_ids: patientIds, max_rate: maxRate };
+        if (this.socket.connected) {
+            this.socket.emit('watch', this.watching);
+        }
+    }
+
+    // Live vitals of the first watched patient in the header
+    updateVitals() {
+        const element = this.args.chatBox.querySelector('.vitals');
+        const vitals = this.watching && this.vitals[this.watching.patient_ids[0]];
+        if (!element || !vitals) {
+            return;
+        }
+        const bp = vitals.blood_pressure || {};
+        element.textContent = 'Patient ' + this.watching.patient_ids[0] + ': HR ' + vitals.heart_rate + ' BPM, SpO2 '
+            + vitals.spo2 + '%, BP ' + bp.systolic + '/' + bp.diastolic + ' mmHg, skin ' + vitals.skin_temperature + '°C';
     }
 
     onSendButton(chatbox) {
@@ -69,9 +129,15 @@ class Chatbox {
         this.updateChatText(chatbox);
         textField.value = '';
         //'http://127.0.0.1:5000/doctor/chat'
+        // With a live socket the answer is streamed token by token; the POST reply is the fallback
+        const request_id = Date.now().toString(36) + Math.random().toString(36).slice(2);
+        const stream = Boolean(this.socket && this.socket.connected);
         fetch($SCRIPT_ROOT + '/chat', {
             method: 'POST',
-            body: JSON.stringify({ message: text1 }),
+            body: JSON.stringify({
+                message: text1, client_charts: true,
+                stream: stream, sid: stream ? this.socket.id : null, request_id: request_id
+            }),
             mode: 'cors',
             headers: {
               'Content-Type': 'application/json'
@@ -80,8 +146,13 @@ class Chatbox {
           .then(r => r.json())
           .then(r => {
             console.log(r)
-            let msg2 = { name: "REMONI", message: r.answer };
-            this.messages.push(msg2);
+            let streamed = this.messages.find(item => item.request_id === request_id);
+            if (streamed) {
+                streamed.message = r.answer;
+                streamed.done = true;
+            } else {
+                this.messages.push({ name: "REMONI", message: r.answer, request_id: request_id, done: true });
+            }
             this.updateChatText(chatbox);
             textField.value = '';
 
@@ -96,6 +167,23 @@ class Chatbox {
                 });
             }
 
+            // Handle series handles: fetch the downsampled data and draw it in the browser
+            if ('series' in r && r.series && r.series.length > 0) {
+                r.series.forEach(handle => {
+                    let chart = { name: "REMONI_Chart", message: handle.title, data: null };
+                    this.messages.push(chart);
+                    this.updateChatText(chatbox);
+                    const width = chatbox.querySelector('.chatbox__messages').clientWidth || 600;
+                    fetch($SCRIPT_ROOT + handle.url + '&format=binary&width=' + width)
+                      .then(resp => resp.arrayBuffer())
+                      .then(buffer => {
+                          chart.data = decodeSeries(buffer)[handle.signal] || { t: [], v: [] };
+                          this.updateChatText(chatbox);
+                      })
+                      .catch(error => console.error('Series error:', error));
+                });
+            }
+
             // Handle show_list if it exists (for backwards compatibility)
             if ('show_list' in r && r.show_list && r.show_list.length > 0) {
                 console.log('showing image');
@@ -117,8 +205,21 @@ class Chatbox {
     }
 
 
+    // Re-render at most once per animation frame while tokens stream in
+    scheduleUpdate(chatbox) {
+        if (this.updatePending) {
+            return;
+        }
+        this.updatePending = true;
+        requestAnimationFrame(() => {
+            this.updatePending = false;
+            this.updateChatText(chatbox);
+        });
+    }
+
     updateChatText(chatbox) {
         var html = '';
+        var charts = [];
         this.messages.slice().reverse().forEach(function(item, index) {
             if (item.name === "REMONI")
             {
@@ -129,6 +230,11 @@ class Chatbox {
                 html += '<image src="' + item.message + '" class="messages__item messages__item--image--operator">'
 
             }
+            else if (item.name === "REMONI_Chart")
+            {
+                html += '<canvas data-chart="' + charts.length + '" class="messages__item messages__item--image--operator" width="600" height="300"></canvas>'
+                charts.push(item)
+            }
             else
             {
                 html += '<div class="messages__item messages__item--operator">' + item.message + '</div>'
@@ -137,6 +243,9 @@ class Chatbox {
 
         const chatmessage = chatbox.querySelector('.chatbox__messages');
         chatmessage.innerHTML = html;
+        chatmessage.querySelectorAll('canvas[data-chart]').forEach(canvas => {
+            drawChart(canvas, charts[Number(canvas.dataset.chart)]);
+        });
         const isScrolledToBottom = chatmessage.scrollHeight - chatmessage.clientHeight <= chatmessage.scrollTop + 1;
         if (isScrolledToBottom) {
         chatmessage.scrollTop = chatmessage.scrollHeight;
@@ -144,5 +253,70 @@ class Chatbox {
     }
 }
 
+// Decode the /api/series?format=binary payload (see series.encode_binary)
+function decodeSeries(buffer) {
+    const view = new DataView(buffer);
+    const decoder = new TextDecoder();
+    const series = {};
+    let offset = 6;
+    const nSeries = view.getUint16(offset, true); offset += 2;
+    for (let s = 0; s < nSeries; s++) {
+        const nameLength = view.getUint16(offset, true); offset += 2;
+        const name = decoder.decode(new Uint8Array(buffer, offset, nameLength)); offset += nameLength;
+        const n = view.getUint32(offset, true);
+        const t = new Float64Array(n);
+        const v = new Float32Array(n);
+        let time = view.getFloat64(offset + 8, true); offset += 16;
+        for (let i = 0; i < n; i++) {
+            if (i > 0) { time += view.getUint32(offset, true); offset += 4; }
+            t[i] = time;
+        }
+        for (let i = 0; i < n; i++) { v[i] = view.getFloat32(offset, true); offset += 4; }
+        series[name] = { t: t, v: v };
+    }
+    return series;
+}
+
+// Line chart on a canvas; timestamps are naive local times encoded as UTC epoch ms
+function drawChart(canvas, chart) {
+    const ctx = canvas.getContext('2d');
+    const pad = { left: 45, right: 10, top: 25, bottom: 30 };
+    const w = canvas.width - pad.left - pad.right;
+    const h = canvas.height - pad.top - pad.bottom;
+    ctx.fillStyle = '#fff';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    ctx.fillStyle = '#333';
+    ctx.font = 'bold 13px sans-serif';
+    ctx.fillText(chart.message, pad.left, 16);
+    ctx.font = '11px sans-serif';
+    if (!chart.data) { ctx.fillText('Loading...', pad.left, pad.top + h / 2); return; }
+    const { t, v } = chart.data;
+    if (t.length === 0) { ctx.fillText('No data', pad.left, pad.top + h / 2); return; }
+
+    let vMin = Infinity, vMax = -Infinity;
+    v.forEach(value => { vMin = Math.min(vMin, value); vMax = Math.max(vMax, value); });
+    if (vMax === vMin) { vMax += 1; vMin -= 1; }
+    const tMin = t[0], tSpan = Math.max(t[t.length - 1] - t[0], 1);
+    const x = time => pad.left + (time - tMin) / tSpan * w;
+    const y = value => pad.top + (1 - (value - vMin) / (vMax - vMin)) * h;
+
+    ctx.strokeStyle = '#ccc';
+    ctx.strokeRect(pad.left, pad.top, w, h);
+    ctx.fillText(vMax.toFixed(1), 2, pad.top + 4);
+    ctx.fillText(vMin.toFixed(1), 2, pad.top + h);
+    const label = time => new Date(time).toISOString().slice(5, 16).replace('T', ' ');
+    ctx.fillText(label(t[0]), pad.left, canvas.height - 10);
+    ctx.textAlign = 'right';
+    ctx.fillText(label(t[t.length - 1]), pad.left + w, canvas.height - 10);
+
+    ctx.strokeStyle = '#1f77b4';
+    ctx.lineWidth = 1.5;
+    ctx.beginPath();
+    for (let i = 0; i < t.length; i++) {
+        if (i === 0) ctx.moveTo(x(t[i]), y(v[i])); else ctx.lineTo(x(t[i]), y(v[i]));
+    }
+    ctx.stroke();
+}
+
 const chatbox = new Chatbox();
 chatbox.display();
\ No newline at end of file
@@ -0,0 +1,126 @@
+# test_frame_store.py
+import io
+import os
+
+import pytest
+
+from frame_store import INDEX_FILE, FrameStore, S3FrameBackend, shard_name
+
+
+class FakeS3Client():
+    """The part of the boto3 S3 client S3FrameBackend uses, backed by a dict"""
+
+    class exceptions():
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, page_size=2):
+        self.objects = {}  # (bucket, key) -> bytes
+        self.page_size = page_size
+        self.gets = 0
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        self.gets += 1
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def get_paginator(self, operation):
+        assert operation == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        for i in range(0, len(keys), self.page_size):
+            yield {'Contents': [{'Key': key} for key in keys[i:i + self.page_size]]}
+
+
+@pytest.fixture
+def backend():
+    return S3FrameBackend('frames-bucket', client=FakeS3Client())
+
+
+def test_shard_name():
+    assert shard_name('2026-03-31 23:59:59') == '2026_03'
+
+
+def test_backend_put_get(backend):
+    key = backend.key('00001', '2026_03', '000001.jpg')
+    assert key == 'frames/00001/2026_03/000001.jpg'
+    assert backend.get(key) is None
+    backend.put(key, b'jpeg')
+    assert backend.get(key) == b'jpeg'
+
+
+def test_backend_shards_lists_uploaded_indexes_only(backend):
+    backend.put(backend.key('00001', '2026_02', INDEX_FILE), b'')
+    backend.put(backend.key('00001', '2026_02', '000001.jpg'), b'a')
+    backend.put(backend.key('00001', '2026_03', '000001.jpg'), b'b')  # index not synced yet
+    backend.put(backend.key('00001', '2026_04', INDEX_FILE), b'')
+    backend.put(backend.key('00002', '2026_05', INDEX_FILE), b'')
+    assert backend.shards('00001') == ['2026_02', '2026_04']
+
+
+def test_frames_are_uploaded_and_indexes_synced(tmp_path, backend):
+    store = FrameStore(str(tmp_path), backend=backend)
+    record = store.add('00001', b'frame-1', '2026-03-01 10:00:00')
+    assert backend.get(backend.key('00001', '2026_03', os.path.basename(record['path']))) == b'frame-1'
+    assert backend.shards('00001') == []
+    store.sync()
+    assert backend.shards('00001') == ['2026_03']
+
+
+def test_fetch_on_miss(tmp_path, backend):
+    writer = FrameStore(str(tmp_path / 'writer'), backend=backend)
+    writer.add('00001', b'frame-1', '2026-02-28 23:50:00')
+    writer.add('00001', b'frame-2', '2026-03-01 10:00:00')
+    writer.add('00001', b'frame-3', '2026-03-01 10:05:00')
+    writer.sync()
+
+    # Another host with an empty root: indexes and frames come from the bucket
+    reader = FrameStore(str(tmp_path / 'reader'), backend=backend)
+    assert reader.shards('00001') == ['2026_02', '2026_03']
+    records = reader.nearest('00001', ['2026-03-01 10:04:00', '2026-03-01 00:05:00'])
+    assert [r['time_stamp'] for r in records] == ['2026-03-01 10:05:00', '2026-02-28 23:50:00']
+    assert not os.path.exists(records[0]['path'])
+    path = reader.local_path(records[0])
+    assert path == records[0]['path']
+    with open(path, 'rb') as f:
+        assert f.read() == b'frame-3'
+    assert reader.downloads == 1
+
+    # Downloaded once: the second lookup reads the local copy
+    gets = backend.client.gets
+    assert reader.local_path(records[0]) == path
+    assert backend.client.gets == gets
+    assert reader.latest('00001')['time_stamp'] == '2026-03-01 10:05:00'
+
+
+def test_fetch_on_miss_missing_object(tmp_path, backend):
+    reader = FrameStore(str(tmp_path), backend=backend)
+    record = {'patient_id': '00001', 'shard': '2026_03', 'path': os.path.join(str(tmp_path), '00001', '2026_03', '000009.jpg')}
+    assert reader.local_path(record) is None
+    assert reader.downloads == 0
+
+
+def test_fetch_on_miss_against_moto(tmp_path, monkeypatch):
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='frames-bucket')
+        backend = S3FrameBackend('frames-bucket', client=client)
+        writer = FrameStore(str(tmp_path / 'writer'), backend=backend)
+        writer.add('00001', b'frame-1', '2026-03-01 10:00:00')
+        writer.sync()
+
+        reader = FrameStore(str(tmp_path / 'reader'), backend=backend)
+        assert backend.get(backend.key('00001', '2026_03', '000099.jpg')) is None
+        record = reader.latest('00001')
+        with open(reader.local_path(record), 'rb') as f:
+            assert f.read() == b'frame-1'
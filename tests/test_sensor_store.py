@@ -0,0 +1,116 @@
+# test_sensor_store.py
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from sensor_store import PartitionLog, SensorStore, WriteCoalescer
+
+COLUMNS = ['time_stamp', 'heart_rate', 'steps']
+
+
+def rows(*samples):
+    return [{'time_stamp': time_stamp, 'heart_rate': heart_rate} for time_stamp, heart_rate in samples]
+
+
+def test_torn_last_line_is_truncated_on_open(tmp_path):
+    path = str(tmp_path / '2026-03-01.csv')
+    log = PartitionLog(path, COLUMNS)
+    log.append_many(rows(('2026-03-01 10:00:00', 70), ('2026-03-01 10:00:01', 71)))
+    log.close()
+    with open(path, 'ab') as f:
+        f.write(b'2026-03-01 10:00:02,7')  # process killed mid-write
+
+    log = PartitionLog(path, COLUMNS)
+    assert log.row_count == 2
+    assert log.latest_row['heart_rate'] == '71'
+    log.append(rows(('2026-03-01 10:00:03', 73))[0])
+    assert log.query()['heart_rate'].tolist() == [70, 71, 73]
+    log.close()
+    with open(path, 'rb') as f:
+        assert f.read().endswith(b'2026-03-01 10:00:03,73,\n')
+
+
+def test_header_only_torn_file_is_reset(tmp_path):
+    path = str(tmp_path / '2026-03-01.csv')
+    with open(path, 'wb') as f:
+        f.write(b'time_stamp,heart')
+    log = PartitionLog(path, COLUMNS)
+    assert log.row_count == 0
+    log.append(rows(('2026-03-01 10:00:00', 70))[0])
+    assert log.query()['heart_rate'].tolist() == [70]
+    log.close()
+
+
+def test_compaction_sorts_and_drops_malformed_rows(tmp_path):
+    path = str(tmp_path / '2026-03-01.csv')
+    log = PartitionLog(path, COLUMNS)
+    log.append_many(rows(('2026-03-01 10:00:02', 72), ('2026-03-01 10:00:00', 70)))
+    log._file.write(b'garbage,1,2\n')
+    log._file.flush()
+    log.append(rows(('2026-03-01 10:00:01', 71))[0])
+
+    log.compact()
+    assert log.row_count == 3
+    df = pd.read_csv(path)
+    assert df['heart_rate'].tolist() == [70, 71, 72]
+    assert log.query(pd.Timestamp('2026-03-01 10:00:01').value)['heart_rate'].tolist() == [71, 72]
+    log.append(rows(('2026-03-01 10:00:03', 73))[0])  # still appendable after the file was replaced
+    assert log.query()['heart_rate'].tolist() == [70, 71, 72, 73]
+    log.close()
+
+
+def test_legacy_schema_is_compacted_on_open(tmp_path):
+    path = str(tmp_path / '2026-03-01.csv')
+    with open(path, 'w') as f:
+        f.write('heart_rate,time_stamp\n71,2026-03-01 10:00:01\n70,2026-03-01 10:00:00\n')
+    log = PartitionLog(path, COLUMNS)
+    assert open(path).readline().strip() == ','.join(COLUMNS)
+    assert log.query()['heart_rate'].tolist() == [70, 71]
+    log.close()
+
+
+def test_store_routes_rows_to_day_partitions(tmp_path):
+    store = SensorStore(str(tmp_path), COLUMNS)
+    store.append_many('00001', rows(('2026-03-01 23:59:59', 70), ('2026-03-02 00:00:01', 71)))
+    assert store.partition_days('00001') == ['2026-03-01', '2026-03-02']
+    df = store.query('00001', ['heart_rate'], datetime(2026, 3, 1, 23), datetime(2026, 3, 2, 1))
+    assert df['heart_rate'].tolist() == [70, 71]
+    store.close()
+
+
+def test_invalid_patient_id_is_rejected(tmp_path):
+    store = SensorStore(str(tmp_path), COLUMNS)
+    with pytest.raises(ValueError):
+        store.append('../x', rows(('2026-03-01 10:00:00', 70))[0])
+    store.close()
+
+
+def test_coalescer_isolates_per_patient_failures(tmp_path):
+    store = SensorStore(str(tmp_path), COLUMNS)
+    coalescer = WriteCoalescer(store, max_rows=10**6, max_delay_ms=200)  # both submits land in one batch
+    errors = {}
+
+    def submit(patient_id, heart_rate):
+        try:
+            coalescer.submit(patient_id, rows(('2026-03-01 10:00:00', heart_rate)))
+            errors[patient_id] = None
+        except Exception as e:
+            errors[patient_id] = e
+
+    threads = [threading.Thread(target=submit, args=args) for args in (('bad/id', 1), ('00001', 70), ('00002', 80))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert isinstance(errors['bad/id'], ValueError)
+    assert errors['00001'] is None and errors['00002'] is None
+    assert store.query('00001')['heart_rate'].tolist() == [70]
+    assert store.query('00002')['heart_rate'].tolist() == [80]
+    assert coalescer.row_count == 2
+
+    # The failure does not stick to the next batch
+    coalescer.submit('00001', rows(('2026-03-01 10:00:01', 71)))
+    assert store.query('00001')['heart_rate'].tolist() == [70, 71]
+    store.close()
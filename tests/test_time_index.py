@@ -0,0 +1,65 @@
+# test_time_index.py
+import numpy as np
+import pandas as pd
+
+from time_index import TimeIndex, index_path, read_rows_at
+
+
+def ns(time_stamp):
+    return pd.Timestamp(time_stamp).value
+
+
+def test_range_offsets_inclusive():
+    index = TimeIndex([ns('2026-03-01 10:00'), ns('2026-03-01 10:01'), ns('2026-03-01 10:02')], [10, 20, 30])
+    assert index.range_offsets(ns('2026-03-01 10:01'), ns('2026-03-01 10:02')).tolist() == [20, 30]
+    assert index.range_offsets(None, ns('2026-03-01 10:00')).tolist() == [10]
+    assert index.range_offsets(ns('2026-03-01 10:03')).tolist() == []
+    assert index.range_offsets().tolist() == [10, 20, 30]
+
+
+def test_out_of_order_appends_are_sorted_on_lookup():
+    index = TimeIndex()
+    index.add([ns('2026-03-01 10:02'), ns('2026-03-01 10:00')], [30, 10])
+    index.add([ns('2026-03-01 10:01')], [20])
+    assert len(index) == 3
+    times, offsets = index.arrays()
+    assert np.all(times[1:] >= times[:-1])
+    assert offsets.tolist() == [10, 20, 30]
+
+
+def test_add_grows_past_initial_capacity():
+    index = TimeIndex()
+    for start in range(0, 3000, 500):
+        index.add(np.arange(start, start + 500), np.arange(start, start + 500) * 10)
+    assert len(index) == 3000
+    assert index.range_offsets(1000, 1002).tolist() == [10000, 10010, 10020]
+
+
+def test_nearest():
+    index = TimeIndex([100, 200, 300], [1, 2, 3])
+    times, offsets = index.nearest([90, 149, 151, 250, 1000])
+    assert times.tolist() == [100, 100, 200, 200, 300]  # ties go to the earlier row
+    assert offsets.tolist() == [1, 1, 2, 2, 3]
+
+
+def test_nearest_single_and_empty():
+    times, offsets = TimeIndex([100], [7]).nearest([0, 500])
+    assert offsets.tolist() == [7, 7]
+    times, offsets = TimeIndex().nearest([0])
+    assert len(times) == 0 and len(offsets) == 0
+
+
+def test_build_save_load(tmp_path):
+    path = str(tmp_path / '2026-03-01.csv')
+    with open(path, 'w') as f:
+        f.write('time_stamp,heart_rate\n2026-03-01 10:00:00,70\nnot a time,71\n2026-03-01 09:00:00,72\n')
+    index = TimeIndex.build(path)
+    assert len(index) == 2  # the malformed row is not indexed
+    df = read_rows_at(path, index.range_offsets(), ['time_stamp', 'heart_rate'])
+    assert df['heart_rate'].tolist() == [70, 72]  # file order; query_rows sorts by time
+
+    size = len(open(path, 'rb').read())
+    index.save(index_path(path), size)
+    loaded = TimeIndex.load(index_path(path), size)
+    assert loaded.arrays()[1].tolist() == index.arrays()[1].tolist()
+    assert TimeIndex.load(index_path(path), size + 1) is None  # stale: the file grew
@@ -0,0 +1,182 @@
+# time_index.py
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class TimeIndex():
+    """
+    Sorted int64 epoch index (nanoseconds, naive local time) over the rows of
+    one partition file, mapping each sample time to the byte offset of its line.
+
+    Appends in time order keep the arrays sorted for free; an out-of-order
+    append only marks the index dirty and the sort happens once, on the next
+    lookup. Range and nearest-sample lookups are np.searchsorted calls.
+    """
+
+    def __init__(self, times=None, offsets=None):
+        times = np.asarray(times if times is not None else [], dtype=np.int64)
+        offsets = np.asarray(offsets if offsets is not None else [], dtype=np.int64)
+        capacity = max(1024, len(times))
+        self._times = np.empty(capacity, dtype=np.int64)
+        self._offsets = np.empty(capacity, dtype=np.int64)
+        self._n = len(times)
+        self._times[:self._n] = times
+        self._offsets[:self._n] = offsets
+        self._sorted = bool(np.all(times[1:] >= times[:-1])) if self._n > 1 else True
+
+    def __len__(self):
+        return self._n
+
+    def add(self, times, offsets):
+        """Register appended rows (amortised O(1) per row)"""
+        times = np.asarray(times, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if not len(times):
+            return
+        needed = self._n + len(times)
+        if needed > len(self._times):
+            capacity = max(needed, 2 * len(self._times))
+            self._times = np.resize(self._times, capacity)
+            self._offsets = np.resize(self._offsets, capacity)
+        if self._sorted and (
+                (self._n and times[0] < self._times[self._n - 1]) or np.any(times[1:] < times[:-1])):
+            self._sorted = False
+        self._times[self._n:needed] = times
+        self._offsets[self._n:needed] = offsets
+        self._n = needed
+
+    def arrays(self):
+        """(times, offsets), sorted by time"""
+        if not self._sorted:
+            order = np.argsort(self._times[:self._n], kind='stable')
+            self._times[:self._n] = self._times[:self._n][order]
+            self._offsets[:self._n] = self._offsets[:self._n][order]
+            self._sorted = True
+        return self._times[:self._n], self._offsets[:self._n]
+
+    def range_offsets(self, start_ns=None, end_ns=None):
+        """Byte offsets of the rows with start_ns <= time <= end_ns"""
+        times, offsets = self.arrays()
+        lo = 0 if start_ns is None else np.searchsorted(times, start_ns, side='left')
+        hi = len(times) if end_ns is None else np.searchsorted(times, end_ns, side='right')
+        return offsets[lo:hi]
+
+    def nearest(self, targets_ns):
+        """For each target, (time, offset) of the closest row; empty index -> empty arrays"""
+        times, offsets = self.arrays()
+        targets_ns = np.asarray(targets_ns, dtype=np.int64)
+        if not len(times):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        pos = np.clip(np.searchsorted(times, targets_ns), 1, len(times) - 1) if len(times) > 1 \
+            else np.zeros(len(targets_ns), dtype=np.int64)
+        before = np.maximum(pos - 1, 0)
+        take_before = np.abs(targets_ns - times[before]) <= np.abs(times[pos] - targets_ns)
+        best = np.where(take_before, before, pos)
+        return times[best], offsets[best]
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def save(self, path, data_size):
+        """Persist next to the partition; data_size ties the index to the file it covers"""
+        times, offsets = self.arrays()
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'  # processes sharing the partition save concurrently
+        np.savez(tmp_path, times=times, offsets=offsets, data_size=np.int64(data_size))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, data_size):
+        """Load a persisted index, or None if missing or stale"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as saved:
+                if int(saved['data_size']) != data_size:
+                    return None
+                return cls(saved['times'], saved['offsets'])
+        except Exception:
+            return None
+
+    @classmethod
+    def build(cls, csv_path):
+        """Scan a partition CSV (header + one row per line) and index it"""
+        with open(csv_path, 'rb') as f:
+            header = f.readline()
+        if not header.endswith(b'\n'):
+            return cls()
+        times, offsets, _ = scan_rows(csv_path, len(header))
+        return cls(times, offsets)
+
+
+def scan_rows(csv_path, start):
+    """
+    (times, offsets, end) of the complete data lines from byte offset start on;
+    end is where the last complete line stops, so a line another process is
+    still writing is left for the next scan
+    """
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        data = f.read()
+    data = data[:data.rfind(b'\n') + 1]
+    if not data:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), start
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n'))
+    line_starts = np.concatenate(([0], newlines[:-1] + 1))
+    stamps = pd.read_csv(io.BytesIO(data), header=None, usecols=[0], dtype=str, skip_blank_lines=False).iloc[:, 0]
+    if len(stamps) != len(line_starts):
+        stamps = pd.Series([data[o:data.find(b',', o, e)].decode('utf-8')
+                            for o, e in zip(line_starts, newlines)])
+    times = pd.to_datetime(stamps, errors='coerce', format='mixed')
+    valid = times.notna().to_numpy()
+    return (times[valid].astype('datetime64[ns]').astype(np.int64).to_numpy(),
+            start + line_starts[valid], start + len(data))
+
+
+def index_path(csv_path):
+    return csv_path[:-4] + '.idx.npz' if csv_path.endswith('.csv') else csv_path + '.idx.npz'
+
+
+def read_rows_at(csv_path, offsets, columns):
+    """Read the CSV lines starting at the given byte offsets into a DataFrame"""
+    if not len(offsets):
+        return pd.DataFrame(columns=columns)
+    first, last = int(np.min(offsets)), int(np.max(offsets))
+    with open(csv_path, 'rb') as f:
+        f.seek(last)
+        f.readline()
+        end = f.tell()
+        f.seek(first)
+        chunk = f.read(end - first)
+    if chunk.count(b'\n') != len(offsets):
+        # Rows of the window are not contiguous on disk: keep only the requested lines
+        lines = chunk.split(b'\n')[:-1]
+        starts = first + np.concatenate(([0], np.cumsum([len(line) + 1 for line in lines])[:-1]))
+        wanted = set(np.asarray(offsets).tolist())
+        chunk = b'\n'.join(line for line, start in zip(lines, starts) if int(start) in wanted) + b'\n'
+    return pd.read_csv(io.BytesIO(chunk), names=columns, header=None)
+
+
+# ==================== Benchmark ====================
+if __name__ == '__main__':
+    import time
+
+    n_rows = 50_000_000
+    start_ns = pd.Timestamp('2026-01-01').value
+    times = start_ns + np.arange(n_rows, dtype=np.int64) * 1_000_000_000  # 1 Hz for ~579 days
+    index = TimeIndex(times, np.arange(n_rows, dtype=np.int64) * 120)
+
+    rng = np.random.default_rng(0)
+    queries = rng.integers(times[0], times[-1], size=10_000)
+    begin = time.perf_counter()
+    for q in queries:
+        index.range_offsets(q, q + 600 * 1_000_000_000)  # 10-minute window
+    range_us = (time.perf_counter() - begin) / len(queries) * 1e6
+
+    begin = time.perf_counter()
+    for q in queries:
+        index.nearest([q])
+    nearest_us = (time.perf_counter() - begin) / len(queries) * 1e6
+    print(f"{n_rows:,} rows: range lookup {range_us:.1f} µs, nearest lookup {nearest_us:.1f} µs")
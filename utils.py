@@ -1,10 +1,10 @@
 import re
 from config import vital_sign_var_to_text
-import matplotlib
-matplotlib.use('Agg')  # For headless plotting
-import matplotlib.pyplot as plt
-from collections import defaultdict
-import os
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # For headless plotting
+import numpy as np
+import pandas as pd
+from time_index import TimeIndex
 
 # -------------------------------
 # Helper Functions
@@ -14,80 +14,157 @@ def combine_data_and_time(list_date, list_time):
     """Combine lists of dates and times into full timestamps"""
     time_stamp_list = []
     for date in list_date:
-        for time in list_time:
-            time_stamp = f'{date} {time}'
+        for time_of_day in list_time:
+            time_stamp = f'{date} {time_of_day}'
             time_stamp_list.append(time_stamp)
     return time_stamp_list
 
-def get_serial_path(data_folder_path):
-    """Generate new sequential filename for images"""
-    files = os.listdir(data_folder_path)
-    image_files = [f for f in files if f.endswith('.jpg') and f[:-4].isdigit()]
-    indices = [int(f.split('.')[0]) for f in image_files]
-    max_index = max(indices) if indices else 0
-    new_index = max_index + 1
-    new_filename = f"{new_index:02d}.jpg"
-    return os.path.join(data_folder_path, new_filename)
-
 def extract_patient_id_from_text(text):
     """Extract patient ID from text"""
     pattern = r"\d{5}"
     match = re.search(pattern, text)
     return match.group(0) if match else 'unknown'
 
-def filter_raw_df(df, intent_dict, is_current):
-    """Filter dataframe based on user intent"""
+def filter_raw_df(df, intent_dict, is_current, tolerance_minutes=15):
+    """
+    Filter dataframe based on user intent.
+    Historical slots are matched to the nearest sample (within tolerance) with a
+    binary search over the sorted timestamps rather than exact string matches.
+    """
     if df.empty:
         return df
 
-    if not is_current:
-        time_stamp_list = combine_data_and_time(intent_dict['list_date'], intent_dict['list_time'])
-    else:
-        time_stamp_list = [df['time_stamp'].iloc[0]]  # current data
-
     columns = ['time_stamp'] + intent_dict['vital_sign']
-    filtered_df = df[columns]
-
-    filtered_df = filtered_df[filtered_df['time_stamp'].isin(time_stamp_list)].reset_index(drop=True)
+    times = pd.to_datetime(df['time_stamp'], format='mixed').astype('datetime64[ns]').to_numpy().astype(np.int64)
+    index = TimeIndex(times, np.arange(len(df)))
+
+    if is_current:
+        positions = index.arrays()[1][-1:]  # current data = latest sample
+        return df[columns].iloc[positions].reset_index(drop=True)
+
+    time_stamp_list = combine_data_and_time(intent_dict['list_date'], intent_dict['list_time'])
+    targets = pd.to_datetime(pd.Series(time_stamp_list), format='mixed').astype('datetime64[ns]').to_numpy().astype(np.int64)
+    nearest_times, positions = index.nearest(targets)
+    within = np.abs(nearest_times - targets) <= tolerance_minutes * 60 * 10**9
+    filtered_df = df[columns].iloc[positions[within]].drop_duplicates().reset_index(drop=True)
     return filtered_df
 
-def df_to_text(df, intent_dict):
-    """Convert dataframe into readable text"""
+def df_to_text(df, intent_dict, resolution=None, max_rows=200, max_tokens=None, summarize='bucket'):
+    """
+    Convert dataframe into readable text.
+    Rows are formatted column-wise and joined once. If the window has more rows
+    than the budget (max_rows, or the rows that fit in max_tokens) it is first
+    reduced: 'bucket' aggregates into equal time buckets (mean/min/max), 'lttb'
+    keeps the rows that best preserve the shape of the first vital sign.
+    """
     if df.empty:
         return "No data available"
+    if resolution:
+        return rollup_to_text(df, intent_dict, resolution)
+
+    vital_signs = [v for v in intent_dict['vital_sign'] if v in df.columns]
+    if len(df) > _row_budget(len(vital_signs), max_rows, max_tokens):
+        if summarize == 'lttb' and vital_signs:
+            df = df.iloc[lttb_indices(df, vital_signs[0], _row_budget(len(vital_signs), max_rows, max_tokens))]
+        else:
+            n_buckets = _row_budget(len(vital_signs), max_rows, max_tokens, chars_per_value=28)
+            return rollup_to_text(bucket_aggregate(df, vital_signs, n_buckets),
+                                  {'vital_sign': vital_signs}, f'{len(df)} samples in {n_buckets} buckets')
 
-    text = ''
     title_row = 'Timestamp (Year-Month-Day Hour:Minute:Second)'
-
-    for vital_sign in intent_dict['vital_sign']:
+    for vital_sign in vital_signs:
         title_row += f', {vital_sign_var_to_text.get(vital_sign, vital_sign)}'
 
-    text += f'{title_row} \n'
-
-    for i in range(len(df)):
-        row_text = str(df.iloc[i]['time_stamp'])
-        for vital_sign in intent_dict['vital_sign']:
-            row_text += f', {df.iloc[i][vital_sign]}'
-        text += f'{row_text} \n'
+    rows = df['time_stamp'].astype(str)
+    for vital_sign in vital_signs:
+        rows = rows + ', ' + df[vital_sign].astype(str)
+    return f'{title_row} \n' + ''.join(row + ' \n' for row in rows)
+
+def _row_budget(n_vital_signs, max_rows=200, max_tokens=None, chars_per_value=8):
+    """Rows that fit the budget; a row is ~26 timestamp chars + chars_per_value per value, ~4 chars per token"""
+    budget = max_rows or float('inf')
+    if max_tokens:
+        tokens_per_row = (26 + chars_per_value * max(n_vital_signs, 1)) / 4
+        budget = min(budget, max_tokens / tokens_per_row)
+    return max(int(budget), 2) if budget != float('inf') else 2**63 - 1
+
+def bucket_aggregate(df, vital_signs, n_buckets):
+    """Aggregate rows into n_buckets equal time buckets with <vital>_mean/_min/_max/_count columns"""
+    times = pd.to_datetime(df['time_stamp'], format='mixed')
+    t = times.astype('datetime64[ns]').to_numpy().astype(np.int64)
+    lo, hi = t.min(), t.max()
+    width = max((hi - lo) // n_buckets + 1, 1)
+    bucket = (t - lo) // width
+    grouped = df[vital_signs].apply(pd.to_numeric, errors='coerce').groupby(bucket)
+    out = grouped.agg(['mean', 'min', 'max', 'count'])
+    out.columns = [f'{vital}_{stat}' for vital, stat in out.columns]
+    out.insert(0, 'time_stamp', pd.to_datetime(lo + out.index.to_numpy() * width))
+    return out.reset_index(drop=True)
+
+def lttb_indices(df, column, n_out):
+    """Largest-Triangle-Three-Buckets: positions of n_out rows that preserve the series' shape"""
+    y = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+    x = pd.to_datetime(df['time_stamp'], format='mixed').astype('datetime64[ns]').to_numpy().astype(np.int64)
+    valid = np.flatnonzero(~np.isnan(y))
+    return valid[lttb(x[valid], y[valid], n_out)]
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets over sorted x: indices of n_out points that preserve the shape"""
+    if len(x) <= n_out:
+        return np.arange(len(x))
+    if n_out < 3:
+        return np.arange(min(n_out, len(x)))
+    x = (np.asarray(x) - x[0]).astype(float)
+    y = np.asarray(y, dtype=float)
+
+    edges = np.linspace(1, len(x) - 1, n_out - 1).astype(np.int64)
+    selected = [0]
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else len(x)
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        a = selected[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        selected.append(start + int(np.argmax(area)))
+    selected.append(len(x) - 1)
+    return np.array(selected)
+
+def rollup_to_text(df, intent_dict, resolution):
+    """Convert a rollup dataframe (<vital>_mean/_min/_max/_count columns) into readable text"""
+    title_row = f'Period start (Year-Month-Day Hour:Minute:Second), {resolution} aggregates'
+    for vital_sign in intent_dict['vital_sign']:
+        title_row += f', {vital_sign_var_to_text.get(vital_sign, vital_sign)} mean (min-max, samples)'
 
-    return text
+    rows = df['time_stamp'].astype(str)
+    for vital_sign in intent_dict['vital_sign']:
+        if f'{vital_sign}_mean' not in df.columns:
+            continue
+        cell = (df[f'{vital_sign}_mean'].round(2).astype(str) + ' (' +
+                df[f'{vital_sign}_min'].round(2).astype(str) + '-' +
+                df[f'{vital_sign}_max'].round(2).astype(str) + ', ' +
+                df[f'{vital_sign}_count'].astype(str) + ')')
+        cell = cell.where(df[f'{vital_sign}_count'] > 0, 'no data')
+        rows = rows + ', ' + cell
+    return f'{title_row} \n' + ''.join(row + ' \n' for row in rows)
 
 def plot_vital_sign(df, vital_sign):
-    """Plot vital sign data"""
+    """Plot vital sign data (Figure API on an Agg canvas; no pyplot global state)"""
     if df.shape[0] <= 20:
         df_sampled = df
     else:
         sample_rate = len(df) // 20
         df_sampled = df.iloc[::sample_rate].copy()
 
-    figure = plt.figure(figsize=(7,5))
+    figure = Figure(figsize=(7,5))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
     x = df_sampled['time_stamp']
     y = df_sampled[vital_sign]
-    plt.plot(x, y)
-    plt.xticks(rotation=90)
+    ax.plot(x, y)
+    ax.tick_params(axis='x', labelrotation=90)
     save_path = f'./static/local_data/show_data/plot_{vital_sign}.png'
     figure.savefig(save_path, bbox_inches='tight')
-    plt.close(figure)
     return save_path
 
 def extract_unique_year_month(date_list):
@@ -95,14 +172,20 @@ def extract_unique_year_month(date_list):
     year_month_set = {date[:7].replace('-', '_') for date in date_list}
     return sorted(list(year_month_set))
 
-def process_key_to_retrieve_image(timestamp_list):
-    """Group timestamps for S3 retrieval"""
-    grouped_timestamps = defaultdict(list)
-    for timestamp in timestamp_list:
-        date, time = timestamp.split(' ')
-        year, month, day = date.split('-')
-        year_month = f'{year}_{month}'
-        day_time = f'{day}_{time.replace(":", "_")}'
-        day_time = day_time[:-3]  # remove seconds
-        grouped_timestamps[year_month].append(day_time)
-    return dict(grouped_timestamps)
+
+# ==================== Benchmark ====================
+if __name__ == '__main__':
+    import time
+
+    intent = {'vital_sign': ['heart_rate', 'steps']}
+    for n_rows in (1_000, 100_000, 1_000_000):
+        df = pd.DataFrame({
+            'time_stamp': pd.date_range('2026-01-01', periods=n_rows, freq='s').astype(str),
+            'heart_rate': np.random.default_rng(0).normal(75, 5, n_rows).round(1),
+            'steps': np.arange(n_rows),
+        })
+        for summarize in ('bucket', 'lttb'):
+            start = time.perf_counter()
+            text = df_to_text(df, intent, max_tokens=2000, summarize=summarize)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            print(f"{n_rows:>9,} rows [{summarize:6}]: {elapsed_ms:8.1f} ms, {len(text):,} chars")
@@ -0,0 +1,146 @@
+# vision_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from image_pipeline import dhash, hamming
+
+HASH_BITS = 64
+
+
+class VisionCache():
+    """
+    Vision model descriptions cached by perceptual hash of the frames described.
+
+    Each frame is reduced to a 64-bit dHash (memoized by path + mtime + size).
+    A call whose frames are each within threshold bits (Hamming distance) of the
+    frames of a cached call reuses its description instead of sending the frames
+    to the model again. Near-duplicates are found without scanning every entry:
+    the first frame's hash is split into threshold + 1 bands, and two hashes at
+    most threshold bits apart must agree exactly on at least one band, so only
+    entries sharing a band are compared. Entries expire after ttl seconds and
+    the least recently used are evicted beyond max_entries.
+    """
+
+    def __init__(self, threshold=5, max_entries=1000, ttl=3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (context, hashes) -> {'description', 'expires'}
+        self._bands = {}  # (context, band, bits) -> set(keys)
+        self._hashes = OrderedDict()  # (path, mtime_ns, size) -> dHash
+        self._lock = threading.Lock()
+        n_bands = threshold + 1
+        self._band_bounds = [(i * HASH_BITS // n_bands, (i + 1) * HASH_BITS // n_bands) for i in range(n_bands)]
+
+    # -------------------------------
+    # Hashes
+    # -------------------------------
+    def frame_hash(self, path):
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if key in self._hashes:
+                self._hashes.move_to_end(key)
+                return self._hashes[key]
+        value = dhash(path)
+        with self._lock:
+            self._hashes[key] = value
+            if len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
+        return value
+
+    def _band_keys(self, context, value):
+        return [(context, i, (value >> lo) & ((1 << (hi - lo)) - 1)) for i, (lo, hi) in enumerate(self._band_bounds)]
+
+    # -------------------------------
+    # Cache
+    # -------------------------------
+    def get(self, hashes, context=''):
+        """Cached description for frames with these hashes (or near-duplicates of them), else None"""
+        hashes = tuple(hashes)
+        key = (context, hashes)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires'] > now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry['description']
+            best, best_distance = None, None
+            for band_key in self._band_keys(context, hashes[0]) if hashes else ():
+                for candidate in self._bands.get(band_key, ()):
+                    other = candidate[1]
+                    if len(other) != len(hashes):
+                        continue
+                    distances = [hamming(a, b) for a, b in zip(hashes, other)]
+                    if max(distances) <= self.threshold and self._entries[candidate]['expires'] > now \
+                            and (best is None or sum(distances) < best_distance):
+                        best, best_distance = candidate, sum(distances)
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.near_hits += 1
+            return self._entries[best]['description']
+
+    def put(self, hashes, description, context=''):
+        hashes = tuple(hashes)
+        key = (context, hashes)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {'description': description, 'expires': time.time() + self.ttl}
+            if hashes:
+                for band_key in self._band_keys(context, hashes[0]):
+                    self._bands.setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        context, hashes = key
+        if hashes:
+            for band_key in self._band_keys(context, hashes[0]):
+                keys = self._bands.get(band_key)
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band_key]
+
+    def describe(self, image_paths, describe_fn, context=''):
+        """
+        Description of the frames: cached (exact or near-duplicate) or from
+        describe_fn(image_paths), which is cached unless it returned an error text
+        """
+        hashes = [self.frame_hash(path) for path in image_paths]
+        description = self.get(hashes, context)
+        if description is not None:
+            return description
+        description = describe_fn(image_paths)
+        if description and not description.startswith(('Error:', 'HTTP error:', 'No response')):
+            self.put(hashes, description, context)
+        return description
+
+    # -------------------------------
+    # Stats
+    # -------------------------------
+    def stats(self):
+        hits = self.exact_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'threshold_bits': self.threshold,
+            'lookups': lookups,
+            'exact_hits': self.exact_hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'saved_calls': hits,
+            'hit_rate': round(hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+        }